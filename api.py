@@ -0,0 +1,291 @@
+"""
+JSON lookup API for programmatic clients
+
+Results are returned as structured JSON with English field names instead of
+the display dicts the web page uses: industries become a list of objects
+rather than the ``**bold**`` multi-line string, and missing fields are null.
+
+Small batches are looked up inline (``POST /api/lookup``); larger ones run as
+a regular durable job (``POST /api/jobs``) whose results are fetched later,
+all at once or a page at a time (sorted/filtered, with an opaque cursor).
+``POST /api/refresh`` re-checks a portfolio and returns only what changed.
+"""
+import asyncio
+import base64
+import csv
+import io
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from crawler import afetch_tax_info
+from ingest import TAX_CODE_COLUMN
+from job_store import JobStore, sort_position
+from jobs import create_job, save_upload
+from refresh import REFRESH_CONCURRENCY, refresh_tax_codes
+from tax_code import DedupStats, InvalidTaxCode, normalize_tax_code
+from tax_parser import parse_industries
+
+
+# Most codes /api/lookup answers inline; bigger batches must use /api/jobs
+API_SYNC_MAX_CODES = int(os.environ.get("API_SYNC_MAX_CODES", "50"))
+
+# Concurrent fetches per /api/jobs batch
+API_JOB_BATCH_SIZE = int(os.environ.get("API_JOB_BATCH_SIZE", os.environ.get("DEFAULT_BATCH_SIZE", "3")))
+
+# Rows per results page (default and most a client may ask for)
+RESULTS_PAGE_SIZE = int(os.environ.get("RESULTS_PAGE_SIZE", "50"))
+RESULTS_MAX_PAGE_SIZE = int(os.environ.get("RESULTS_MAX_PAGE_SIZE", "500"))
+
+# Result dict key -> API field name
+API_FIELDS = [
+    ("MST", "tax_code"),
+    ("Tên", "name"),
+    ("Địa chỉ thuế", "tax_address"),
+    ("Địa chỉ", "address"),
+    ("Tình trạng", "status"),
+    ("Người đại diện", "representative"),
+    ("Điện thoại", "phone"),
+    ("Ngày hoạt động", "start_date"),
+    ("Quản lý bởi", "managed_by"),
+    ("Loại hình DN", "business_type"),
+]
+
+# API field name -> result dict key, for sorting and filtering result pages
+RESULT_KEYS = {name: key for key, name in API_FIELDS}
+
+
+def to_api_result(info: Dict, query: Optional[str] = None) -> Dict:
+    """
+    Convert a result dict to the API's structured form
+
+    Args:
+        info: Result dict as produced by fetch_tax_info / stored in the job store
+        query: The code as the client sent it
+
+    Returns:
+        Dict with the API_FIELDS names, ``industries`` as a list of
+        {code, name, detail, main} objects and ``error`` (null on success)
+    """
+    result = {"query": query if query is not None else info.get("MST")}
+    for key, name in API_FIELDS:
+        result[name] = info.get(key) or None
+    result["industries"] = [
+        {"code": ind["Mã ngành"], "name": ind["Ngành"], "detail": ind["Chi tiết"] or None, "main": ind["Đậm"]}
+        for ind in parse_industries(info.get("Ngành nghề kinh doanh", ""))
+    ]
+    result["error"] = info.get("Error") or None
+    return result
+
+
+async def lookup_codes(codes: List[str], force_refresh: bool = False) -> Tuple[List[Dict], DedupStats]:
+    """
+    Look up a small batch of codes on the event loop
+
+    Invalid codes are answered without a fetch and each unique code is
+    fetched once; concurrent lookups of the same code (from this or other
+    requests) share one upstream fetch.
+
+    Args:
+        codes: Tax codes as sent by the client
+        force_refresh: Skip the result cache and re-fetch from upstream
+
+    Returns:
+        (API results in input order, de-duplication counters)
+    """
+    stats = DedupStats()
+    normalized: List[Optional[str]] = []
+    errors: Dict[int, str] = {}
+    unique: Dict[str, None] = {}
+    for row, raw in enumerate(codes):
+        stats.rows += 1
+        try:
+            code = normalize_tax_code(raw)
+        except InvalidTaxCode as e:
+            stats.invalid += 1
+            normalized.append(None)
+            errors[row] = str(e)
+            continue
+        if code in unique:
+            stats.duplicates += 1
+        else:
+            stats.unique += 1
+            unique[code] = None
+        normalized.append(code)
+
+    fetched = await asyncio.gather(*(afetch_tax_info(code, force_refresh=force_refresh) for code in unique))
+    by_code = dict(zip(unique, fetched))
+
+    results = []
+    for row, raw in enumerate(codes):
+        code = normalized[row]
+        info = by_code[code] if code is not None else {"MST": str(raw).strip(), "Error": errors[row]}
+        results.append(to_api_result(info, query=raw))
+    return results, stats
+
+
+def submit_lookup_job(job_id: str, codes: List[str], force_refresh: bool = False):
+    """
+    Create a durable job for a large batch (run it with jobs.start_job)
+
+    The codes are saved as a one-column CSV upload, so the job is resumable
+    like any uploaded file and its result rows line up with `codes`.
+    """
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow([TAX_CODE_COLUMN])
+    writer.writerows([code] for code in codes)
+    path = save_upload(io.BytesIO(text.getvalue().encode("utf-8")), job_id, "codes.csv")
+    create_job(job_id, path, "codes.csv", API_JOB_BATCH_SIZE, force_refresh)
+
+
+def to_api_change(result: Dict) -> Dict:
+    """
+    Convert a refresh result (refresh.refresh_tax_code) to the API's form
+
+    Changed fields are keyed by their API names; an industries change is
+    given as the old and new lists of industry objects.
+    """
+    names = dict(API_FIELDS)
+    changes = {}
+    for field, change in result["changes"].items():
+        if field == "Ngành nghề kinh doanh":
+            changes["industries"] = {
+                side: to_api_result({"Ngành nghề kinh doanh": value or ""})["industries"]
+                for side, value in change.items()
+            }
+        else:
+            changes[names.get(field, "error" if field == "Error" else field)] = change
+    return {
+        "tax_code": result["MST"],
+        "status": result["status"],
+        "changes": changes,
+        "result": to_api_result(result["info"]),
+    }
+
+
+async def refresh_codes(codes: List[str], force_refresh: bool = False) -> Tuple[List[Dict], Dict[str, int]]:
+    """
+    Re-check codes against their stored fingerprints (see refresh.py)
+
+    Runs on a worker thread; invalid codes are counted as errors without a request.
+
+    Returns:
+        (API changes for new and changed records in input order, count of checks per status)
+    """
+    valid: Dict[str, None] = {}
+    invalid = 0
+    for raw in codes:
+        try:
+            valid[normalize_tax_code(raw)] = None
+        except InvalidTaxCode:
+            invalid += 1
+
+    changed, counts = await asyncio.to_thread(
+        refresh_tax_codes, list(valid), REFRESH_CONCURRENCY, force_refresh=force_refresh
+    )
+    counts["error"] += invalid
+    return [to_api_change(result) for result in changed], counts
+
+
+def iter_json_array(results: Iterable[Tuple[int, Dict]]) -> Iterator[str]:
+    """Stream stored (index, result) rows as a JSON array of API results"""
+    yield "["
+    for n, (_, info) in enumerate(results):
+        yield ("," if n else "") + json.dumps(to_api_result(info), ensure_ascii=False)
+    yield "]"
+
+
+def encode_cursor(sort: str, descending: bool, position: Tuple[str, int], total: Optional[int] = None) -> str:
+    """Opaque cursor for the row after `position` in a listing of `total` rows"""
+    data = json.dumps([sort, descending, *position, total], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, descending: bool) -> Tuple[Tuple[str, int], Optional[int]]:
+    """
+    Position a cursor points after, and the listing's total when the cursor carries it
+
+    Raises:
+        ValueError: Malformed cursor, or one from a listing with another order
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, cursor_descending, value, index, *rest = json.loads(data)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    total = rest[0] if rest else None
+    if (cursor_sort, cursor_descending) != (sort, descending) or not isinstance(value, str) \
+            or not isinstance(index, int) or not (total is None or isinstance(total, int)):
+        raise ValueError("Cursor does not belong to this sort order")
+    return (value, index), total
+
+
+def results_page(
+    job_store: JobStore,
+    job_id: str,
+    cursor: Optional[str] = None,
+    limit: int = RESULTS_PAGE_SIZE,
+    sort: str = "index",
+    descending: bool = False,
+    filters: Optional[Dict[str, str]] = None,
+    errors: Optional[bool] = None
+) -> Dict:
+    """
+    One page of a job's results as API results
+
+    Pages are read with keyset pagination, so rows stored while paging (a
+    running job) are neither skipped nor repeated before the cursor. The
+    matching rows are counted on the first page only and the count rides
+    along in the cursor, so later pages just read their rows.
+
+    Args:
+        job_store: Store holding the job
+        job_id: The job
+        cursor: next_cursor of the previous page (None for the first page)
+        limit: Rows per page (capped at RESULTS_MAX_PAGE_SIZE)
+        sort: "index" (input order) or an API field name
+        descending: Reverse the order
+        filters: {API field name: text}; each field must contain its text (case-insensitive)
+        errors: True for failed rows only, False for successful rows only
+
+    Returns:
+        {"results": [API results with their input "index"], "total" (rows
+        matching the filters when the first page was read), "next_cursor"
+        (None on the last page)}
+
+    Raises:
+        ValueError: Unknown sort or filter field, a bad cursor, or a query the
+            store cannot run on a job this large
+    """
+    if sort != "index" and sort not in RESULT_KEYS:
+        raise ValueError(f"Cannot sort by '{sort}'")
+    unknown = [name for name in filters or {} if name not in RESULT_KEYS]
+    if unknown:
+        raise ValueError(f"Cannot filter by '{unknown[0]}'")
+    key = RESULT_KEYS.get(sort)
+    after, total = decode_cursor(cursor, sort, descending) if cursor else (None, None)
+    limit = max(1, min(limit, RESULTS_MAX_PAGE_SIZE))
+
+    # One extra row tells whether there is a next page
+    rows, counted = job_store.query_results(
+        job_id,
+        filters={RESULT_KEYS[name]: text for name, text in (filters or {}).items() if text},
+        errors=errors,
+        sort=key,
+        descending=descending,
+        after=after,
+        limit=limit + 1,
+        count=total is None
+    )
+    total = counted if total is None else total
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        idx, info = rows[-1]
+        next_cursor = encode_cursor(sort, descending, sort_position(info, idx, key), total)
+    return {
+        "results": [{"index": idx, **to_api_result(info)} for idx, info in rows],
+        "total": total,
+        "next_cursor": next_cursor,
+    }
@@ -2,23 +2,117 @@
 FastAPI web application for tax information crawler
 """
 import io
+import os
 import asyncio
 import json
-from typing import Dict, List
-from fastapi import FastAPI, Request, UploadFile, File, Form
-from fastapi.responses import HTMLResponse, StreamingResponse
+import logging
+import tempfile
+from typing import Dict, List, Optional, Union
+from fastapi import Body, FastAPI, Query, Request, UploadFile, File, Form
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-import pandas as pd
-
-from crawler import crawl_tax_code, crawl_multiple_tax_codes
+from starlette.background import BackgroundTask
+
+from api import (
+    API_SYNC_MAX_CODES, RESULTS_MAX_PAGE_SIZE, RESULTS_PAGE_SIZE, iter_json_array, lookup_codes, refresh_codes,
+    results_page, submit_lookup_job, to_api_result
+)
+import metrics
+from cache import get_cache
+from company_index import SEARCH_MAX_PAGE_SIZE, SEARCH_PAGE_SIZE, get_company_index
+from crawler import afetch_tax_info
+from events import publish_progress, stream_events, wait_for_final
+from exports import (
+    EXPORT_FORMATS, STREAM_FORMATS, ExportError, export_csv, export_parquet, export_xlsx, tail_results
+)
+from http_client import close_async_client, upstream_host
+from ingest import IngestError, normalize_code, open_tax_codes
+from job_store import get_job_store
+from logs import configure_logging
+from preload import preload_in_background
+from jobs import USE_WORK_QUEUE, cleanup_uploads, create_job, resume_job, resume_orphaned_jobs, save_upload, start_job
+from scheduler import get_scheduler
+import singleflight
+from tax_code import InvalidTaxCode, normalize_tax_code
+from throttle import get_throttle
 
 app = FastAPI(title="Tax Information Crawler")
 
+logger = logging.getLogger("app")
+
 # Setup templates
 templates = Jinja2Templates(directory="templates")
 
-# Global progress storage (in production, use Redis or similar)
-progress_store: Dict[str, Dict] = {}
+# Number of concurrent fetches per crawl job
+DEFAULT_BATCH_SIZE = int(os.environ.get("DEFAULT_BATCH_SIZE", "3"))
+
+# Seconds between sweeps of expired jobs from the job store
+JOB_CLEANUP_INTERVAL = int(os.environ.get("JOB_CLEANUP_INTERVAL", "600"))
+
+# Seconds between checks for unfinished jobs whose runner has died
+JOB_RESUME_INTERVAL = int(os.environ.get("JOB_RESUME_INTERVAL", "30"))
+
+
+@app.on_event("startup")
+async def setup_logging():
+    """Structured logs (LOG_FORMAT, LOG_LEVEL) for the app and crawler modules"""
+    configure_logging()
+
+
+@app.on_event("startup")
+async def start_job_cleanup():
+    """Periodically drop expired jobs from the job store (and their leftovers in the work queue)"""
+    async def cleanup_loop():
+        while True:
+            try:
+                removed = await asyncio.to_thread(get_job_store().cleanup_expired)
+                if removed:
+                    logger.info("jobs_expired", extra={"removed": removed})
+                if USE_WORK_QUEUE:
+                    from work_queue import get_work_queue
+                    removed = await asyncio.to_thread(get_work_queue().cleanup_expired)
+                    if removed:
+                        logger.info("work_tasks_expired", extra={"removed": removed})
+                await asyncio.to_thread(cleanup_uploads)
+            except Exception:
+                logger.exception("cleanup_failed")
+            await asyncio.sleep(JOB_CLEANUP_INTERVAL)
+
+    asyncio.create_task(cleanup_loop())
+
+
+@app.on_event("startup")
+async def start_job_resume():
+    """Resume unfinished jobs left by a crashed or restarted process (now and periodically)"""
+    async def resume_loop():
+        while True:
+            try:
+                resumed = await asyncio.to_thread(resume_orphaned_jobs)
+                if resumed:
+                    logger.info("jobs_resumed", extra={"job_ids": resumed})
+            except Exception:
+                logger.exception("resume_failed")
+            await asyncio.sleep(JOB_RESUME_INTERVAL)
+
+    asyncio.create_task(resume_loop())
+
+
+@app.on_event("startup")
+async def start_preload():
+    """Import the lazily loaded parsing/export dependencies once the app is serving"""
+    preload_in_background()
+
+
+@app.on_event("shutdown")
+async def close_http_client():
+    """Drop the async client's pooled upstream connections"""
+    await close_async_client()
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness check: the app is up and serving (touches no dependency)"""
+    return {"status": "ok"}
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -27,17 +121,51 @@ async def home(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 
+def store_single_result(session_id: str, result: Dict):
+    """Save a single lookup as a completed one-row job"""
+    get_job_store().add_result(session_id, 0, result)
+    publish_progress(session_id, {
+        'status': 'completed',
+        'total': 1,
+        'completed': 1,
+        'message': 'Crawling completed!',
+        'percentage': 100
+    })
+
+
+def check_upload(path: str, filename: str):
+    """Read an upload's header and first code (raises IngestError)"""
+    open_tax_codes(open(path, "rb"), filename).close()
+
+
 @app.post("/crawl")
-async def crawl_single(request: Request, tax_code: str = Form(...)):
+async def crawl_single(request: Request, tax_code: str = Form(...), force_refresh: bool = Form(False)):
     """Crawl a single tax code"""
     try:
-        result = crawl_tax_code(tax_code)
+        try:
+            normalized = normalize_tax_code(tax_code)
+        except InvalidTaxCode as e:
+            return templates.TemplateResponse(
+                "index.html",
+                {"request": request, "error": str(e), "tax_code": tax_code}
+            )
+
+        # Fetched on the event loop (async client) as an interactive request: it takes the next
+        # free throttle slot ahead of bulk jobs, then draws from the same rate limiter
+        result = await afetch_tax_info(normalized, force_refresh=force_refresh)
+
+        # Stored as a one-row job so the page can offer the same exports as a batch
+        import uuid
+        session_id = str(uuid.uuid4())
+        await asyncio.to_thread(store_single_result, session_id, result)
+
         return templates.TemplateResponse(
             "index.html",
             {
                 "request": request,
                 "results": [result],
-                "tax_code": tax_code
+                "tax_code": tax_code,
+                "session_id": session_id
             }
         )
     except Exception as e:
@@ -52,164 +180,62 @@ async def crawl_single(request: Request, tax_code: str = Form(...)):
 
 
 @app.post("/crawl_csv")
-async def crawl_from_csv(request: Request, file: UploadFile = File(...)):
-    """Crawl tax codes from uploaded CSV file with columns: dinh_danh_doanh_nghiep, ten_doanh_nghiep"""
+async def crawl_from_csv(request: Request, file: UploadFile = File(...), force_refresh: bool = Form(False)):
+    """
+    Crawl tax codes from an uploaded file
+
+    CSV or Excel with a dinh_danh_doanh_nghiep column, or a text file with
+    one code per line. The file is read as a stream that feeds the crawl, so
+    fetching starts before the whole file has been parsed.
+    """
     try:
-        # Read CSV file - preserve leading zeros by reading as string
-        contents = await file.read()
-        df = pd.read_csv(io.BytesIO(contents), dtype=str)
-
-        # Validate CSV structure
-        if df.empty:
-            return templates.TemplateResponse(
-                "index.html",
-                {"request": request, "error": "CSV file is empty"}
-            )
-        
-        # Check if required columns exist
-        if 'dinh_danh_doanh_nghiep' not in df.columns:
-            return templates.TemplateResponse(
-                "index.html",
-                {"request": request, "error": "CSV file must have 'dinh_danh_doanh_nghiep' column"}
-            )
+        # Generate session ID for progress tracking
+        import uuid
+        session_id = str(uuid.uuid4())
 
-        # Get tax codes from dinh_danh_doanh_nghiep column
-        tax_codes = df['dinh_danh_doanh_nghiep'].dropna().tolist()
+        # The input is kept until the job completes so an interrupted job can be resumed
+        input_path = await asyncio.to_thread(save_upload, file.file, session_id, file.filename)
 
-        if not tax_codes:
+        # Codes are read lazily; header/column problems are reported right away
+        try:
+            await asyncio.to_thread(check_upload, input_path, file.filename)
+        except IngestError as e:
+            os.remove(input_path)
             return templates.TemplateResponse(
                 "index.html",
-                {"request": request, "error": "No tax codes found in 'dinh_danh_doanh_nghiep' column"}
+                {"request": request, "error": str(e)}
             )
 
-        # Generate session ID for progress tracking
-        import uuid
-        session_id = str(uuid.uuid4())
-
-        # Initialize progress
-        progress_store[session_id] = {
-            'status': 'processing',
-            'total': len(tax_codes),
-            'completed': 0,
-            'current': '',
-            'message': 'Starting crawl...'
-        }
+        # Concurrency per job; politeness comes from the shared per-host rate limiter
+        batch_size = DEFAULT_BATCH_SIZE
 
-        # Crawl all tax codes with anti-detection and progress tracking
-        # Use larger batch_size for better performance
-        if len(tax_codes) <= 10:
-            batch_size = 5
-            delay_range = (1, 2)
-        elif len(tax_codes) <= 50:
-            batch_size = 2
-            delay_range = (3, 5)
-        elif len(tax_codes) <= 100:
-            batch_size = 2
-            delay_range = (3, 6)
-        else:
-            batch_size = 3
-            delay_range = (3, 5)
-
-        print(f"Processing {len(tax_codes)} tax codes with batch_size={batch_size}, delay={delay_range}")
+        await asyncio.to_thread(create_job, session_id, input_path, file.filename, batch_size, force_refresh)
+        logger.info("job_created", extra={"job_id": session_id, "upload": file.filename, "batch_size": batch_size})
 
         # Check if AJAX request
         is_ajax = request.headers.get("X-Requested-With") == "XMLHttpRequest"
 
         if is_ajax:
             # For AJAX requests, start background task and return session_id immediately
-            def crawl_in_background():
-                try:
-                    from crawler import crawl_multiple_tax_codes_with_progress
-
-                    def progress_callback(current, total, code, status):
-                        progress_data = {
-                            'status': 'processing',
-                            'total': total,
-                            'completed': current,
-                            'current': code,
-                            'message': status,
-                            'percentage': int((current / total) * 100)
-                        }
-                        progress_store[session_id] = progress_data
-                        print(f"[Progress] {current}/{total}: {code} - {status}")
-
-                    results = crawl_multiple_tax_codes_with_progress(
-                        tax_codes,
-                        batch_size=batch_size,
-                        delay_range=delay_range,
-                        progress_callback=progress_callback
-                    )
-
-                    # Mark as completed and store results
-                    progress_store[session_id] = {
-                        'status': 'completed',
-                        'total': len(tax_codes),
-                        'completed': len(tax_codes),
-                        'message': 'Crawling completed!',
-                        'percentage': 100,
-                        'results': results
-                    }
-                    print(f"[Completed] Stored {len(results)} results for session {session_id}")
-                except Exception as e:
-                    error_msg = f'Error: {str(e)}'
-                    progress_store[session_id] = {
-                        'status': 'error',
-                        'message': error_msg
-                    }
-                    print(f"[Error] {error_msg}")
-
-            # Start background task using threading
-            import threading
-            thread = threading.Thread(target=crawl_in_background, daemon=True)
-            thread.start()
-
-            # Return session_id immediately
-            print(f"[AJAX] Starting background crawl with session_id: {session_id}")
+            start_job(session_id)
             return {"session_id": session_id, "status": "started"}
 
-        # For non-AJAX requests, process synchronously
-        results = []
-        try:
-            from crawler import crawl_multiple_tax_codes_with_progress
-            results = crawl_multiple_tax_codes_with_progress(
-                tax_codes,
-                batch_size=batch_size,
-                delay_range=delay_range,
-                progress_callback=lambda current, total, code, status: progress_store.update({
-                    session_id: {
-                        'status': 'processing',
-                        'total': total,
-                        'completed': current,
-                        'current': code,
-                        'message': status,
-                        'percentage': int((current / total) * 100)
-                    }
-                })
-            )
-
-            # Mark as completed
-            progress_store[session_id] = {
-                'status': 'completed',
-                'total': len(tax_codes),
-                'completed': len(tax_codes),
-                'message': 'Crawling completed!',
-                'percentage': 100
-            }
-        except Exception as e:
-            progress_store[session_id] = {
-                'status': 'error',
-                'message': f'Error: {str(e)}'
-            }
-            raise
-
+        # For non-AJAX requests, run the job the same way and wait for it without
+        # blocking the event loop; results are read back in input order
+        start_job(session_id)
+        progress = await wait_for_final(session_id)
+        if progress is None or progress.get('status') != 'completed':
+            raise RuntimeError((progress or {}).get('message', 'Job expired'))
 
+        # Rows are not rendered here: the page loads them from the paginated API as it scrolls
         return templates.TemplateResponse(
             "index.html",
             {
                 "request": request,
-                "results": results,
+                "lazy_results": True,
                 "csv_uploaded": True,
-                "total_codes": len(tax_codes),
+                "total_codes": progress.get('total', 0),
+                "summary": progress if 'fetches_saved' in progress else None,
                 "session_id": session_id
             }
         )
@@ -221,31 +247,27 @@ async def crawl_from_csv(request: Request, file: UploadFile = File(...)):
 
 
 @app.get("/progress/{session_id}")
-async def progress_stream(session_id: str):
-    """Stream progress updates using Server-Sent Events"""
-    async def event_generator():
-        while True:
-            if session_id in progress_store:
-                progress = progress_store[session_id]
-                # Send progress as SSE
-                yield f"data: {json.dumps(progress)}\n\n"
-
-                # If completed or error, stop streaming (but keep data for retrieval)
-                if progress.get('status') in ['completed', 'error']:
-                    await asyncio.sleep(1)
-                    break
-            else:
-                # Session not found yet, wait
-                yield f"data: {json.dumps({'status': 'waiting', 'message': 'Waiting for task...'})}\n\n"
-
-            await asyncio.sleep(0.5)  # Update every 500ms
+async def progress_stream(request: Request, session_id: str):
+    """
+    Stream progress updates using Server-Sent Events
+
+    Events are pushed as the crawl publishes them (one per tax code), each
+    with an ``id:``; a reconnecting browser sends ``Last-Event-ID`` and gets
+    only the events it missed. Idle streams get heartbeat comments.
+    """
+    last_event_id = request.headers.get("Last-Event-ID")
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
 
     return StreamingResponse(
-        event_generator(),
+        stream_events(session_id, last_event_id),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",
         }
     )
 
@@ -253,33 +275,30 @@ async def progress_stream(session_id: str):
 @app.get("/results/{session_id}")
 async def get_results(request: Request, session_id: str):
     """Get results after crawling is complete"""
-    if session_id not in progress_store:
+    job_store = get_job_store()
+    progress = await asyncio.to_thread(job_store.get_progress, session_id)
+    if progress is None:
         return templates.TemplateResponse(
             "index.html",
             {"request": request, "error": "Session not found or expired"}
         )
 
-    progress = progress_store[session_id]
-
-    if progress.get('status') == 'completed' and 'results' in progress:
-        results = progress['results']
-        total_codes = progress.get('total', len(results))
-
-        # Clean up session after retrieving results
-        del progress_store[session_id]
-
+    # Jobs stay in the store until their TTL expires, so the page can be reloaded
+    if progress.get('status') == 'completed':
+        # Rows are not rendered here: the page loads them from the paginated API as it scrolls
         return templates.TemplateResponse(
             "index.html",
             {
                 "request": request,
-                "results": results,
+                "lazy_results": True,
                 "csv_uploaded": True,
-                "total_codes": total_codes
+                "total_codes": progress.get('total', 0),
+                "summary": progress if 'fetches_saved' in progress else None,
+                "session_id": session_id
             }
         )
     elif progress.get('status') == 'error':
         error_msg = progress.get('message', 'Unknown error')
-        del progress_store[session_id]
         return templates.TemplateResponse(
             "index.html",
             {"request": request, "error": error_msg}
@@ -291,12 +310,295 @@ async def get_results(request: Request, session_id: str):
         )
 
 
+@app.get("/results/{session_id}/stream")
+async def stream_results(session_id: str, format: str = "ndjson"):
+    """
+    Stream a job's results as NDJSON or CSV while it runs
+
+    Rows are sent in completion order as soon as each tax code finishes
+    (each carries its input ``index``); the response ends when the job does.
+    """
+    if format not in STREAM_FORMATS:
+        return JSONResponse({"error": f"format must be one of: {', '.join(STREAM_FORMATS)}"}, status_code=400)
+
+    job_store = get_job_store()
+    if await asyncio.to_thread(job_store.get_progress, session_id) is None:
+        return JSONResponse({"error": "Session not found or expired"}, status_code=404)
+
+    return StreamingResponse(
+        tail_results(session_id, format),
+        media_type=STREAM_FORMATS[format],
+        headers={
+            "Content-Disposition": f"attachment; filename=tax_results_{session_id}.{format}",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        }
+    )
+
+
+@app.post("/jobs/{session_id}/resume")
+async def resume(session_id: str):
+    """
+    Resume an unfinished job
+
+    Only the rows without a stored result are crawled; progress continues
+    on the job's usual /progress stream.
+    """
+    status = await asyncio.to_thread(resume_job, session_id)
+    if status == "not_found":
+        return JSONResponse({"error": "Job not found, expired or not resumable"}, status_code=404)
+    if status == "completed":
+        return JSONResponse({"session_id": session_id, "status": status}, status_code=409)
+    return {"session_id": session_id, "status": status}
+
+
+@app.get("/jobs/{session_id}/export.{fmt}")
+async def export_job(session_id: str, fmt: str):
+    """
+    Download a job's results as XLSX, CSV or Parquet
+
+    Built on the server from the job store, in input order, without loading
+    every row at once.
+    """
+    from datetime import datetime
+
+    if fmt not in EXPORT_FORMATS:
+        return JSONResponse({"error": f"format must be one of: {', '.join(EXPORT_FORMATS)}"}, status_code=400)
+
+    job_store = get_job_store()
+    if await asyncio.to_thread(job_store.get_progress, session_id) is None:
+        return JSONResponse({"error": "Session not found or expired"}, status_code=404)
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"tax_results_{timestamp}.{fmt}"
+    rows = (result for _, result in job_store.iter_results(session_id))
+
+    if fmt == "csv":
+        return StreamingResponse(
+            export_csv(rows),
+            media_type=EXPORT_FORMATS[fmt],
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
+
+    # XLSX and Parquet are finished in a temp file, then sent and removed
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        await asyncio.to_thread(export_xlsx if fmt == "xlsx" else export_parquet, rows, path)
+    except ExportError as e:
+        os.remove(path)
+        return JSONResponse({"error": str(e)}, status_code=501)
+    except Exception:
+        os.remove(path)
+        raise
+
+    return FileResponse(
+        path,
+        media_type=EXPORT_FORMATS[fmt],
+        filename=filename,
+        background=BackgroundTask(os.remove, path)
+    )
+
+
+def parse_codes(codes: List[Union[str, int]]):
+    """Cleaned-up codes of an API request body, or an error response"""
+    cleaned = [normalize_code(code) for code in codes]
+    if None in cleaned:
+        return JSONResponse({"error": f"Code #{cleaned.index(None)} is blank"}, status_code=400)
+    return cleaned
+
+
+@app.post("/api/lookup")
+async def api_lookup(codes: List[Union[str, int]] = Body(...), force_refresh: bool = False):
+    """
+    Look up a JSON array of tax codes and return structured JSON
+
+    Answers inline, one result per input code in input order. Batches over
+    API_SYNC_MAX_CODES are rejected with 413; submit them to /api/jobs.
+    """
+    cleaned = parse_codes(codes)
+    if isinstance(cleaned, JSONResponse):
+        return cleaned
+    if len(cleaned) > API_SYNC_MAX_CODES:
+        return JSONResponse(
+            {"error": f"At most {API_SYNC_MAX_CODES} codes per lookup; submit larger batches to /api/jobs"},
+            status_code=413
+        )
+
+    results, stats = await lookup_codes(cleaned, force_refresh=force_refresh)
+    return {"results": results, "stats": stats.as_dict()}
+
+
+@app.post("/api/jobs", status_code=202)
+async def api_submit_job(codes: List[Union[str, int]] = Body(...), force_refresh: bool = False):
+    """
+    Submit a JSON array of tax codes of any size as a background job
+
+    Returns the job id right away; poll /api/jobs/{id} (or follow
+    /progress/{id}) and read /api/jobs/{id}/results once it has completed.
+    """
+    cleaned = parse_codes(codes)
+    if isinstance(cleaned, JSONResponse):
+        return cleaned
+
+    import uuid
+    job_id = str(uuid.uuid4())
+    await asyncio.to_thread(submit_lookup_job, job_id, cleaned, force_refresh)
+    logger.info("job_created", extra={"job_id": job_id, "upload": "api", "codes": len(cleaned)})
+    start_job(job_id)
+    return {
+        "job_id": job_id,
+        "status": "started",
+        "total": len(cleaned),
+        "status_url": f"/api/jobs/{job_id}",
+        "results_url": f"/api/jobs/{job_id}/results",
+    }
+
+
+@app.get("/api/jobs/{job_id}")
+async def api_job_status(job_id: str):
+    """A job's current progress record"""
+    progress = await asyncio.to_thread(get_job_store().get_progress, job_id)
+    if progress is None:
+        return JSONResponse({"error": "Job not found or expired"}, status_code=404)
+    return {"job_id": job_id, **progress}
+
+
+@app.get("/api/jobs/{job_id}/results")
+async def api_job_results(job_id: str):
+    """
+    A completed job's results as a JSON array in input order
+
+    Streamed from the job store, so large batches are not built in memory.
+    Answers 409 with the progress record while the job is still running.
+    """
+    job_store = get_job_store()
+    progress = await asyncio.to_thread(job_store.get_progress, job_id)
+    if progress is None:
+        return JSONResponse({"error": "Job not found or expired"}, status_code=404)
+    if progress.get("status") != "completed":
+        return JSONResponse({"job_id": job_id, **progress}, status_code=409)
+
+    return StreamingResponse(iter_json_array(job_store.iter_results(job_id)), media_type="application/json")
+
+
+@app.get("/api/jobs/{job_id}/results/page")
+async def api_job_results_page(
+    job_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(RESULTS_PAGE_SIZE, ge=1, le=RESULTS_MAX_PAGE_SIZE),
+    sort: str = "index",
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    status: Optional[str] = None,
+    managed_by: Optional[str] = None,
+    business_type: Optional[str] = None,
+    name: Optional[str] = None,
+    errors: Optional[bool] = None
+):
+    """
+    One page of a job's results, sorted and filtered, with a cursor to the next
+
+    Works while the job is running (rows stored so far). sort is "index"
+    (input order) or an API field name; status, managed_by, business_type
+    and name keep rows whose field contains the text (case-insensitive);
+    errors=true/false keeps only failed/successful rows. Pass next_cursor
+    back as cursor, with the same sort and order, for the following page.
+    """
+    job_store = get_job_store()
+    progress = await asyncio.to_thread(job_store.get_progress, job_id)
+    if progress is None:
+        return JSONResponse({"error": "Job not found or expired"}, status_code=404)
+
+    filters = {"status": status, "managed_by": managed_by, "business_type": business_type, "name": name}
+    try:
+        page = await asyncio.to_thread(
+            results_page, job_store, job_id, cursor, limit, sort, order == "desc", filters, errors
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return {"job_id": job_id, "job_status": progress.get("status"), **page}
+
+
+@app.post("/api/refresh")
+async def api_refresh(codes: List[Union[str, int]] = Body(...), force_refresh: bool = False):
+    """
+    Re-check previously crawled codes and return only the ones that changed
+
+    Pages are revalidated with ETag/Last-Modified when the upstream gave
+    them, otherwise compared by content hash; unchanged pages are not
+    parsed. Each change lists its changed fields with old and new values;
+    codes seen for the first time come back as "new". force_refresh
+    downloads and parses every page.
+    """
+    cleaned = parse_codes(codes)
+    if isinstance(cleaned, JSONResponse):
+        return cleaned
+
+    changes, counts = await refresh_codes(cleaned, force_refresh=force_refresh)
+    logger.info("refresh_completed", extra={"codes": len(cleaned), **counts})
+    return {"changes": changes, "stats": {"codes": len(cleaned), **counts}}
+
+
+@app.get("/search")
+async def search(
+    q: Optional[str] = None,
+    industry: Optional[str] = None,
+    managed_by: Optional[str] = None,
+    main_industry: bool = False,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE)
+):
+    """
+    Search companies crawled so far, without asking the upstream
+
+    q matches words (prefixes, accents optional) in the tax code, name and
+    addresses; industry is an exact industry code (main_industry: only as
+    the main one); managed_by matches words in the managing tax office.
+    Results use the /api/lookup format, one page at a time.
+    """
+    index = get_company_index()
+    if index is None:
+        return JSONResponse({"error": "The company index is disabled"}, status_code=503)
+
+    found = await asyncio.to_thread(index.search, q, industry, managed_by, main_industry, page, page_size)
+    found["results"] = [to_api_result(info) for info in found["results"]]
+    return found
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics: fetch/parse/queue/politeness timings, outcomes, in-flight work and per-job throughput"""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Result cache hit/miss/eviction counters"""
+    cache = get_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    """Shared crawl worker pool (busy workers, active and queued jobs), the upstream throttle and fetch coalescing"""
+    return {
+        **get_scheduler().stats(),
+        "upstream": get_throttle(upstream_host()).stats(),
+        "coalescing": singleflight.stats(),
+    }
+
+
 @app.post("/download_excel")
 async def download_excel(results_json: str = Form(...)):
-    """Download results as Excel file"""
+    """Download posted results as Excel file (kept for API clients; the page uses /jobs/{id}/export.xlsx)"""
     import json
     import base64
     from datetime import datetime
+    # pandas is the heaviest import in the app; only this endpoint needs it
+    import pandas as pd
+    from openpyxl.utils import get_column_letter
 
     try:
         # Try to decode from base64 first
@@ -335,7 +637,7 @@ async def download_excel(results_json: str = Form(...)):
                     df[col].astype(str).apply(len).max(),
                     len(col)
                 ) + 2
-                worksheet.column_dimensions[chr(65 + idx)].width = min(max_length, 50)
+                worksheet.column_dimensions[get_column_letter(idx + 1)].width = min(max_length, 50)
 
         output.seek(0)
 
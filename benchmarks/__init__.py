@@ -0,0 +1,3 @@
+"""
+Benchmarks for the tax crawler (run with ``python -m benchmarks.<name>``)
+"""
@@ -0,0 +1,73 @@
+"""
+Benchmark: one-off requests.get vs the shared pooled session
+
+Runs fetch_tax_info against a local stub server and reports TCP handshakes
+per lookup and p50/p95 latency for both transports.
+
+Usage:
+    python -m benchmarks.bench_http_session [lookups]
+"""
+import statistics
+import sys
+import time
+from typing import Callable, Dict
+
+import requests
+
+import http_client
+from crawler import fetch_tax_info
+from rate_limiter import set_rate_limit
+from benchmarks.stub_server import StubServer
+
+
+def percentile(samples, pct: float) -> float:
+    """Nearest-rank percentile of a list of samples"""
+    ordered = sorted(samples)
+    idx = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[idx]
+
+
+def run(server: StubServer, lookups: int, session_factory: Callable[[], requests.Session]) -> Dict:
+    """Run `lookups` fetches, calling session_factory before each one"""
+    server.reset_stats()
+    latencies = []
+    for i in range(lookups):
+        code = f"{i:010d}"
+        start = time.perf_counter()
+        fetch_tax_info(code, session=session_factory())
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "handshakes_per_lookup": server.connections / lookups,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "mean_ms": statistics.mean(latencies),
+    }
+
+
+def main():
+    lookups = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    server = StubServer().start()
+    http_client.BASE_URL = server.base_url
+    set_rate_limit(http_client.upstream_host(), rate=0)
+
+    try:
+        # Before: requests.get builds (and tears down) a session per call
+        before = run(server, lookups, requests.Session)
+
+        shared = http_client.create_session()
+        after = run(server, lookups, lambda: shared)
+        shared.close()
+    finally:
+        server.stop()
+
+    print(f"{'transport':<12} {'handshakes/lookup':>18} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8}")
+    for name, stats in (("before", before), ("after", after)):
+        print(
+            f"{name:<12} {stats['handshakes_per_lookup']:>18.3f} "
+            f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['mean_ms']:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
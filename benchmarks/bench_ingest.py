@@ -0,0 +1,79 @@
+"""
+Benchmark: peak RSS of reading an uploaded CSV, pandas vs streaming ingestion
+
+For each file size a fresh subprocess reads every tax code from a generated
+CSV, once the way /crawl_csv used to (read the whole upload, pd.read_csv,
+.tolist()) and once through ingest.open_tax_codes, and reports its peak RSS
+and time.
+
+Usage:
+    python -m benchmarks.bench_ingest [rows ...]
+"""
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def make_csv(path: str, rows: int):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("dinh_danh_doanh_nghiep,ten_doanh_nghiep\n")
+        for i in range(rows):
+            f.write(f"{i:010d},CÔNG TY TNHH MẪU SỐ {i}\n")
+
+
+def read_pandas(path: str) -> int:
+    import pandas as pd
+    with open(path, "rb") as f:
+        contents = f.read()
+    df = pd.read_csv(io.BytesIO(contents), dtype=str)
+    return len(df["dinh_danh_doanh_nghiep"].dropna().tolist())
+
+
+def read_streaming(path: str) -> int:
+    from ingest import open_tax_codes
+    with open(path, "rb") as f:
+        return sum(1 for _ in open_tax_codes(f, path))
+
+
+READERS = {"pandas": read_pandas, "streaming": read_streaming}
+
+
+def run_child(reader: str, path: str) -> dict:
+    start = time.perf_counter()
+    codes = READERS[reader](path)
+    return {
+        "codes": codes,
+        "seconds": time.perf_counter() - start,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        print(json.dumps(run_child(sys.argv[2], sys.argv[3])))
+        return
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    print(f"{'rows':>10} {'file MB':>8} {'reader':<10} {'peak RSS MB':>12} {'seconds':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in sizes:
+            path = os.path.join(tmp, f"codes_{rows}.csv")
+            make_csv(path, rows)
+            size_mb = os.path.getsize(path) / 1024 / 1024
+            for reader in READERS:
+                out = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.bench_ingest", "--child", reader, path],
+                    check=True, capture_output=True, text=True
+                ).stdout
+                stats = json.loads(out)
+                assert stats["codes"] == rows
+                print(f"{rows:>10} {size_mb:>8.1f} {reader:<10} {stats['peak_rss_mb']:>12.1f} {stats['seconds']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
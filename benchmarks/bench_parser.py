@@ -0,0 +1,99 @@
+"""
+Microbenchmark: lxml single-pass parser vs the html5lib/BeautifulSoup fallback
+
+Each parser runs in a fresh subprocess over the saved fixture pages and
+reports mean/p50 parse time per page, the peak Python heap allocated while
+parsing one page (tracemalloc) and the subprocess's peak RSS.
+
+Usage:
+    python -m benchmarks.bench_parser [iterations]
+"""
+import glob
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import tax_parser
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fixtures", "pages")
+
+PARSERS = {
+    "lxml": lambda data: tax_parser._parse_lxml(data),
+    "html5lib": lambda data: tax_parser._parse_html5lib(data.decode("utf-8")),
+}
+
+
+def load_pages():
+    pages = []
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.html"))):
+        with open(path, "rb") as f:
+            pages.append(f.read())
+    return pages
+
+
+def parse_quietly(parse, data):
+    try:
+        parse(data)
+    except tax_parser.ParseError:
+        pass
+
+
+def run_child(name: str, iterations: int) -> dict:
+    """Measure one parser in this process (called in a subprocess)"""
+    parse = PARSERS[name]
+    pages = load_pages()
+
+    # Warm up so lazy imports are not counted as parse allocations
+    for data in pages:
+        parse_quietly(parse, data)
+
+    heap_peaks = []
+    for data in pages:
+        tracemalloc.start()
+        parse_quietly(parse, data)
+        heap_peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    timings = []
+    for _ in range(iterations):
+        for data in pages:
+            start = time.perf_counter()
+            parse_quietly(parse, data)
+            timings.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "parser": name,
+        "pages": len(pages),
+        "mean_ms": statistics.mean(timings),
+        "p50_ms": statistics.median(timings),
+        "peak_heap_kb": max(heap_peaks) / 1024,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        print(json.dumps(run_child(sys.argv[2], int(sys.argv[3]))))
+        return
+
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"{'parser':<10} {'mean ms':>8} {'p50 ms':>8} {'peak heap KB':>13} {'peak RSS MB':>12}")
+    for name in PARSERS:
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_parser", "--child", name, str(iterations)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        stats = json.loads(out)
+        print(
+            f"{name:<10} {stats['mean_ms']:>8.3f} {stats['p50_ms']:>8.3f} "
+            f"{stats['peak_heap_kb']:>13.1f} {stats['peak_rss_mb']:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark: parse throughput of the process-pool pipeline vs parsing in fetch threads
+
+Pages are replayed from fixtures/pages (no network), so throughput is bound
+by parsing; the pipeline should scale with the number of parser processes up
+to the number of cores.
+
+Usage:
+    python -m benchmarks.bench_pipeline [pages]
+"""
+import glob
+import itertools
+import os
+import sys
+import threading
+import time
+
+from cache import ResultCache
+from crawler import crawl_multiple_tax_codes
+from pipeline import crawl_pipeline, shutdown_parse_pool
+from rate_limiter import TokenBucket
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fixtures", "pages")
+
+
+class ReplayResponse:
+    def __init__(self, content: bytes):
+        self.content = content
+
+
+class ReplaySession:
+    """Stands in for requests.Session, serving recorded pages round-robin"""
+
+    def __init__(self):
+        pages = []
+        for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.html"))):
+            with open(path, "rb") as f:
+                pages.append(f.read())
+        self._pages = itertools.cycle(pages)
+        self._lock = threading.Lock()
+
+    def get(self, url, timeout=None):
+        with self._lock:
+            return ReplayResponse(next(self._pages))
+
+
+def measure(label: str, run, count: int):
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {count / elapsed:>10.1f} pages/s")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    codes = [f"{i:010d}" for i in range(count)]
+    unlimited = TokenBucket(rate=0)
+    cores = os.cpu_count() or 1
+
+    print(f"{count} recorded pages, {cores} core(s)")
+    measure(
+        "threads (parse in-thread)",
+        lambda: crawl_multiple_tax_codes(
+            codes, batch_size=4, session=ReplaySession(), rate_limiter=unlimited
+        ),
+        count
+    )
+
+    worker_counts = sorted({1, 2, 4, cores})
+    for workers in worker_counts:
+        measure(
+            f"pipeline parse_workers={workers}",
+            lambda: crawl_pipeline(
+                codes,
+                fetch_workers=4,
+                parse_workers=workers,
+                session=ReplaySession(),
+                rate_limiter=unlimited,
+                cache=ResultCache(path=":memory:", ttl=0, error_ttl=0)
+            ),
+            count
+        )
+    shutdown_parse_pool()
+
+
+if __name__ == "__main__":
+    main()
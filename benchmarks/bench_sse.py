@@ -0,0 +1,127 @@
+"""
+Load test: many SSE clients following one crawl job's progress
+
+Starts the app under uvicorn in a subprocess (upstream replaced by the local
+stub server), submits a crawl job and attaches N concurrent clients to
+``/progress/{session_id}``. Reports the server process's CPU time and the
+bytes/messages each client received until the job completed.
+
+Usage:
+    python -m benchmarks.bench_sse [clients] [codes] [rate]
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmarks.stub_server import StubServer
+from tax_code import with_check_digit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def valid_codes(count: int):
+    """`count` distinct tax codes that pass the MST check digit"""
+    codes = (with_check_digit(f"{i:09d}") for i in range(1, 10 * count + 10))
+    return [code for code in codes if code][:count]
+
+
+def cpu_seconds(pid: int) -> float:
+    """User + system CPU time of a process (Linux /proc)"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def follow(port: int, session_id: str) -> dict:
+    """One SSE client: read the stream until the server ends it"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"GET /progress/{session_id} HTTP/1.1\r\nHost: localhost\r\n"
+        f"Accept: text/event-stream\r\nConnection: close\r\n\r\n".encode()
+    )
+    await writer.drain()
+
+    received = 0
+    messages = 0
+    while True:
+        chunk = await reader.read(65536)
+        if not chunk:
+            break
+        received += len(chunk)
+        messages += chunk.count(b"data: ")
+    writer.close()
+    return {"bytes": received, "messages": messages}
+
+
+async def run_clients(port: int, session_id: str, clients: int):
+    return await asyncio.gather(*(follow(port, session_id) for _ in range(clients)))
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    codes = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    rate = sys.argv[3] if len(sys.argv) > 3 else "20"
+
+    upstream = StubServer().start()
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix="bench_sse_")
+    env = dict(
+        os.environ,
+        MASOTHUE_BASE_URL=upstream.base_url,
+        RATE_LIMIT_PER_SECOND=rate,
+        RATE_LIMIT_JITTER="0",
+        CACHE_ENABLED="false",
+        JOB_STORE_PATH=os.path.join(workdir, "jobs.sqlite3"),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(100):
+            try:
+                requests.get(f"{base}/cache/stats", timeout=1)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+
+        csv = "dinh_danh_doanh_nghiep\n" + "".join(f"{code}\n" for code in valid_codes(codes))
+        cpu_start = cpu_seconds(server.pid)
+        start = time.perf_counter()
+        session_id = requests.post(
+            f"{base}/crawl_csv",
+            files={"file": ("codes.csv", csv, "text/csv")},
+            headers={"X-Requested-With": "XMLHttpRequest"},
+        ).json()["session_id"]
+
+        stats = asyncio.run(run_clients(port, session_id, clients))
+        elapsed = time.perf_counter() - start
+        cpu = cpu_seconds(server.pid) - cpu_start
+    finally:
+        server.terminate()
+        server.wait()
+        upstream.stop()
+
+    total_bytes = sum(s["bytes"] for s in stats)
+    total_messages = sum(s["messages"] for s in stats)
+    print(f"{clients} clients, {codes} codes at {rate}/s, job took {elapsed:.1f}s")
+    print(f"server CPU          {cpu:>10.2f} s ({cpu / elapsed * 100:.0f}% of one core)")
+    print(f"bytes sent          {total_bytes / 1024:>10.1f} KiB ({total_bytes / clients / 1024:.1f} KiB/client)")
+    print(f"messages sent       {total_messages:>10d} ({total_messages / clients:.1f}/client)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Cold-start benchmark: import time of the app and time to first healthy response
+
+Each run is a fresh interpreter:
+
+- import   `python -X importtime -c "import app"`; reports the total and the
+           heaviest modules app imports directly (cumulative ms)
+- deferred which of preload.DEFERRED_MODULES `import app` loaded (should be none)
+- startup  `uvicorn app:app` from process start to the first 200 from /healthz
+
+The report is JSON (stdout, or -o FILE). The exit status is 1 when the
+median time to first healthy response is over --max-seconds, the median
+import time is over --max-import-seconds, or a deferred module was loaded,
+so it can gate CI.
+
+Usage:
+    python -m benchmarks.bench_startup [--runs N] [--max-seconds S] [--max-import-seconds S] [-o FILE]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import requests
+
+from benchmarks.bench_sse import ROOT, free_port
+from benchmarks.bench_suite import version
+from preload import DEFERRED_MODULES
+
+STARTUP_MAX_SECONDS = float(os.environ.get("STARTUP_MAX_SECONDS", "1.5"))
+IMPORT_MAX_SECONDS = float(os.environ.get("IMPORT_MAX_SECONDS", "1.0"))
+
+
+def import_times(module: str = "app") -> Tuple[float, Dict[str, float]]:
+    """
+    Import a module in a fresh interpreter under -X importtime
+
+    Returns:
+        (total seconds, {directly imported module: cumulative ms})
+    """
+    child = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    total, direct = 0.0, {}
+    for line in child.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        if name.strip() == module and depth == 0:
+            total = int(cumulative) / 1e6
+        elif depth == 1:
+            direct[name.strip()] = int(cumulative) / 1000
+    return total, direct
+
+
+def loaded_deferred(module: str = "app") -> List[str]:
+    """Deferred dependencies that importing `module` loads"""
+    check = (
+        f"import sys, json, {module}; "
+        f"print(json.dumps([m for m in {list(DEFERRED_MODULES)!r} if m in sys.modules]))"
+    )
+    child = subprocess.run([sys.executable, "-c", check], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+
+def time_to_healthy(workdir: str, timeout: float = 30) -> float:
+    """Seconds from starting uvicorn to the first 200 from /healthz"""
+    port = free_port()
+    env = dict(
+        os.environ,
+        JOB_STORE_PATH=os.path.join(workdir, "jobs.sqlite3"),
+        JOB_UPLOAD_DIR=os.path.join(workdir, "uploads"),
+    )
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                if requests.get(f"http://127.0.0.1:{port}/healthz", timeout=1).status_code == 200:
+                    return time.perf_counter() - start
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.01)
+        raise RuntimeError("App server did not become healthy")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=10, help="heaviest direct imports to report")
+    parser.add_argument("--max-seconds", type=float, default=STARTUP_MAX_SECONDS,
+                        help="fail if the median time to first healthy response is over this (STARTUP_MAX_SECONDS)")
+    parser.add_argument("--max-import-seconds", type=float, default=IMPORT_MAX_SECONDS,
+                        help="fail if the median `import app` time is over this (IMPORT_MAX_SECONDS)")
+    parser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    imports = [import_times() for _ in range(args.runs)]
+    totals = [total for total, _ in imports]
+    # Per-module breakdown from the fastest run (least noise)
+    _, breakdown = min(imports, key=lambda run: run[0])
+    heaviest = dict(sorted(breakdown.items(), key=lambda item: -item[1])[:args.top])
+
+    with tempfile.TemporaryDirectory(prefix="bench_startup_") as workdir:
+        healthy = [time_to_healthy(workdir) for _ in range(args.runs)]
+
+    deferred = loaded_deferred()
+    report = {
+        "version": version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "runs": args.runs,
+        "import_seconds": {"median": round(statistics.median(totals), 3), "min": round(min(totals), 3)},
+        "import_ms_by_module": {name: round(ms, 1) for name, ms in heaviest.items()},
+        "deferred_loaded": deferred,
+        "time_to_healthy_seconds": {"median": round(statistics.median(healthy), 3), "min": round(min(healthy), 3)},
+        "thresholds": {"max_seconds": args.max_seconds, "max_import_seconds": args.max_import_seconds},
+    }
+
+    failures = []
+    if report["time_to_healthy_seconds"]["median"] > args.max_seconds:
+        failures.append(f"time to healthy {report['time_to_healthy_seconds']['median']} s > {args.max_seconds} s")
+    if report["import_seconds"]["median"] > args.max_import_seconds:
+        failures.append(f"import app {report['import_seconds']['median']} s > {args.max_import_seconds} s")
+    if deferred:
+        failures.append(f"import app loaded deferred modules: {', '.join(deferred)}")
+    report["failures"] = failures
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
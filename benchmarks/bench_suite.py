@@ -0,0 +1,342 @@
+"""
+End-to-end throughput benchmark suite over the offline replay corpus
+
+The replay corpus (fixtures/corpus.json) is served by the local stub
+upstream with configurable latency and error rates; every other code gets a
+generated company page. Each scenario runs in a fresh child process, so CPU
+time and peak RSS are its own:
+
+- fetch_tax_info   sequential single lookups
+- crawl_multiple   crawler.crawl_multiple_tax_codes_with_progress (thread pool)
+- scheduler        the shared worker pool (scheduler.Scheduler.iter_crawl)
+- api_lookup       POST /api/lookup batches against the app under uvicorn
+- crawl_csv        one uploaded batch job (POST /crawl_csv) until it completes
+
+For the HTTP scenarios CPU and peak RSS are the app server's. Results are
+written as JSON (stdout, or -o FILE) with the version and settings, so runs
+can be tracked across versions.
+
+Usage:
+    python -m benchmarks.bench_suite [--codes N] [--latency S] [--concurrency N]
+        [--error-rate KIND=RATE ...] [--scenario NAME ...] [-o FILE]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from benchmarks.bench_sse import ROOT, cpu_seconds, free_port, valid_codes
+from benchmarks.stub_server import ERROR_KINDS, StubServer, load_corpus
+
+SCENARIOS = ["fetch_tax_info", "crawl_multiple", "scheduler", "api_lookup", "crawl_csv"]
+
+
+def percentile(samples: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of a list of samples (None when empty)"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    idx = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[idx]
+
+
+def bench_codes(count: int) -> List[str]:
+    """The replay corpus codes followed by generated valid codes, `count` in all (all distinct)"""
+    corpus = list(load_corpus())
+    return (corpus + valid_codes(count))[:count]
+
+
+def peak_rss_mb(pid: Optional[int] = None) -> float:
+    """Peak resident set size of this process, or of `pid` (Linux /proc)"""
+    if pid is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def own_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+# ==== Scenarios (run in the child process) ====
+
+class StartTimes:
+    """Latency per code from the crawl's "Crawling <code>..." progress to its result"""
+
+    def __init__(self):
+        self.started: Dict[str, float] = {}
+        self.latencies: List[float] = []
+        self.errors = 0
+
+    def progress(self, current, total, code, status):
+        if status.startswith("Crawling"):
+            self.started[code] = time.perf_counter()
+
+    def result(self, code: str, info: Dict):
+        self.latencies.append(time.perf_counter() - self.started.pop(code, time.perf_counter()))
+        self.errors += "Error" in info
+
+
+def run_fetch_tax_info(codes: List[str], args) -> Dict:
+    from crawler import fetch_tax_info
+
+    times = StartTimes()
+    for code in codes:
+        times.progress(0, 0, code, "Crawling")
+        times.result(code, fetch_tax_info(code))
+    return {"latencies": times.latencies, "errors": times.errors}
+
+
+def run_crawl_multiple(codes: List[str], args) -> Dict:
+    from crawler import crawl_multiple_tax_codes_with_progress
+
+    times = StartTimes()
+    crawl_multiple_tax_codes_with_progress(
+        codes,
+        batch_size=args.concurrency,
+        progress_callback=times.progress,
+        result_callback=lambda idx, info: times.result(codes[idx], info)
+    )
+    return {"latencies": times.latencies, "errors": times.errors}
+
+
+def run_scheduler(codes: List[str], args) -> Dict:
+    from scheduler import Scheduler
+
+    times = StartTimes()
+    scheduler = Scheduler(workers=args.concurrency)
+    for idx, info in scheduler.iter_crawl("bench", codes, progress_callback=times.progress,
+                                          max_in_flight=args.concurrency):
+        times.result(codes[idx], info)
+    return {"latencies": times.latencies, "errors": times.errors}
+
+
+def run_api_lookup(codes: List[str], args, base: str) -> Dict:
+    import requests
+
+    batches = [codes[i:i + args.api_batch] for i in range(0, len(codes), args.api_batch)]
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def lookup(batch):
+        nonlocal errors
+        start = time.perf_counter()
+        results = requests.post(f"{base}/api/lookup", json=batch, timeout=120).json()["results"]
+        with lock:
+            latencies.append(time.perf_counter() - start)
+            errors += sum(1 for r in results if r["error"])
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lookup, batches))
+    return {"latencies": latencies, "errors": errors, "requests": len(batches)}
+
+
+def run_crawl_csv(codes: List[str], args, base: str) -> Dict:
+    import requests
+
+    csv = "dinh_danh_doanh_nghiep\n" + "".join(f"{code}\n" for code in codes)
+    session_id = requests.post(
+        f"{base}/crawl_csv",
+        files={"file": ("codes.csv", csv, "text/csv")},
+        headers={"X-Requested-With": "XMLHttpRequest"},
+    ).json()["session_id"]
+    while True:
+        progress = requests.get(f"{base}/api/jobs/{session_id}", timeout=10).json()
+        if progress["status"] in ("completed", "error"):
+            break
+        time.sleep(0.05)
+    results = requests.get(f"{base}/api/jobs/{session_id}/results", timeout=60).json()
+    return {"latencies": [], "errors": sum(1 for r in results if r["error"])}
+
+
+IN_PROCESS = {"fetch_tax_info": run_fetch_tax_info, "crawl_multiple": run_crawl_multiple, "scheduler": run_scheduler}
+OVER_HTTP = {"api_lookup": run_api_lookup, "crawl_csv": run_crawl_csv}
+
+
+def start_app(workdir: str):
+    """The app under uvicorn in a subprocess (upstream/settings from this process's environment)"""
+    import requests
+
+    port = free_port()
+    env = dict(
+        os.environ,
+        JOB_STORE_PATH=os.path.join(workdir, "jobs.sqlite3"),
+        JOB_UPLOAD_DIR=os.path.join(workdir, "uploads"),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            requests.get(f"{base}/cache/stats", timeout=1)
+            return server, base
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    server.terminate()
+    raise RuntimeError("App server did not start")
+
+
+def run_child(name: str, args) -> Dict:
+    """Run one scenario in this process and measure it"""
+    codes = bench_codes(args.codes)
+
+    if name in IN_PROCESS:
+        cpu_start = own_cpu_seconds()
+        start = time.perf_counter()
+        outcome = IN_PROCESS[name](codes, args)
+        elapsed = time.perf_counter() - start
+        cpu, rss = own_cpu_seconds() - cpu_start, peak_rss_mb()
+    else:
+        workdir = tempfile.mkdtemp(prefix="bench_suite_")
+        server, base = start_app(workdir)
+        try:
+            cpu_start = cpu_seconds(server.pid)
+            start = time.perf_counter()
+            outcome = OVER_HTTP[name](codes, args, base)
+            elapsed = time.perf_counter() - start
+            cpu, rss = cpu_seconds(server.pid) - cpu_start, peak_rss_mb(server.pid)
+        finally:
+            server.terminate()
+            server.wait()
+
+    latencies = outcome.pop("latencies")
+    return {
+        "codes": len(codes),
+        "seconds": round(elapsed, 3),
+        "codes_per_sec": round(len(codes) / elapsed, 2),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+            "p99": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        },
+        "cpu_seconds": round(cpu, 3),
+        "peak_rss_mb": round(rss, 1),
+        **outcome,
+    }
+
+
+# ==== Orchestration (parent process: hosts the stub upstream) ====
+
+def version() -> Dict:
+    """Package version and git revision of the tree being measured"""
+    try:
+        import tomllib
+        with open(os.path.join(ROOT, "pyproject.toml"), "rb") as f:
+            package = tomllib.load(f)["project"]["version"]
+    except Exception:
+        package = None
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except Exception:
+        revision = None
+    return {"package": package, "revision": revision, "python": platform.python_version()}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--codes", type=int, default=300, help="codes per scenario")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds the stub upstream adds per answer")
+    parser.add_argument("--concurrency", type=int, default=4, help="fetch workers / concurrent HTTP clients")
+    parser.add_argument("--api-batch", type=int, default=10, help="codes per /api/lookup request")
+    parser.add_argument("--rate", type=float, default=0, help="client rate limit, requests/second (0: unlimited)")
+    parser.add_argument("--error-rate", action="append", default=[], metavar="KIND=RATE",
+                        help=f"random upstream failures, KIND one of {', '.join(ERROR_KINDS)}")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the random failures")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="run only these (repeatable)")
+    parser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def error_rates(specs: List[str]) -> Dict[str, float]:
+    rates = {}
+    for spec in specs:
+        kind, _, rate = spec.partition("=")
+        if kind not in ERROR_KINDS:
+            raise SystemExit(f"Unknown error kind '{kind}' (one of {', '.join(ERROR_KINDS)})")
+        rates[kind] = float(rate)
+    return rates
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        print(json.dumps(run_child(args.child, args)))
+        return
+
+    upstream = StubServer(corpus=load_corpus(), seed=args.seed).start()
+    upstream.latency = args.latency
+    upstream.error_rates = error_rates(args.error_rate)
+    env = dict(
+        os.environ,
+        MASOTHUE_BASE_URL=upstream.base_url,
+        RATE_LIMIT_PER_SECOND=str(args.rate),
+        RATE_LIMIT_JITTER="0",
+        CACHE_ENABLED="false",
+        UPSTREAM_BLOCK_BACKOFF=os.environ.get("UPSTREAM_BLOCK_BACKOFF", "0.05"),
+        DEFAULT_BATCH_SIZE=str(args.concurrency),
+        SCHEDULER_WORKERS=str(args.concurrency),
+    )
+    child_args = [
+        "--codes", str(args.codes), "--concurrency", str(args.concurrency), "--api-batch", str(args.api_batch)
+    ]
+
+    report = {
+        "version": version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "settings": {
+            "codes": args.codes,
+            "latency": args.latency,
+            "concurrency": args.concurrency,
+            "api_batch": args.api_batch,
+            "rate": args.rate,
+            "error_rates": upstream.error_rates,
+        },
+        "scenarios": {},
+    }
+    try:
+        for name in args.scenario or SCENARIOS:
+            upstream.reset_stats()
+            child = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_suite", "--child", name, *child_args],
+                cwd=ROOT, env=env, capture_output=True, text=True
+            )
+            if child.returncode != 0:
+                report["scenarios"][name] = {"failed": child.stderr.strip().splitlines()[-1:]}
+                continue
+            result = json.loads(child.stdout.strip().splitlines()[-1])
+            result["upstream_requests"] = upstream.requests
+            result["upstream_statuses"] = {str(status): n for status, n in upstream.statuses.items()}
+            report["scenarios"][name] = result
+            print(f"{name:<16} {result['codes_per_sec']:>9.1f} codes/s  p50 {result['latency_ms']['p50']} ms  "
+                  f"p99 {result['latency_ms']['p99']} ms  cpu {result['cpu_seconds']} s  "
+                  f"rss {result['peak_rss_mb']} MiB", file=sys.stderr)
+    finally:
+        upstream.stop()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
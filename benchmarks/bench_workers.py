@@ -0,0 +1,116 @@
+"""
+Benchmark: throughput of crawl workers as worker processes are added
+
+Starts the stub upstream, then for each worker count runs that many
+``worker.py`` processes on a fresh SQLite work queue and times how long they
+take to fetch the same codes. Every worker has its own rate budget (--rate),
+so throughput should grow about linearly with the number of workers until
+the upstream or the queue becomes the bottleneck. Workers are started and
+ready before the codes are queued, so interpreter startup is not counted.
+
+Usage:
+    python -m benchmarks.bench_workers [codes] [rate per worker]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+from benchmarks.stub_server import StubServer
+from tax_code import with_check_digit
+from work_queue import SQLiteWorkQueue
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_codes(count: int) -> List[str]:
+    codes = (with_check_digit(f"{i:09d}") for i in range(100000, 100000 + 20 * count))
+    return [code for code in codes if code][:count]
+
+
+def _drain(stream):
+    with stream:
+        stream.read()
+
+
+def start_worker(queue_path: str, base_url: str, workdir: str, rate: float, concurrency: int) -> subprocess.Popen:
+    """Start a worker process and wait until it is polling the queue"""
+    env = dict(
+        os.environ,
+        MASOTHUE_BASE_URL=base_url,
+        CACHE_ENABLED="false",
+        COMPANY_INDEX_ENABLED="false",
+        PRELOAD_ENABLED="false",
+        LOG_FORMAT="text",
+        PYTHONPATH=ROOT,
+    )
+    worker = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "worker.py"), "--queue", queue_path, "--rate", str(rate),
+         "--concurrency", str(concurrency), "--max-idle", "2"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    for line in worker.stderr:
+        if "worker_started" in line:
+            # Keep draining its log so the pipe never fills up
+            threading.Thread(target=_drain, args=(worker.stderr,), daemon=True).start()
+            return worker
+    raise RuntimeError(f"worker exited with status {worker.wait()}")
+
+
+def run_workers(workers: int, codes: List[str], rate: float, concurrency: int = 4, latency: float = 0.02) -> Dict:
+    """
+    Fetch `codes` with `workers` worker processes
+
+    Returns:
+        {"workers", "codes", "seconds", "codes_per_second", "requests"}
+    """
+    server = StubServer().start()
+    server.latency = latency
+    procs = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            queue_path = os.path.join(tmp, "queue.sqlite3")
+            queue = SQLiteWorkQueue(path=queue_path)
+            procs = [start_worker(queue_path, server.base_url, tmp, rate, concurrency) for _ in range(workers)]
+
+            start = time.perf_counter()
+            queue.enqueue("bench", codes)
+            results = {}
+            while len(results) < len(codes):
+                results.update(queue.take_results("bench"))
+                time.sleep(0.005)
+            seconds = time.perf_counter() - start
+
+            for proc in procs:
+                proc.terminate()
+            for proc in procs:
+                proc.wait(timeout=30)
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+        server.stop()
+    return {"workers": workers, "codes": len(codes), "seconds": seconds,
+            "codes_per_second": len(codes) / seconds, "requests": server.requests}
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+    codes = make_codes(count)
+
+    print(f"{count} codes, {rate:g} requests/s per worker, stub upstream")
+    print(f"{'workers':>7} {'seconds':>8} {'codes/s':>8} {'speed-up':>9}")
+    base = None
+    for workers in (1, 2, 4, 8):
+        stats = run_workers(workers, codes, rate)
+        base = base or stats["codes_per_second"]
+        print(f"{workers:>7} {stats['seconds']:>8.2f} {stats['codes_per_second']:>8.1f} "
+              f"{stats['codes_per_second'] / base:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Local stub of the masothue.com search endpoint for offline benchmarks and tests
+
+Codes in the replay corpus (fixtures/corpus.json: recorded company, branch,
+no-results, blocked, captcha and malformed answers) are served their
+recorded page; any other code gets a generated company page.
+
+It can also simulate an upstream under pressure: added latency, a
+request-rate ceiling above which it answers 429, random failures at
+configurable rates, and a forced answer (403, captcha or empty page) for
+every request. With ``etags`` on it validates conditional requests (304).
+"""
+import collections
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fixtures")
+CORPUS_PATH = os.path.join(FIXTURES_DIR, "corpus.json")
+
+# Failure kinds for StubServer.error_rates and the answers they produce
+ERROR_KINDS = ("throttled", "blocked", "captcha", "error", "empty")
+
+
+def render_company_page(tax_code: str) -> str:
+    """Render a search result page shaped like masothue.com's company page"""
+    return f"""<!DOCTYPE html>
+<html lang="vi"><head><meta charset="utf-8"><title>{tax_code} - CÔNG TY TNHH MẪU</title>
+<script>var ads = [];</script></head>
+<body><div class="container"><section>
+<table class="table-taxinfo">
+<thead><tr><th colspan="2" itemprop="name"><span class="copy">CÔNG TY TNHH MẪU {tax_code}</span></th></tr></thead>
+<tbody>
+<tr><td><i class="fa fa-hashtag"></i> Mã số thuế</td><td itemprop="taxID"><span class="copy">{tax_code}</span></td></tr>
+<tr><td><i class="fa fa-map-marker"></i> Địa chỉ Thuế</td><td itemprop="address"><span class="copy">Số 1 Đường Mẫu, Phường Bến Nghé, Quận 1, TP Hồ Chí Minh</span></td></tr>
+<tr><td><i class="fa fa-map-marker"></i> Địa chỉ</td><td><span class="copy">Số 1 Đường Mẫu, Phường Sài Gòn, TP Hồ Chí Minh</span></td></tr>
+<tr><td><i class="fa fa-info"></i> Tình trạng</td><td><a href="#">Đang hoạt động (đã được cấp GCN ĐKT)</a></td></tr>
+<tr><td><i class="fa fa-user"></i> Người đại diện</td><td><span itemprop="name"><a href="#">NGUYỄN VĂN A</a></span><br>Ngoài ra NGUYỄN VĂN A còn đại diện các doanh nghiệp: <div class="ads"><ins>ad</ins></div></td></tr>
+<tr><td><i class="fa fa-phone"></i> Điện thoại</td><td><span class="copy">0901234567</span> Ẩn thông tin</td></tr>
+<tr><td><i class="fa fa-calendar"></i> Ngày hoạt động</td><td><span class="copy">2024-01-15</span></td></tr>
+<tr><td><i class="fa fa-users"></i> Quản lý bởi</td><td><span class="copy">Thuế cơ sở 1 Thành phố Hồ Chí Minh</span></td></tr>
+<tr><td><i class="fa fa-building"></i> Loại hình DN</td><td><a href="#">Công ty trách nhiệm hữu hạn ngoài NN</a></td></tr>
+</tbody></table>
+<h3 class="h3">Ngành nghề kinh doanh</h3>
+<table class="table">
+<thead><tr><th>Mã</th><th>Ngành</th></tr></thead>
+<tbody>
+<tr><td><a href="#">4649</a></td><td><a href="#">Bán buôn đồ dùng khác cho gia đình</a></td></tr>
+<tr><td><strong><a href="#">4659</a></strong></td><td><strong><a href="#">Bán buôn máy móc, thiết bị và phụ tùng máy khác</a></strong></td></tr>
+<tr><td><a href="#">6201</a></td><td><a href="#">Lập trình máy vi tính</a> Chi tiết: Sản xuất phần mềm</td></tr>
+</tbody></table>
+</section></div></body></html>"""
+
+
+CAPTCHA_PAGE = """<!DOCTYPE html>
+<html><head><title>Just a moment...</title></head>
+<body><form id="challenge-form"><div class="g-recaptcha" data-sitekey="stub"></div></form></body></html>"""
+
+EMPTY_PAGE = """<!DOCTYPE html>
+<html lang="vi"><head><meta charset="utf-8"><title>Tìm kiếm</title></head>
+<body><div class="container"><p>Không tìm thấy kết quả</p></div></body></html>"""
+
+
+def load_corpus(path: str = CORPUS_PATH) -> Dict[str, Tuple[int, str]]:
+    """
+    Load the replay corpus
+
+    Returns:
+        tax code -> (status, body) of its recorded answer
+    """
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    corpus = {}
+    for code, entry in manifest.items():
+        body = ""
+        if entry.get("page"):
+            with open(os.path.join(os.path.dirname(path), "pages", entry["page"]), encoding="utf-8") as f:
+                body = f.read()
+        corpus[code] = (entry.get("status", 200), body or "Forbidden")
+    return corpus
+
+
+def corpus_kinds(path: str = CORPUS_PATH) -> Dict[str, str]:
+    """tax code -> kind of recorded answer ("company", "branch", "captcha", ...)"""
+    with open(path, encoding="utf-8") as f:
+        return {code: entry["kind"] for code, entry in json.load(f).items()}
+
+
+def failure(kind: str) -> Tuple[int, str]:
+    """Status and body of one simulated failure"""
+    return {
+        "throttled": (429, "Too Many Requests"),
+        "blocked": (403, "Forbidden"),
+        "captcha": (200, CAPTCHA_PAGE),
+        "error": (503, "Service Unavailable"),
+        "empty": (200, EMPTY_PAGE),
+    }[kind]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Keep-alive handler that counts accepted TCP connections"""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; avoid Nagle/delayed-ACK stalls
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        tax_code = query.get("q", [""])[0]
+        status, body = self.server.respond(tax_code)
+        body = body.encode("utf-8")
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        etag = None
+        if self.server.etags and status == 200:
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+            if self.headers.get("If-None-Match") == etag:
+                status, body = 304, b""
+                with self.server.stats_lock:
+                    self.server.statuses[200] -= 1
+                    self.server.statuses[304] += 1
+
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+        if status == 429 and self.server.retry_after is not None:
+            self.send_header("Retry-After", str(self.server.retry_after))
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """Threaded stub server exposing connection/request counters"""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        handler=StubHandler,
+        corpus: Optional[Dict[str, Tuple[int, str]]] = None,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            host: Interface to listen on
+            port: Port (0 picks a free one)
+            handler: Request handler class
+            corpus: Recorded answers by tax code (see load_corpus); None serves generated pages only
+            seed: Seed for the random failures (error_rates)
+        """
+        super().__init__((host, port), handler)
+        self.stats_lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        # Simulated upstream behaviour (change at any time)
+        self.latency = 0.0          # seconds added to every answer
+        self.max_rate = None        # requests/second over the last second before answering 429
+        self.mode = None            # None, "blocked" (403), "captcha" or "empty" for every request
+        self.retry_after = None     # Retry-After header sent with 429s
+        self.etags = False          # send ETags with result pages and answer If-None-Match with 304
+        self.error_rates: Dict[str, float] = {}   # failure kind (ERROR_KINDS) -> fraction of requests
+        self.corpus = corpus or {}
+        self.random = random.Random(seed)
+        self.statuses = collections.Counter()
+        self._recent = collections.deque()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def respond(self, tax_code: str):
+        """Status and body for one request under the current behaviour"""
+        with self.stats_lock:
+            self.requests += 1
+            now = time.monotonic()
+            self._recent.append(now)
+            while self._recent and self._recent[0] < now - 1.0:
+                self._recent.popleft()
+            if self.max_rate is not None and len(self._recent) > self.max_rate:
+                status, body = 429, "Too Many Requests"
+            elif self.mode is not None:
+                status, body = failure(self.mode)
+            elif self.error_rates and (kind := self._random_failure()):
+                status, body = failure(kind)
+            elif tax_code in self.corpus:
+                status, body = self.corpus[tax_code]
+            else:
+                status, body = 200, render_company_page(tax_code)
+            self.statuses[status] += 1
+        return status, body
+
+    def _random_failure(self) -> Optional[str]:
+        # Called with stats_lock held
+        draw = self.random.random()
+        for kind, rate in self.error_rates.items():
+            if draw < rate:
+                return kind
+            draw -= rate
+        return None
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.connections = 0
+            self.requests = 0
+            self.statuses.clear()
+
+    def start(self) -> "StubServer":
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
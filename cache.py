@@ -0,0 +1,235 @@
+"""
+Persistent result cache for tax lookups
+
+An in-memory LRU sits in front of a SQLite store so repeated uploads of the
+same tax codes are served locally instead of being re-fetched from
+masothue.com. Successful lookups and error/empty lookups (``{"MST": code}``)
+have separate TTLs, and both tiers are size-bounded.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+CACHE_ENABLED = os.environ.get("CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+CACHE_PATH = os.environ.get("CACHE_PATH", "data/cache.sqlite3")
+CACHE_TTL = float(os.environ.get("CACHE_TTL", str(24 * 3600)))
+CACHE_ERROR_TTL = float(os.environ.get("CACHE_ERROR_TTL", "300"))
+CACHE_MEMORY_SIZE = int(os.environ.get("CACHE_MEMORY_SIZE", "1024"))
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "100000"))
+
+
+def cache_key(tax_code: str) -> str:
+    """Normalize a tax code into a cache key (drops all whitespace)"""
+    return re.sub(r"\s+", "", tax_code)
+
+
+def is_empty_result(info: Dict) -> bool:
+    """True for error/empty lookups such as {"MST": code} or {"MST": code, "Error": ...}"""
+    return "Error" in info or "Tên" not in info
+
+
+class ResultCache:
+    """
+    Two-tier (memory LRU + SQLite) cache of fetch_tax_info results
+
+    Thread-safe; a single instance is shared by all crawl threads.
+    """
+
+    def __init__(
+        self,
+        path: str = CACHE_PATH,
+        ttl: float = CACHE_TTL,
+        error_ttl: float = CACHE_ERROR_TTL,
+        memory_size: int = CACHE_MEMORY_SIZE,
+        max_entries: int = CACHE_MAX_ENTRIES
+    ):
+        """
+        Args:
+            path: SQLite database file (":memory:" keeps everything in RAM)
+            ttl: Seconds a successful lookup stays fresh
+            error_ttl: Seconds an error/empty lookup stays fresh
+            memory_size: Maximum entries in the in-memory LRU
+            max_entries: Maximum entries in the on-disk store
+        """
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._stats = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " tax_code TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " stored_at REAL NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_stored_at ON results (stored_at)")
+        self._disk_count = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def get(self, tax_code: str) -> Optional[Dict]:
+        """
+        Look up a fresh cached result
+
+        Args:
+            tax_code: Tax code to look up
+
+        Returns:
+            Copy of the cached result dict, or None on a miss
+        """
+        key = cache_key(tax_code)
+        now = time.time()
+
+        with self._lock:
+            expired = False
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, info = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats["hits"] += 1
+                    self._stats["memory_hits"] += 1
+                    return dict(info)
+                del self._memory[key]
+                expired = True
+
+            row = self._db.execute(
+                "SELECT data, expires_at FROM results WHERE tax_code = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                data, expires_at = row
+                if expires_at > now:
+                    info = json.loads(data)
+                    self._remember(key, expires_at, info)
+                    self._stats["hits"] += 1
+                    self._stats["disk_hits"] += 1
+                    return dict(info)
+                self._db.execute("DELETE FROM results WHERE tax_code = ?", (key,))
+                self._disk_count -= 1
+                expired = True
+
+            if expired:
+                self._stats["expired"] += 1
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, tax_code: str, info: Dict):
+        """
+        Store a lookup result, using the short TTL for error/empty results
+
+        Args:
+            tax_code: Tax code the result belongs to
+            info: Result dict from fetch_tax_info
+        """
+        key = cache_key(tax_code)
+        now = time.time()
+        ttl = self.error_ttl if is_empty_result(info) else self.ttl
+        if ttl <= 0:
+            return
+        expires_at = now + ttl
+
+        with self._lock:
+            self._remember(key, expires_at, dict(info))
+
+            exists = self._db.execute(
+                "SELECT 1 FROM results WHERE tax_code = ?", (key,)
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (tax_code, data, stored_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(info, ensure_ascii=False), now, expires_at)
+            )
+            if not exists:
+                self._disk_count += 1
+            self._evict_disk()
+
+    def invalidate(self, tax_code: str):
+        """Drop a tax code from both tiers"""
+        key = cache_key(tax_code)
+        with self._lock:
+            self._memory.pop(key, None)
+            deleted = self._db.execute("DELETE FROM results WHERE tax_code = ?", (key,)).rowcount
+            self._disk_count -= deleted
+
+    def clear(self):
+        """Drop every cached entry"""
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM results")
+            self._disk_count = 0
+
+    def stats(self) -> Dict:
+        """Hit/miss/eviction counters plus current sizes"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_entries"] = self._disk_count
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _remember(self, key: str, expires_at: float, info: Dict):
+        """Insert into the memory LRU, evicting the least recently used entry (lock held)"""
+        self._memory[key] = (expires_at, info)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+            self._stats["memory_evictions"] += 1
+
+    def _evict_disk(self):
+        """Trim the on-disk store down to max_entries, oldest first (lock held)"""
+        excess = self._disk_count - self.max_entries
+        if excess <= 0:
+            return
+        deleted = self._db.execute(
+            "DELETE FROM results WHERE tax_code IN ("
+            " SELECT tax_code FROM results ORDER BY stored_at LIMIT ?)",
+            (excess,)
+        ).rowcount
+        self._disk_count -= deleted
+        self._stats["disk_evictions"] += deleted
+
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[ResultCache]:
+    """
+    Get the process-wide result cache, creating it on first use
+
+    Returns:
+        Shared ResultCache, or None when CACHE_ENABLED is off
+    """
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache()
+    return _cache
@@ -0,0 +1,361 @@
+"""
+Command-line batch crawler
+
+    tax-crawler crawl input.csv -o out.parquet --concurrency 4 --rate 2 --resume
+
+Runs the same engine as the web app's jobs (input de-duplication, the shared
+scheduler, the adaptive throttle and the result cache) without the server.
+The input is read lazily and results are written to the output file in input
+order as soon as they are available (CSV, NDJSON, Parquet or XLSX). Every
+finished row is checkpointed in the job store, so ``--resume`` after an
+interruption only fetches the rows that are still missing and then rewrites
+the output from the checkpoint.
+
+Exit status: 0 on success, 1 when an error threshold (--max-errors,
+--max-error-rate) is exceeded, 2 on bad arguments or an unreadable input,
+130 when interrupted.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, Iterable, Iterator, Optional, TextIO, Tuple
+
+from exports import ExportError, export_csv, export_parquet, export_xlsx, ndjson_line
+from http_client import upstream_host
+from ingest import TAX_CODE_COLUMN, IngestError, file_format, open_tax_codes
+from job_store import JobStore, SQLiteJobStore, get_job_store
+from jobs import JOB_LEASE_SECONDS, WORKER_ID, JobLease, LeaseLost, iter_job_rows
+from logs import configure_logging
+from rate_limiter import get_rate_limiter
+from scheduler import SCHEDULER_WORKERS, configure_scheduler
+from tax_code import DedupStats
+from throttle import set_throttle_limits
+
+
+# Output format by file extension
+OUTPUT_FORMATS = {
+    ".csv": "csv",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".parquet": "parquet",
+    ".xlsx": "xlsx",
+}
+
+EXIT_OK = 0
+EXIT_ERRORS = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+# Seconds between progress bar redraws
+PROGRESS_INTERVAL = 0.1
+
+logger = logging.getLogger(__name__)
+
+
+class ErrorThresholdExceeded(Exception):
+    """Too many rows came back with an error"""
+
+
+class ProgressBar:
+    """Single-line progress bar with throughput and ETA, redrawn on a TTY only"""
+
+    def __init__(self, total: Optional[int], stream: TextIO, enabled: Optional[bool] = None):
+        """
+        Args:
+            total: Expected number of rows (None when unknown)
+            stream: Where to draw
+            enabled: Force drawing on/off (default: only when `stream` is a terminal)
+        """
+        self.total = total
+        self.stream = stream
+        self.enabled = stream.isatty() if enabled is None else enabled
+        self.started = time.monotonic()
+        self._drawn = 0.0
+
+    def update(self, done: int, errors: int, force: bool = False):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if not force and now - self._drawn < PROGRESS_INTERVAL:
+            return
+        self._drawn = now
+        elapsed = max(now - self.started, 1e-9)
+        rate = done / elapsed
+        if self.total:
+            fraction = min(done / self.total, 1.0)
+            filled = int(fraction * 30)
+            eta = (self.total - done) / rate if rate and done < self.total else 0
+            line = (f"\r{fraction * 100:5.1f}% [{'#' * filled}{'.' * (30 - filled)}] {done}/{self.total}"
+                    f"  {rate:.1f} codes/s  ETA {_duration(eta)}  errors {errors}")
+        else:
+            line = f"\r{done} rows  {rate:.1f} codes/s  errors {errors}"
+        self.stream.write(line)
+        self.stream.flush()
+
+    def close(self):
+        if self.enabled:
+            self.stream.write("\n")
+            self.stream.flush()
+
+
+def _duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def output_format(path: str, fmt: Optional[str] = None) -> str:
+    """Output format from --format or the output file's extension"""
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in OUTPUT_FORMATS:
+        raise ExportError(f"Cannot tell the output format of '{path}'; use --format")
+    return OUTPUT_FORMATS[ext]
+
+
+def count_rows(path: str) -> Optional[int]:
+    """Rows in a CSV/text input (header and blank lines excluded), or None for Excel"""
+    fmt = file_format(path)
+    if fmt == "xlsx":
+        return None
+    with open(path, "rb") as f:
+        rows = sum(1 for line in f if line.strip())
+    return max(rows - 1, 0) if fmt == "csv" else rows
+
+
+def checkpoint_id(input_path: str, output_path: str) -> str:
+    """Job id a run checkpoints under, stable for the same input and output"""
+    key = f"{os.path.abspath(input_path)}|{os.path.abspath(output_path)}"
+    return "cli-" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def input_identity(path: str) -> Dict:
+    """What a resumed run checks to make sure the input has not changed"""
+    st = os.stat(path)
+    return {"path": os.path.abspath(path), "size": st.st_size, "mtime": st.st_mtime}
+
+
+def write_output(rows: Iterable[Tuple[int, Dict]], path: str, fmt: str):
+    """
+    Write (index, result) rows, already in input order, to the output file
+
+    CSV and NDJSON are written row by row; Parquet in row batches; XLSX with
+    a write-only workbook.
+    """
+    if fmt == "csv":
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            for chunk in export_csv(info for _, info in rows):
+                f.write(chunk)
+    elif fmt == "ndjson":
+        with open(path, "w", encoding="utf-8") as f:
+            for idx, info in rows:
+                f.write(ndjson_line(idx, info))
+    elif fmt == "parquet":
+        export_parquet((info for _, info in rows), path)
+    elif fmt == "xlsx":
+        export_xlsx((info for _, info in rows), path)
+    else:
+        raise ExportError(f"Unknown output format '{fmt}'")
+
+
+def iter_in_order(
+    job_id: str,
+    rows: Iterator[Tuple[int, Dict]],
+    store: JobStore,
+    stats: DedupStats,
+    resumed: bool
+) -> Iterator[Tuple[int, Dict]]:
+    """
+    Checkpoint rows as they complete and re-emit them in input order
+
+    Rows finish out of order (concurrent fetches, duplicates fanned out
+    later); each is held only until every earlier row has been emitted.
+    On a resumed run, rows finished before the interruption are read back
+    from the checkpoint when their turn comes.
+    """
+    pending: Dict[int, Dict] = {}
+    next_row = 0
+
+    def ready() -> Iterator[Tuple[int, Dict]]:
+        nonlocal next_row
+        while True:
+            info = pending.pop(next_row, None)
+            if info is None and resumed:
+                info = store.get_result(job_id, next_row)
+            if info is None:
+                return
+            yield next_row, info
+            next_row += 1
+
+    for idx, info in rows:
+        store.add_result(job_id, idx, info)
+        pending[idx] = info
+        yield from ready()
+
+    yield from ready()
+    # Rows that finished before the interruption and come after the last new one
+    while next_row < stats.rows:
+        info = store.get_result(job_id, next_row)
+        yield next_row, info if info is not None else {"MST": "", "Error": "Missing from checkpoint"}
+        next_row += 1
+
+
+def crawl(args: argparse.Namespace, stream: Optional[TextIO] = None) -> int:
+    """Run `tax-crawler crawl`; returns the exit status (messages and the progress bar go to `stream`, default stderr)"""
+    stream = stream or sys.stderr
+    try:
+        fmt = output_format(args.output, args.format)
+        reader = open_tax_codes(open(args.input, "rb"), args.input)
+    except (ExportError, IngestError, OSError) as e:
+        stream.write(f"error: {e}\n")
+        return EXIT_USAGE
+
+    concurrency = args.concurrency or SCHEDULER_WORKERS
+    if args.concurrency:
+        configure_scheduler(concurrency)
+    if args.concurrency or args.rate is not None:
+        rate = args.rate if args.rate is not None else get_rate_limiter(upstream_host()).rate
+        set_throttle_limits(upstream_host(), rate, concurrency)
+
+    store = SQLiteJobStore(path=args.checkpoint) if args.checkpoint else get_job_store()
+    job_id = checkpoint_id(args.input, args.output)
+    identity = input_identity(args.input)
+    previous = store.get_progress(job_id)
+    resumed = bool(args.resume and previous is not None)
+    if resumed and previous.get("input") != identity:
+        reader.close()
+        stream.write("error: the input changed since the interrupted run; run again without --resume\n")
+        return EXIT_USAGE
+    if not resumed:
+        store.delete_job(job_id)
+    if not store.claim_job(job_id, WORKER_ID, JOB_LEASE_SECONDS):
+        reader.close()
+        stream.write(f"error: another run is working on {args.input} -> {args.output}\n")
+        return EXIT_USAGE
+
+    stats = DedupStats()
+    errors = 0
+    written = 0
+    bar = ProgressBar(count_rows(args.input), stream, enabled=None if args.progress else False)
+
+    def on_progress(current, total, code, status):
+        lease.check()
+
+    def counted(rows: Iterator[Tuple[int, Dict]]) -> Iterator[Tuple[int, Dict]]:
+        nonlocal errors, written
+        for idx, info in rows:
+            lease.check()
+            written += 1
+            if info.get("Error"):
+                errors += 1
+                if args.max_errors is not None and errors > args.max_errors:
+                    raise ErrorThresholdExceeded(f"more than {args.max_errors} rows failed")
+            bar.update(written, errors)
+            yield idx, info
+
+    store.set_progress(job_id, {"status": "processing", "input": identity, "output": os.path.abspath(args.output)})
+    started = time.monotonic()
+    status = EXIT_OK
+    rows = iter_job_rows(
+        job_id, reader, concurrency, on_progress, args.force_refresh, stats, resume=resumed, store=store
+    )
+    lease = JobLease(store, job_id).start()
+    try:
+        write_output(counted(iter_in_order(job_id, rows, store, stats, resumed)), args.output, fmt)
+    except ErrorThresholdExceeded as e:
+        bar.close()
+        stream.write(f"error: {e}; stopped (finish later with --resume)\n")
+        return EXIT_ERRORS
+    except ExportError as e:
+        bar.close()
+        stream.write(f"error: {e}\n")
+        return EXIT_USAGE
+    except LeaseLost:
+        bar.close()
+        stream.write(f"error: another run took over {args.input} -> {args.output}; stopped\n")
+        return EXIT_USAGE
+    except KeyboardInterrupt:
+        bar.close()
+        stream.write("interrupted (finish later with --resume)\n")
+        return EXIT_INTERRUPTED
+    finally:
+        rows.close()
+        reader.close()
+        lease.stop()
+        store.release_job(job_id, WORKER_ID)
+
+    bar.update(written, errors, force=True)
+    bar.close()
+    elapsed = time.monotonic() - started
+    store.set_progress(job_id, {"status": "completed", "input": identity, **stats.as_dict()})
+
+    error_rate = errors / written if written else 0.0
+    summary = {
+        **stats.as_dict(),
+        "written": written,
+        "errors": errors,
+        "error_rate": round(error_rate, 4),
+        "seconds": round(elapsed, 3),
+        "codes_per_sec": round(stats.unique / elapsed, 2) if elapsed else 0.0,
+        "output": args.output,
+    }
+    stream.write(
+        f"{written} rows -> {args.output} in {_duration(elapsed)} ({elapsed:.1f}s): "
+        f"{summary['codes_per_sec']} codes/s, {stats.unique} unique, {stats.duplicates} duplicates, "
+        f"{stats.invalid} invalid, {stats.resumed} resumed, {errors} errors ({error_rate:.1%})\n"
+    )
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    logger.info("cli_completed", extra={"job_id": job_id, **summary})
+
+    if args.max_error_rate is not None and error_rate > args.max_error_rate:
+        stream.write(f"error: {error_rate:.1%} of rows failed (limit {args.max_error_rate:.1%})\n")
+        status = EXIT_ERRORS
+    return status
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="tax-crawler", description="Crawl company data from masothue.com")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("crawl", help="Crawl every tax code of an input file into an output file")
+    run.add_argument("input", help=f"CSV/XLSX with a '{TAX_CODE_COLUMN}' column, or a text file with one code per line")
+    run.add_argument("-o", "--output", required=True, help="Output file (.csv, .ndjson/.jsonl, .parquet, .xlsx)")
+    run.add_argument("--format", choices=sorted(set(OUTPUT_FORMATS.values())),
+                     help="Output format (default: from the output extension)")
+    run.add_argument("--concurrency", type=int, default=None,
+                     help="Fetches in flight at once (default: SCHEDULER_WORKERS)")
+    run.add_argument("--rate", type=float, default=None,
+                     help="Highest requests per second to the upstream (0: unlimited; default: RATE_LIMIT_PER_SECOND)")
+    run.add_argument("--resume", action="store_true",
+                     help="Continue an interrupted run of the same input and output")
+    run.add_argument("--force-refresh", action="store_true", help="Ignore the result cache")
+    run.add_argument("--checkpoint", help="SQLite file for the checkpoint (default: the job store)")
+    run.add_argument("--max-errors", type=int, default=None,
+                     help="Stop with status 1 once more than this many rows failed")
+    run.add_argument("--max-error-rate", type=float, default=None,
+                     help="Exit with status 1 if more than this fraction of rows failed")
+    run.add_argument("--summary", help="Also write the run summary as JSON to this file")
+    run.add_argument("--no-progress", dest="progress", action="store_false", help="Don't draw the progress bar")
+    run.add_argument("--log-level", default="WARNING", help="Log level (logs go to stderr)")
+    return parser
+
+
+def main(argv: Optional[list] = None) -> int:
+    """Entry point of the tax-crawler command"""
+    args = build_parser().parse_args(argv)
+    configure_logging(level=args.log_level)
+    if args.concurrency is not None and args.concurrency < 1:
+        sys.stderr.write("error: --concurrency must be at least 1\n")
+        return EXIT_USAGE
+    return crawl(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
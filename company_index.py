@@ -0,0 +1,268 @@
+"""
+Local searchable index of crawled companies
+
+Every successful lookup (single, batch job, pipeline or refresh) is upserted
+into a SQLite database, so what has already been crawled can be searched
+without asking masothue.com:
+
+- an FTS5 table over the tax code, name, addresses and managing tax office
+  (unicode61 with diacritics removed, so "cong ty" finds "CÔNG TY"; "Đ" is
+  folded to "D" before indexing and querying since unicode61 leaves it alone)
+- a secondary (industry code, tax code) index for "who is in industry 6201"
+
+The latest result dict is stored as-is, so search results have the same
+shape as lookups.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+import metrics
+from cache import cache_key, is_empty_result
+from tax_parser import parse_industries
+
+
+COMPANY_INDEX_ENABLED = os.environ.get("COMPANY_INDEX_ENABLED", "true").lower() not in ("0", "false", "no")
+COMPANY_INDEX_PATH = os.environ.get("COMPANY_INDEX_PATH", "data/companies.sqlite3")
+SEARCH_PAGE_SIZE = int(os.environ.get("SEARCH_PAGE_SIZE", "20"))
+SEARCH_MAX_PAGE_SIZE = int(os.environ.get("SEARCH_MAX_PAGE_SIZE", "100"))
+
+# FTS columns a free-text query is matched against
+_QUERY_COLUMNS = "{tax_code name address}"
+_WORD_RE = re.compile(r"\w+")
+
+logger = logging.getLogger(__name__)
+
+
+def _fold(text: str) -> str:
+    """Fold the letters unicode61 does not strip diacritics from"""
+    return text.replace("Đ", "D").replace("đ", "d")
+
+
+def fts_query(text: str) -> Optional[str]:
+    """
+    Turn free user text into a safe FTS5 expression
+
+    Every word must match (as a prefix); FTS syntax in the input is ignored.
+
+    Returns:
+        The expression, or None when the text has no words
+    """
+    words = _WORD_RE.findall(_fold(text or ""))
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class CompanyIndex:
+    """
+    SQLite/FTS5 index of the latest known record of each company
+
+    Thread-safe; a single instance is shared by all crawl threads.
+    """
+
+    def __init__(self, path: str = COMPANY_INDEX_PATH):
+        """
+        Args:
+            path: SQLite database file (":memory:" keeps everything in RAM)
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS companies ("
+            " tax_code TEXT PRIMARY KEY,"
+            " name TEXT NOT NULL,"
+            " data TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS companies_fts USING fts5("
+            " tax_code, name, address, managed_by,"
+            " tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS industries ("
+            " code TEXT NOT NULL,"
+            " tax_code TEXT NOT NULL,"
+            " main INTEGER NOT NULL,"
+            " PRIMARY KEY (code, tax_code)) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS industries_tax_code ON industries (tax_code)")
+
+    def add(self, info: Dict) -> bool:
+        """
+        Insert or replace a company's record
+
+        Args:
+            info: Result dict from fetch_tax_info
+
+        Returns:
+            False (and nothing stored) for error/empty results
+        """
+        if is_empty_result(info) or not info.get("MST"):
+            return False
+        code = cache_key(info["MST"])
+        address = "\n".join(filter(None, (info.get("Địa chỉ thuế"), info.get("Địa chỉ"))))
+        industries = parse_industries(info.get("Ngành nghề kinh doanh", ""))
+
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                row = self._db.execute("SELECT rowid FROM companies WHERE tax_code = ?", (code,)).fetchone()
+                data = json.dumps(info, ensure_ascii=False)
+                if row is None:
+                    rowid = self._db.execute(
+                        "INSERT INTO companies (tax_code, name, data, updated_at) VALUES (?, ?, ?, ?)",
+                        (code, info.get("Tên", ""), data, time.time())
+                    ).lastrowid
+                else:
+                    rowid = row[0]
+                    self._db.execute(
+                        "UPDATE companies SET name = ?, data = ?, updated_at = ? WHERE rowid = ?",
+                        (info.get("Tên", ""), data, time.time(), rowid)
+                    )
+                    self._db.execute("DELETE FROM companies_fts WHERE rowid = ?", (rowid,))
+                    self._db.execute("DELETE FROM industries WHERE tax_code = ?", (code,))
+                self._db.execute(
+                    "INSERT INTO companies_fts (rowid, tax_code, name, address, managed_by) VALUES (?, ?, ?, ?, ?)",
+                    (rowid, code, _fold(info.get("Tên", "")), _fold(address), _fold(info.get("Quản lý bởi", "")))
+                )
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO industries (code, tax_code, main) VALUES (?, ?, ?)",
+                    [(ind["Mã ngành"], code, int(ind["Đậm"])) for ind in industries]
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return True
+
+    def get(self, tax_code: str) -> Optional[Dict]:
+        """The indexed record of a company, or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM companies WHERE tax_code = ?", (cache_key(tax_code),)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def search(
+        self,
+        query: Optional[str] = None,
+        industry: Optional[str] = None,
+        managed_by: Optional[str] = None,
+        main_industry: bool = False,
+        page: int = 1,
+        page_size: int = SEARCH_PAGE_SIZE
+    ) -> Dict:
+        """
+        Search indexed companies; all given filters must match
+
+        Args:
+            query: Words matched (as prefixes, accents optional) against tax code, name and addresses
+            industry: Industry code ("Mã ngành"), exact
+            managed_by: Words matched against the managing tax office ("Quản lý bởi")
+            main_industry: Only companies whose main industry is `industry`
+            page: 1-based page number
+            page_size: Results per page (capped at SEARCH_MAX_PAGE_SIZE)
+
+        Returns:
+            {"results": [result dicts], "total", "page", "page_size", "pages"};
+            full-text matches are ordered by relevance, the rest by name
+        """
+        page = max(1, page)
+        page_size = max(1, min(page_size, SEARCH_MAX_PAGE_SIZE))
+
+        match = []
+        text = fts_query(query)
+        if text:
+            match.append(f"{_QUERY_COLUMNS} : ({text})")
+        office = fts_query(managed_by)
+        if office:
+            match.append(f"managed_by : ({office})")
+
+        joins, where, params = "", [], []
+        if match:
+            joins = " JOIN companies_fts ON companies_fts.rowid = companies.rowid"
+            where.append("companies_fts MATCH ?")
+            params.append(" AND ".join(match))
+        if industry:
+            where.append(
+                "companies.tax_code IN (SELECT tax_code FROM industries WHERE code = ?"
+                + (" AND main = 1)" if main_industry else ")")
+            )
+            params.append(industry.strip())
+        clause = joins + (" WHERE " + " AND ".join(where) if where else "")
+        order = "companies_fts.rank" if match else "companies.name, companies.tax_code"
+
+        with self._lock:
+            total = self._db.execute(f"SELECT COUNT(*) FROM companies{clause}", params).fetchone()[0]
+            rows = self._db.execute(
+                f"SELECT companies.data FROM companies{clause} ORDER BY {order} LIMIT ? OFFSET ?",
+                params + [page_size, (page - 1) * page_size]
+            ).fetchall()
+        return {
+            "results": [json.loads(data) for data, in rows],
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "pages": (total + page_size - 1) // page_size,
+        }
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM companies").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_index: Optional[CompanyIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_company_index() -> Optional[CompanyIndex]:
+    """
+    Get the process-wide company index, creating it on first use
+
+    Returns:
+        Shared CompanyIndex, or None when COMPANY_INDEX_ENABLED is off
+    """
+    global _index
+    if not COMPANY_INDEX_ENABLED:
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = CompanyIndex()
+    return _index
+
+
+def index_result(info: Dict):
+    """Add a fresh lookup result to the shared index (no-op when disabled; never raises)"""
+    index = get_company_index()
+    if index is None:
+        return
+    try:
+        index.add(info)
+    except sqlite3.Error as e:
+        logger.warning("index_failed", extra={"tax_code": info.get("MST"), "error": str(e)})
+
+
+def _index_metrics():
+    """Indexed company count (scrape-time collector)"""
+    if _index is not None:
+        yield ("crawler_indexed_companies", "gauge", "Companies in the local search index",
+               [({}, _index.count())])
+
+
+metrics.REGISTRY.register_collector(_index_metrics)
@@ -0,0 +1,9 @@
+"""
+Pytest configuration: keep tests hermetic
+"""
+import os
+
+# Tests count upstream requests, so the shared on-disk result cache must stay off
+os.environ.setdefault("CACHE_ENABLED", "false")
+# Crawled companies are indexed in memory rather than under data/
+os.environ.setdefault("COMPANY_INDEX_PATH", ":memory:")
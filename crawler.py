@@ -1,226 +1,679 @@
 """
 Tax information crawler module
 """
-import re
+import asyncio
+import logging
+import os
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import httpx
 import requests
-from typing import Dict, List
-from bs4 import BeautifulSoup
 
+import metrics
+from cache import ResultCache, get_cache
+from company_index import index_result
+from http_client import (
+    BACKOFF_FACTOR, MAX_RETRIES, REQUEST_TIMEOUT, RETRY_STATUS_CODES, get_async_client, get_session,
+    search_url, upstream_host
+)
+from rate_limiter import TokenBucket, get_rate_limiter
+from singleflight import get_single_flight
+from tax_parser import parse_result_timed
+from throttle import (
+    ADAPTIVE_THROTTLE, ERROR, OK, AdaptiveThrottle, UpstreamError, classify_response, get_throttle,
+    retry_after_seconds
+)
+
+
+# Retries of a throttled/blocked/captcha answer, and the base wait before them (doubles each time)
+UPSTREAM_BLOCK_RETRIES = int(os.environ.get("UPSTREAM_BLOCK_RETRIES", "2"))
+UPSTREAM_BLOCK_BACKOFF = float(os.environ.get("UPSTREAM_BLOCK_BACKOFF", "2"))
+
+logger = logging.getLogger(__name__)
+
+
+class CodeFeed:
+    """
+    Iterator over input tax codes that counts how many have been read
+
+    Lets the batch crawlers take a lazily read input (e.g. an upload being
+    parsed): ``total`` is the input's length when it has one, otherwise the
+    number of codes read so far, which is exact once the input is exhausted.
+    """
+
+    def __init__(self, tax_codes: Iterable[str]):
+        self._codes = iter(tax_codes)
+        self._size = len(tax_codes) if hasattr(tax_codes, "__len__") else None
+        self.read = 0
+
+    def __iter__(self) -> "CodeFeed":
+        return self
+
+    def __next__(self) -> str:
+        code = next(self._codes)
+        self.read += 1
+        return code
 
-def crawl_tax_code(tax_code: str) -> Dict:
+    @property
+    def total(self) -> int:
+        return self._size if self._size is not None else self.read
+
+
+def crawl_tax_code(
+    tax_code: str,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    force_refresh: bool = False
+) -> Dict:
     """
     Crawl tax information for a given tax code
     
     Args:
         tax_code: The tax code to search for
+        session: HTTP session to use (defaults to the shared pooled session)
+        rate_limiter: Token bucket to draw from (defaults to the shared per-host one)
+        force_refresh: Bypass the result cache and re-fetch from upstream
         
     Returns:
         Dictionary containing tax information
     """
     # Use crawl_multiple_tax_codes for single tax code
-    results = crawl_multiple_tax_codes([tax_code])
+    results = crawl_multiple_tax_codes(
+        [tax_code], session=session, rate_limiter=rate_limiter, force_refresh=force_refresh
+    )
     return results[0] if results else {"MST": tax_code}
 
 
-def fetch_tax_info(tax_code: str) -> Dict:
+def fetch_tax_info(
+    tax_code: str,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    force_refresh: bool = False,
+    cache: Optional[ResultCache] = None
+) -> Dict:
     """
-    Fetch tax information for a single tax code using requests
+    Fetch tax information for a single tax code, served from the result cache when fresh
+
+    Concurrent calls for the same code (afetch_tax_info ones too) are
+    coalesced into one upstream fetch.
 
     Args:
         tax_code: The tax code to search for
+        session: HTTP session to use (defaults to the shared pooled session)
+        rate_limiter: Token bucket to draw from (defaults to the shared per-host one)
+        force_refresh: Skip the cache lookup and re-fetch from upstream
+        cache: Result cache to use (defaults to the shared one, if enabled)
 
     Returns:
         Dictionary containing tax information
     """
-    url = f"https://masothue.com/Search/?type=auto&q={tax_code}"
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0 Safari/537.36",
-        "Referer": "https://masothue.com/",
-        "Accept-Language": "vi,en;q=0.9"
-    }
-
+    cache = cache or get_cache()
+
+    if cache is not None and not force_refresh:
+        cached = cache.get(tax_code)
+        if cached is not None:
+            metrics.LOOKUPS.labels("cache").inc()
+            logger.debug("cache_hit", extra={"tax_code": tax_code})
+            return cached
+
+    # Callers asking for the same code at the same time share one upstream fetch
+    return get_single_flight().do(tax_code, lambda: _fetch_and_store(tax_code, session, rate_limiter, cache))
+
+
+def _fetch_and_store(
+    tax_code: str,
+    session: Optional[requests.Session],
+    rate_limiter: Optional[TokenBucket],
+    cache: Optional[ResultCache]
+) -> Dict:
+    metrics.LOOKUPS.labels("upstream").inc()
     try:
-        r = requests.get(url, headers=headers, timeout=10)
-        r.encoding = "utf-8"
-        html = r.text
-
-        # Split HTML by "Ngành nghề kinh doanh" to separate two tables
-        html_parts = html.rsplit('Ngành nghề kinh doanh', 1)
-
-        if len(html_parts) < 2:
-            print(f"✗ Cannot split HTML for {tax_code}")
-            return {"MST": tax_code}
-
-        html, html2 = html_parts
-        match = re.search(r"<table.*?>.*?</table>", html, re.DOTALL | re.IGNORECASE)
-        match2 = re.search(r"<table.*?>.*?</table>", html2, re.DOTALL | re.IGNORECASE)
-
-        if not match:
-            print(f"✗ No company info table found for {tax_code}")
-            return {"MST": tax_code}
-
-        table_html = match.group(0)
-
-        # ==== TABLE 1: Company Information ====
-        soup = BeautifulSoup(table_html, "html5lib")
-
-        # Remove junk tags
-        for tag in soup(["script", "style", "ins", "iframe", "div"]):
-            tag.decompose()
-
-        info = {}
-
-        # Get company name
-        name_tag = soup.select_one("th[colspan='2'] span.copy")
-        if name_tag:
-            info["Tên"] = name_tag.get_text(strip=True)
-
-        # Parse all table rows
-        for tr in soup.select("table.table-taxinfo tr"):
-            tds = tr.find_all("td")
-            if len(tds) < 2:
-                continue
-            key = tds[0].get_text(strip=True)
-            val = tds[1].get_text(" ", strip=True)
-
-            if "Mã số thuế" in key:
-                info["MST"] = val
-            elif "Địa chỉ Thuế" in key:
-                info["Địa chỉ thuế"] = val
-            elif re.fullmatch(r"Địa chỉ", key):
-                info["Địa chỉ"] = val
-            elif "Tình trạng" in key:
-                info["Tình trạng"] = val
-            elif "Người đại diện" in key:
-                rep = tds[1].find("span", {"itemprop": "name"})
-                info["Người đại diện"] = rep.get_text(strip=True) if rep else val
-            elif "Điện thoại" in key:
-                info["Điện thoại"] = val.split("Ẩn")[0].strip()
-            elif "Ngày hoạt động" in key:
-                info["Ngày hoạt động"] = val
-            elif "Quản lý bởi" in key:
-                info["Quản lý bởi"] = val
-            elif "Loại hình DN" in key:
-                info["Loại hình DN"] = val
-
-        # ==== TABLE 2: Industries (Ngành nghề kinh doanh) ====
-        if match2:
-            table_html2 = match2.group(0)
-            soup2 = BeautifulSoup(table_html2, "html5lib")
-            industries = []
-
-            for tr in soup2.select("tbody tr"):
-                tds = tr.find_all("td")
-                if len(tds) < 2:
-                    continue
-                is_main = bool(tr.find("strong"))
-                code = tds[0].get_text(strip=True)
-                raw_text = tds[1].get_text(" ", strip=True)
-                parts = raw_text.split("Chi tiết:", 1)
-                name = parts[0].strip()
-                detail = parts[1].strip() if len(parts) > 1 else ""
-                industries.append({
-                    "Mã ngành": code,
-                    "Ngành": name,
-                    "Chi tiết": detail,
-                    "Đậm": is_main
-                })
-
-            # Format industries as multi-line string with bold markers
-            formatted_industries = []
-            for ind in industries:
-                prefix = "**" if ind["Đậm"] else ""
-                suffix = "**" if ind["Đậm"] else ""
-                line = f"{prefix}{ind['Mã ngành']} - {ind['Ngành']}{suffix}"
-                if ind["Chi tiết"]:
-                    line += f" | Chi tiết: {ind['Chi tiết']}"
-                formatted_industries.append(line)
-
-            # Join with newlines
-            info["Ngành nghề kinh doanh"] = "\n".join(formatted_industries)
-
-        print(f"✓ Crawled: {tax_code}")
-        return info
+        html = download_page(tax_code, session, rate_limiter)
+    except UpstreamError as e:
+        logger.warning("upstream_refused", extra={"tax_code": tax_code, "outcome": e.outcome, "error": str(e)})
+        info = {"MST": tax_code, "Error": str(e)}
+        if e.retryable:
+            # Being blocked says nothing about the company; don't remember it
+            return info
+    except Exception as e:
+        logger.warning("fetch_failed", extra={"tax_code": tax_code, "error": str(e)})
+        info = {"MST": tax_code, "Error": str(e)}
+    else:
+        info = _parse_and_index(tax_code, html)
+
+    if cache is not None:
+        cache.set(tax_code, info)
+    return info
+
+
+def _parse(tax_code: str, html: bytes) -> Dict:
+    info, seconds = parse_result_timed(tax_code, html)
+    metrics.PARSE_SECONDS.observe(seconds)
+    if metrics.TRACE_SPANS:
+        metrics.span("parse", seconds, tax_code=tax_code)
+    return info
+
+
+def _parse_and_index(tax_code: str, html: bytes) -> Dict:
+    """Parse a result page and add the company to the local search index"""
+    info = _parse(tax_code, html)
+    index_result(info)
+    return info
+
+
+def _observe_request(tax_code: str, outcome: str, waited: float, latency: float):
+    """Record one upstream request: politeness wait, latency and outcome class"""
+    metrics.RATE_LIMIT_WAIT_SECONDS.observe(waited)
+    metrics.FETCH_SECONDS.observe(latency)
+    metrics.UPSTREAM_RESPONSES.labels(outcome).inc()
+    if metrics.TRACE_SPANS:
+        metrics.span("rate_limit", waited, tax_code=tax_code)
+        metrics.span("fetch", latency, tax_code=tax_code, outcome=outcome)
+
+
+def download_page(
+    tax_code: str,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    throttle: Optional[AdaptiveThrottle] = None,
+    block_retries: Optional[int] = None,
+    block_backoff: Optional[float] = None
+) -> bytes:
+    """
+    Download the raw masothue.com search page for a tax code
+
+    Each answer is classified; anything but a result page raises
+    UpstreamError. Throttled/blocked/captcha answers are retried after a
+    backoff (Retry-After when given). With the shared rate limiter, requests
+    go through the host's adaptive throttle, which learns from every outcome.
+
+    Args:
+        tax_code: The tax code to search for
+        session: HTTP session to use (defaults to the shared pooled session)
+        rate_limiter: Token bucket to draw from (defaults to the shared per-host one)
+        throttle: Adaptive throttle to report to (defaults to the host's one
+            when rate_limiter is not given and ADAPTIVE_THROTTLE is on)
+        block_retries: Retries of a throttled/blocked/captcha answer (default UPSTREAM_BLOCK_RETRIES)
+        block_backoff: Seconds before the first such retry, doubling each time
+            (default UPSTREAM_BLOCK_BACKOFF)
+
+    Returns:
+        Response body as bytes
 
+    Raises:
+        UpstreamError: The answer was not a result page (see throttle.py outcomes)
+        requests.RequestException: The request failed after retries
+    """
+    return _get_page(tax_code, session, rate_limiter, throttle, block_retries, block_backoff).content
+
+
+def download_page_if_changed(
+    tax_code: str,
+    validators: Optional[Dict[str, str]] = None,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[TokenBucket] = None
+) -> Tuple[Optional[bytes], Dict[str, str]]:
+    """
+    Conditionally re-download a page we have seen before
+
+    Sends If-None-Match / If-Modified-Since built from the validators the
+    upstream gave last time (if it gave any); a 304 answer means the page
+    is unchanged and has no body to download or parse. Throttling, retries
+    and errors are as for download_page.
+
+    Args:
+        tax_code: The tax code to search for
+        validators: {"etag", "last_modified"} from the previous answer (missing or empty: unconditional)
+        session: HTTP session to use (defaults to the shared pooled session)
+        rate_limiter: Token bucket to draw from (defaults to the shared per-host one)
+
+    Returns:
+        (body, or None when not modified; the answer's validators, the old ones on a 304)
+    """
+    validators = validators or {}
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    r = _get_page(tax_code, session, rate_limiter, headers=headers or None)
+    if r.status_code == 304:
+        return None, dict(validators)
+    fresh = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+    return r.content, {key: value for key, value in fresh.items() if value}
+
+
+def _get_page(
+    tax_code: str,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    throttle: Optional[AdaptiveThrottle] = None,
+    block_retries: Optional[int] = None,
+    block_backoff: Optional[float] = None,
+    headers: Optional[Dict[str, str]] = None
+) -> requests.Response:
+    """download_page returning the whole response (a 200 result page or a 304)"""
+    session = session or get_session()
+    if throttle is None and rate_limiter is None and ADAPTIVE_THROTTLE:
+        throttle = get_throttle(upstream_host())
+    rate_limiter = rate_limiter or (throttle.bucket if throttle else get_rate_limiter(upstream_host()))
+    block_retries = UPSTREAM_BLOCK_RETRIES if block_retries is None else block_retries
+    block_backoff = UPSTREAM_BLOCK_BACKOFF if block_backoff is None else block_backoff
+
+    for attempt in range(block_retries + 1):
+        queued = time.monotonic()
+        if throttle:
+            throttle.acquire()
+        outcome = ERROR
+        sent = False
+        start = time.monotonic()
+        try:
+            rate_limiter.acquire()
+            start = time.monotonic()
+            metrics.UPSTREAM_IN_FLIGHT.inc()
+            sent = True
+            r = session.get(search_url(tax_code), headers=headers, timeout=REQUEST_TIMEOUT)
+            outcome = classify_response(r.status_code, r.content)
+        finally:
+            latency = time.monotonic() - start
+            if throttle:
+                throttle.release(outcome, latency)
+            if sent:
+                metrics.UPSTREAM_IN_FLIGHT.dec()
+            _observe_request(tax_code, outcome, start - queued, latency)
+
+        if outcome == OK:
+            return r
+        time.sleep(_block_retry_wait(outcome, r.status_code, r.headers, attempt, block_retries, block_backoff))
+
+
+def _block_retry_wait(outcome: str, status: int, headers, attempt: int, block_retries: int, block_backoff: float) -> float:
+    """Seconds to wait before retrying a non-result answer; raises UpstreamError when it should not be retried"""
+    retry_after = retry_after_seconds(headers.get("Retry-After"))
+    error = UpstreamError(outcome, status, retry_after)
+    if not error.retryable or attempt == block_retries:
+        raise error
+    return retry_after if retry_after is not None else block_backoff * 2 ** attempt
+
+
+async def afetch_tax_info(
+    tax_code: str,
+    client: Optional[httpx.AsyncClient] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    force_refresh: bool = False,
+    cache: Optional[ResultCache] = None,
+    interactive: bool = True
+) -> Dict:
+    """
+    Async fetch_tax_info for use inside an event loop (the web handlers)
+
+    Waits for rate limit tokens and upstream answers without blocking the
+    loop; cache reads/writes and parsing run on worker threads. Shares the
+    result cache, token buckets and adaptive throttle with the threaded
+    crawler, so the global request budget still holds, but takes throttle
+    slots ahead of it: a lookup someone is waiting on only waits for the
+    requests already in flight, not for queued bulk work. Concurrent calls
+    for the same code, here or in the threaded crawler, share one upstream
+    fetch.
+
+    Args:
+        tax_code: The tax code to search for
+        client: Async HTTP client (defaults to the loop's shared one)
+        rate_limiter: Token bucket to draw from (defaults to the shared per-host one)
+        force_refresh: Skip the cache lookup and re-fetch from upstream
+        cache: Result cache to use (defaults to the shared one, if enabled)
+        interactive: Take throttle slots ahead of bulk fetches
+
+    Returns:
+        Dictionary containing tax information
+    """
+    cache = cache or get_cache()
+
+    if cache is not None and not force_refresh:
+        # SQLite reads (behind a lock shared with the crawl threads) stay off the loop
+        cached = await asyncio.to_thread(cache.get, tax_code)
+        if cached is not None:
+            metrics.LOOKUPS.labels("cache").inc()
+            logger.debug("cache_hit", extra={"tax_code": tax_code})
+            return cached
+
+    return await get_single_flight().do_async(
+        tax_code, lambda: _afetch_and_store(tax_code, client, rate_limiter, cache, interactive)
+    )
+
+
+async def _afetch_and_store(
+    tax_code: str,
+    client: Optional[httpx.AsyncClient],
+    rate_limiter: Optional[TokenBucket],
+    cache: Optional[ResultCache],
+    interactive: bool
+) -> Dict:
+    metrics.LOOKUPS.labels("upstream").inc()
+    try:
+        html = await adownload_page(tax_code, client, rate_limiter, interactive=interactive)
+    except UpstreamError as e:
+        logger.warning("upstream_refused", extra={"tax_code": tax_code, "outcome": e.outcome, "error": str(e)})
+        info = {"MST": tax_code, "Error": str(e)}
+        if e.retryable:
+            return info
     except Exception as e:
-        print(f"✗ Error crawling {tax_code}: {e}")
-        return {"MST": tax_code, "Error": str(e)}
+        logger.warning("fetch_failed", extra={"tax_code": tax_code, "error": str(e)})
+        info = {"MST": tax_code, "Error": str(e) or type(e).__name__}
+    else:
+        # Parsing (CPU-bound) and the index upsert run on a thread so other handlers keep going
+        info = await asyncio.to_thread(_parse_and_index, tax_code, html)
+
+    if cache is not None:
+        await asyncio.to_thread(cache.set, tax_code, info)
+    return info
+
+
+async def adownload_page(
+    tax_code: str,
+    client: Optional[httpx.AsyncClient] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    throttle: Optional[AdaptiveThrottle] = None,
+    block_retries: Optional[int] = None,
+    block_backoff: Optional[float] = None,
+    interactive: bool = True
+) -> bytes:
+    """
+    Async download_page: same classification, throttling and retries
 
+    5xx answers are retried here (up to HTTP_MAX_RETRIES, exponential
+    backoff), matching what the sync session's urllib3 Retry does. With
+    `interactive` the throttle slot is taken ahead of bulk fetches.
 
-def crawl_multiple_tax_codes_with_progress(
-    tax_codes: List[str],
+    Raises:
+        UpstreamError: The answer was not a result page
+        httpx.HTTPError: The request failed after retries
+    """
+    client = client or get_async_client()
+    if throttle is None and rate_limiter is None and ADAPTIVE_THROTTLE:
+        throttle = get_throttle(upstream_host())
+    rate_limiter = rate_limiter or (throttle.bucket if throttle else get_rate_limiter(upstream_host()))
+    block_retries = UPSTREAM_BLOCK_RETRIES if block_retries is None else block_retries
+    block_backoff = UPSTREAM_BLOCK_BACKOFF if block_backoff is None else block_backoff
+
+    attempt = 0
+    server_errors = 0
+    while True:
+        queued = time.monotonic()
+        if throttle:
+            await throttle.acquire_async(interactive)
+        outcome = ERROR
+        sent = False
+        start = time.monotonic()
+        try:
+            await rate_limiter.acquire_async()
+            start = time.monotonic()
+            metrics.UPSTREAM_IN_FLIGHT.inc()
+            sent = True
+            r = await client.get(search_url(tax_code))
+            outcome = classify_response(r.status_code, r.content)
+        finally:
+            latency = time.monotonic() - start
+            if throttle:
+                throttle.release(outcome, latency)
+            if sent:
+                metrics.UPSTREAM_IN_FLIGHT.dec()
+            _observe_request(tax_code, outcome, start - queued, latency)
+
+        if outcome == OK:
+            return r.content
+        if r.status_code in RETRY_STATUS_CODES and server_errors < MAX_RETRIES:
+            await asyncio.sleep(BACKOFF_FACTOR * 2 ** server_errors)
+            server_errors += 1
+            continue
+        await asyncio.sleep(_block_retry_wait(outcome, r.status_code, r.headers, attempt, block_retries, block_backoff))
+        attempt += 1
+
+
+def _crawl_concurrently(
+    tax_codes: Iterable[str],
+    concurrency: int,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    force_refresh: bool = False,
+    on_start: Optional[Callable[[int, str], None]] = None,
+    fetch: Callable[..., Dict] = fetch_tax_info
+) -> Iterator[Tuple[int, Dict]]:
+    """
+    Fetch tax codes on a bounded thread pool, yielding results as they finish
+
+    At most `concurrency` fetches are in flight at once; pacing comes from the
+    shared rate limiter inside fetch_tax_info. Callbacks run on the calling
+    thread, never on pool threads.
+
+    Args:
+        tax_codes: Tax codes to search for (read lazily, as fetch slots free up)
+        concurrency: Maximum number of concurrent fetches
+        session: HTTP session to use (defaults to the shared pooled session)
+        rate_limiter: Token bucket to draw from (defaults to the shared per-host one)
+        force_refresh: Bypass the result cache and re-fetch from upstream
+        on_start: Called with (index, code) when a fetch is submitted
+        fetch: Called as fetch(code, session, rate_limiter, force_refresh) on a pool thread
+
+    Yields:
+        (input index, result dict) in completion order
+    """
+    concurrency = max(1, concurrency)
+    pending = {}
+    queued = iter(enumerate(tax_codes))
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="crawl") as pool:
+        def submit_next() -> bool:
+            for idx, code in queued:
+                code = code.strip()
+                if on_start:
+                    on_start(idx, code)
+                future = pool.submit(fetch, code, session, rate_limiter, force_refresh)
+                pending[future] = idx
+                return True
+            return False
+
+        for _ in range(concurrency):
+            if not submit_next():
+                break
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx = pending.pop(future)
+                submit_next()
+                yield idx, future.result()
+
+
+def iter_crawl_tax_codes(
+    tax_codes: Iterable[str],
     batch_size: int = 3,
-    delay_range: tuple = (2, 5),
-    progress_callback = None
-) -> List[Dict]:
+    progress_callback = None,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    force_refresh: bool = False
+) -> Iterator[Tuple[int, Dict]]:
     """
-    Crawl tax information with progress tracking
+    Crawl tax information concurrently, yielding each result as it finishes
+
+    Nothing is accumulated, so memory stays flat however many codes there
+    are. The input is read lazily, so it can be a generator over a file that
+    is still being parsed (progress totals then grow as codes are read).
+    Closing the generator stops submitting new fetches.
 
     Args:
-        tax_codes: List of tax codes to search for
-        batch_size: Not used in synchronous version (kept for compatibility)
-        delay_range: Delay range between requests in seconds
+        tax_codes: Tax codes to search for (list or any iterable)
+        batch_size: Number of concurrent fetches
         progress_callback: Callback function(current, total, code, status)
+        session: HTTP session to use (defaults to the shared pooled session)
+        rate_limiter: Token bucket to draw from (defaults to the shared per-host one)
+        force_refresh: Bypass the result cache and re-fetch from upstream
 
-    Returns:
-        List of dictionaries containing tax information
+    Yields:
+        (input index, result dict) in completion order
     """
-    results = []
-    total = len(tax_codes)
+    feed = CodeFeed(tax_codes)
+    in_flight: Dict[int, str] = {}
+    completed = 0
 
     # Notify initialization start
     if progress_callback:
-        progress_callback(0, total, '', 'Starting crawl...')
-
-    for idx, tax_code in enumerate(tax_codes):
-        tax_code = tax_code.strip()
+        progress_callback(0, feed.total, '', 'Starting crawl...')
 
+    def on_start(idx: int, tax_code: str):
+        in_flight[idx] = tax_code
         if progress_callback:
-            progress_callback(idx, total, tax_code, f"Crawling {tax_code}...")
+            progress_callback(completed, feed.total, tax_code, f"Crawling {tax_code}...")
 
-        info = fetch_tax_info(tax_code)
-        results.append(info)
+    for idx, info in _crawl_concurrently(
+        feed, batch_size, session, rate_limiter, force_refresh, on_start
+    ):
+        completed += 1
+        tax_code = in_flight.pop(idx)
+        yield idx, info
 
         if progress_callback:
-            progress_callback(idx + 1, total, tax_code, f"Completed {idx + 1}/{total}")
+            progress_callback(completed, feed.total, tax_code, f"Completed {completed}/{feed.total}")
 
-        # Delay between requests (except last one)
-        if idx < total - 1:
-            import random
-            delay = random.uniform(*delay_range)
-            if progress_callback:
-                progress_callback(idx + 1, total, '', f"Waiting {delay:.1f}s before next request...")
-            print(f"Waiting {delay:.1f}s before next request...")
-            time.sleep(delay)
 
-    return results
+async def aiter_crawl_tax_codes(
+    tax_codes: Iterable[str],
+    batch_size: int = 3,
+    progress_callback = None,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    force_refresh: bool = False
+) -> AsyncIterator[Tuple[int, Dict]]:
+    """
+    Async-iterator variant of iter_crawl_tax_codes for use inside an event loop
+
+    The crawl runs on a worker thread; progress_callback is called on that
+    thread. Same arguments as iter_crawl_tax_codes.
+
+    Yields:
+        (input index, result dict) in completion order
+    """
+    results = iter_crawl_tax_codes(
+        tax_codes, batch_size, progress_callback, session, rate_limiter, force_refresh
+    )
+    async for item in iterate_in_thread(results):
+        yield item
+
+
+async def iterate_in_thread(iterator: Iterator, buffer: int = 16) -> AsyncIterator:
+    """
+    Drive a blocking iterator on a worker thread and yield its items asynchronously
+
+    At most `buffer` items are held between the producer and the consumer,
+    so a slow consumer slows the producer down instead of growing memory.
+    If the consumer stops early the iterator is closed.
+    """
+    loop = asyncio.get_running_loop()
+    items: asyncio.Queue = asyncio.Queue(maxsize=max(1, buffer))
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for item in iterator:
+                if stop.is_set():
+                    break
+                asyncio.run_coroutine_threadsafe(items.put((item, None)), loop).result()
+        except BaseException as e:
+            error = e
+        else:
+            error = None
+        finally:
+            close = getattr(iterator, "close", None)
+            if close:
+                close()
+        if not stop.is_set():
+            asyncio.run_coroutine_threadsafe(items.put((done, error)), loop).result()
+
+    producer = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item, error = await items.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                break
+            yield item
+    finally:
+        stop.set()
+        # Unblock a producer waiting on a full queue
+        while not items.empty():
+            items.get_nowait()
+        await producer
 
 
-def crawl_multiple_tax_codes(tax_codes: List[str], batch_size: int = 3, delay_range: tuple = (2, 5)) -> List[Dict]:
+def crawl_multiple_tax_codes_with_progress(
+    tax_codes: List[str],
+    batch_size: int = 3,
+    delay_range: tuple = (2, 5),
+    progress_callback = None,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    force_refresh: bool = False,
+    result_callback = None
+) -> List[Dict]:
     """
-    Crawl tax information for multiple tax codes sequentially
+    Crawl tax information concurrently with progress tracking
 
     Args:
         tax_codes: List of tax codes to search for
-        batch_size: Not used in synchronous version (kept for compatibility)
-        delay_range: Delay range between requests in seconds (min, max)
+        batch_size: Number of concurrent fetches
+        delay_range: Not used; pacing comes from the shared rate limiter (kept for compatibility)
+        progress_callback: Callback function(current, total, code, status)
+        session: HTTP session to use (defaults to the shared pooled session)
+        rate_limiter: Token bucket to draw from (defaults to the shared per-host one)
+        force_refresh: Bypass the result cache and re-fetch from upstream
+        result_callback: Callback function(index, result) as each code completes
 
     Returns:
-        List of dictionaries containing tax information
+        List of dictionaries containing tax information, in input order
     """
-    import random
-    results = []
+    results: List[Optional[Dict]] = [None] * len(tax_codes)
+
+    for idx, info in iter_crawl_tax_codes(
+        tax_codes, batch_size, progress_callback, session, rate_limiter, force_refresh
+    ):
+        results[idx] = info
+        if result_callback:
+            result_callback(idx, info)
+
+    return results
+
 
-    for idx, code in enumerate(tax_codes):
-        info = fetch_tax_info(code.strip())
-        if info:
-            results.append(info)
+def crawl_multiple_tax_codes(
+    tax_codes: List[str],
+    batch_size: int = 3,
+    delay_range: tuple = (2, 5),
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    force_refresh: bool = False
+) -> List[Dict]:
+    """
+    Crawl tax information for multiple tax codes concurrently
+
+    Args:
+        tax_codes: List of tax codes to search for
+        batch_size: Number of concurrent fetches
+        delay_range: Not used; pacing comes from the shared rate limiter (kept for compatibility)
+        session: HTTP session to use (defaults to the shared pooled session)
+        rate_limiter: Token bucket to draw from (defaults to the shared per-host one)
+        force_refresh: Bypass the result cache and re-fetch from upstream
+
+    Returns:
+        List of dictionaries containing tax information, in input order
+    """
+    results: List[Optional[Dict]] = [None] * len(tax_codes)
 
-        # Delay between requests (except last one)
-        if idx < len(tax_codes) - 1:
-            delay = random.uniform(*delay_range)
-            print(f"Waiting {delay:.1f}s before next request...")
-            time.sleep(delay)
+    for idx, info in _crawl_concurrently(tax_codes, batch_size, session, rate_limiter, force_refresh):
+        results[idx] = info
 
     return results
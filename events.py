@@ -0,0 +1,273 @@
+"""
+Push-based job progress events for the SSE endpoint
+
+The crawl engine publishes a small progress event per tax code. Each event
+is appended to the job's event log in the job store (so any worker can
+serve it and a reconnecting client can resume from ``Last-Event-ID``) and
+handed to the in-process EventBroker, which wakes the SSE streams waiting
+on that job. Streams read new events from the broker's recent-events buffer
+and only go to the job store when they have fallen behind it or the job is
+being run by another worker process (checked every ``SSE_POLL_INTERVAL``);
+when nothing happens they send a heartbeat comment instead of re-sending the
+same progress.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from job_store import JobStore, get_job_store
+
+
+# Seconds of silence before an SSE heartbeat comment is sent
+SSE_HEARTBEAT_INTERVAL = float(os.environ.get("SSE_HEARTBEAT_INTERVAL", "15"))
+# Seconds a stream waits for a wakeup before checking the job store itself
+# (picks up events published by other worker processes)
+SSE_POLL_INTERVAL = float(os.environ.get("SSE_POLL_INTERVAL", "1"))
+# Minimum seconds between progress messages on one stream; bursts in between
+# are coalesced to the newest event (each event is a full progress snapshot)
+SSE_MIN_INTERVAL = float(os.environ.get("SSE_MIN_INTERVAL", "0.5"))
+# Milliseconds the browser waits before reconnecting a dropped stream
+SSE_RETRY_MS = int(os.environ.get("SSE_RETRY_MS", "2000"))
+
+FINAL_STATUSES = ("completed", "error")
+
+
+def is_final(event: Dict) -> bool:
+    """True for the last event of a job"""
+    return event.get("status") in FINAL_STATUSES
+
+
+class EventBroker:
+    """In-process fan-out of job events to waiting SSE streams"""
+
+    def __init__(self, buffer_size: int = 256, max_jobs: int = 1000):
+        """
+        Args:
+            buffer_size: Recent events kept in memory per job
+            max_jobs: Jobs tracked at once (least recently published dropped first)
+        """
+        self.buffer_size = buffer_size
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._recent: "OrderedDict[str, deque]" = OrderedDict()
+        self._waiters: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+
+    def publish(self, job_id: str, seq: int, event: Dict):
+        """Record a published event and wake its waiters (safe from any thread)"""
+        with self._lock:
+            recent = self._recent.get(job_id)
+            if recent is None or (recent and recent[-1][0] != seq - 1):
+                # First event seen here, or a gap (published by another process)
+                recent = deque(maxlen=self.buffer_size)
+            recent.append((seq, event))
+            self._recent[job_id] = recent
+            self._recent.move_to_end(job_id)
+            while len(self._recent) > self.max_jobs:
+                self._recent.popitem(last=False)
+            waiters = self._waiters.pop(job_id, [])
+
+        for loop, wakeup in waiters:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                pass  # loop already closed
+
+    def recent_since(self, job_id: str, after: int) -> Optional[List[Tuple[int, Dict]]]:
+        """
+        Buffered events newer than `after`
+
+        Returns:
+            The events (possibly empty), or None when the buffer does not
+            reach back to `after` and the job store has to be read instead
+        """
+        with self._lock:
+            recent = self._recent.get(job_id)
+            if not recent or recent[0][0] > after + 1:
+                return None
+            return [(seq, event) for seq, event in recent if seq > after]
+
+    async def wait(self, job_id: str, after: int, timeout: float) -> bool:
+        """
+        Wait until an event newer than `after` is published for the job
+
+        Returns:
+            True if woken by a publish, False on timeout
+        """
+        wakeup = asyncio.Event()
+        with self._lock:
+            recent = self._recent.get(job_id)
+            if recent and recent[-1][0] > after:
+                return True
+            self._waiters.setdefault(job_id, []).append((asyncio.get_running_loop(), wakeup))
+
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(job_id)
+                if waiters:
+                    waiters[:] = [w for w in waiters if w[1] is not wakeup]
+                    if not waiters:
+                        del self._waiters[job_id]
+
+
+_broker = EventBroker()
+
+
+def get_broker() -> EventBroker:
+    """Get the process-wide event broker"""
+    return _broker
+
+
+def publish_progress(job_id: str, progress: Dict, store: Optional[JobStore] = None,
+                     broker: Optional[EventBroker] = None) -> int:
+    """
+    Save a job's progress and push it to the job's event stream
+
+    Args:
+        job_id: Job (session) id
+        progress: Progress record (status, total, completed, current, message, ...)
+        store: Job store to write to (defaults to the shared one)
+        broker: Event broker to notify (defaults to the shared one)
+
+    Returns:
+        Sequence id of the published event
+    """
+    store = store or get_job_store()
+    broker = broker or _broker
+    store.set_progress(job_id, progress)
+    seq = store.append_event(job_id, progress)
+    broker.publish(job_id, seq, progress)
+    return seq
+
+
+def _latest_event(store: JobStore, job_id: str) -> Optional[Tuple[int, Dict]]:
+    """Newest (seq, event) of a job, falling back to its bare progress record"""
+    seq = store.last_event_id(job_id)
+    if seq:
+        events = store.get_events(job_id, seq - 1, 1)
+        if events:
+            return events[0]
+    progress = store.get_progress(job_id)
+    return (0, progress) if progress is not None else None
+
+
+async def wait_for_final(
+    job_id: str,
+    store: Optional[JobStore] = None,
+    broker: Optional[EventBroker] = None,
+    poll: float = SSE_POLL_INTERVAL
+) -> Optional[Dict]:
+    """
+    Wait without blocking the event loop until a job completes or fails
+
+    Returns:
+        The job's final progress record, or None if the job is unknown/expired
+    """
+    store = store or get_job_store()
+    broker = broker or get_broker()
+    while True:
+        seq = await asyncio.to_thread(store.last_event_id, job_id)
+        progress = await asyncio.to_thread(store.get_progress, job_id)
+        if progress is None or is_final(progress):
+            return progress
+        await broker.wait(job_id, seq, poll)
+
+
+def format_event(event: Dict, seq: Optional[int] = None) -> str:
+    """Encode one SSE message"""
+    lines = f"id: {seq}\n" if seq is not None else ""
+    return f"{lines}data: {json.dumps(event)}\n\n"
+
+
+async def stream_events(
+    job_id: str,
+    last_event_id: Optional[int] = None,
+    store: Optional[JobStore] = None,
+    broker: Optional[EventBroker] = None,
+    heartbeat: float = SSE_HEARTBEAT_INTERVAL,
+    poll: float = SSE_POLL_INTERVAL,
+    min_interval: float = SSE_MIN_INTERVAL
+) -> AsyncIterator[str]:
+    """
+    SSE messages for a job, ending after its completed/error event
+
+    A new subscriber gets the current progress once and then each change
+    after it; a reconnecting one (``last_event_id``) resumes after the last
+    event it saw. Events arriving less than ``min_interval`` apart are
+    coalesced into the newest one; the final event is sent immediately.
+
+    Args:
+        job_id: Job (session) id
+        last_event_id: Last sequence id the client received, from Last-Event-ID
+        store: Job store to read from (defaults to the shared one)
+        broker: Event broker to wait on (defaults to the shared one)
+        heartbeat: Seconds of silence before a heartbeat comment
+        poll: Seconds between job store checks while no wakeup arrives
+        min_interval: Minimum seconds between progress messages
+
+    Yields:
+        Encoded SSE messages
+    """
+    store = store or get_job_store()
+    broker = broker or _broker
+
+    yield f"retry: {SSE_RETRY_MS}\n\n"
+    last_sent = time.monotonic()
+    last_data = 0.0
+
+    after = last_event_id
+    waiting_sent = False
+    while after is None:
+        snapshot = await asyncio.to_thread(_latest_event, store, job_id)
+        if snapshot is not None:
+            seq, progress = snapshot
+            yield format_event(progress, seq)
+            last_sent = last_data = time.monotonic()
+            if is_final(progress):
+                return
+            after = seq
+        else:
+            if not waiting_sent:
+                yield format_event({'status': 'waiting', 'message': 'Waiting for task...'})
+                last_sent = time.monotonic()
+                waiting_sent = True
+            elif time.monotonic() - last_sent >= heartbeat:
+                yield ": heartbeat\n\n"
+                last_sent = time.monotonic()
+            await broker.wait(job_id, 0, poll)
+
+    while True:
+        # Jobs running in this process are served from the broker's buffer;
+        # anything else (another worker, or a client far behind) from the store
+        events = broker.recent_since(job_id, after)
+        local = events is not None
+        if not local:
+            events = await asyncio.to_thread(store.get_events, job_id, after)
+
+        if events:
+            seq, event = events[-1]
+            backoff = min_interval - (time.monotonic() - last_data)
+            if backoff > 0 and not is_final(event):
+                await asyncio.sleep(backoff)
+                continue
+            yield format_event(event, seq)
+            after = seq
+            last_sent = last_data = time.monotonic()
+            if is_final(event):
+                return
+
+        if not events:
+            idle = time.monotonic() - last_sent
+            if idle >= heartbeat:
+                yield ": heartbeat\n\n"
+                last_sent = time.monotonic()
+                idle = 0
+            await broker.wait(job_id, after, heartbeat - idle if local else min(poll, heartbeat - idle))
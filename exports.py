@@ -0,0 +1,188 @@
+"""
+Job result exports
+
+Results are read from the job store and encoded row by row, so a download
+never builds the whole table (or a DataFrame copy of it) in memory:
+
+- CSV is streamed straight to the response
+- XLSX is written by openpyxl's write-only workbook; column widths come
+  from a sample of the first rows
+- Parquet is written in row batches with pyarrow (optional dependency)
+
+``tail_results`` follows a job while it is still running: it emits the rows
+stored so far, then waits on the job's progress events for more, and ends
+once the job has completed and every row has been sent.
+"""
+import asyncio
+import csv
+import io
+import itertools
+import json
+from typing import AsyncIterator, Dict, Iterable, Iterator, Optional, Tuple
+
+from events import EventBroker, SSE_POLL_INTERVAL, get_broker, is_final
+from job_store import JobStore, get_job_store
+from tax_parser import RESULT_FIELDS
+
+
+STREAM_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+EXPORT_FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Rows used to size XLSX columns, and the width cap
+WIDTH_SAMPLE_ROWS = 200
+MAX_COLUMN_WIDTH = 50
+
+PARQUET_BATCH_ROWS = 1000
+
+
+class ExportError(Exception):
+    """An export format cannot be produced here (e.g. missing optional dependency)"""
+
+
+def ndjson_line(index: int, result: Dict) -> str:
+    """One result as a JSON line, tagged with its input position"""
+    return json.dumps({"index": index, **result}, ensure_ascii=False) + "\n"
+
+
+def csv_header(with_index: bool = True) -> str:
+    """CSV header row, prefixed with a BOM so Excel reads the file as UTF-8"""
+    return "\ufeff" + csv_row((["index"] if with_index else []) + RESULT_FIELDS)
+
+
+def csv_row(values: Iterable) -> str:
+    buf = io.StringIO()
+    csv.writer(buf).writerow(values)
+    return buf.getvalue()
+
+
+def csv_result_row(index: int, result: Dict, with_index: bool = True) -> str:
+    values = [result.get(field, "") for field in RESULT_FIELDS]
+    return csv_row([index] + values if with_index else values)
+
+
+def export_csv(rows: Iterable[Dict]) -> Iterator[str]:
+    """Encode results as CSV chunks (header first), one chunk per row"""
+    yield csv_header(with_index=False)
+    for result in rows:
+        yield csv_result_row(0, result, with_index=False)
+
+
+def export_xlsx(rows: Iterable[Dict], path: str):
+    """
+    Write results to an Excel file without holding them all in memory
+
+    Args:
+        rows: Result dicts, in the order they should appear
+        path: Output .xlsx path
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    from openpyxl.utils import get_column_letter
+
+    rows = iter(rows)
+    sample = list(itertools.islice(rows, WIDTH_SAMPLE_ROWS))
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Tax Results")
+
+    # Write-only sheets need column widths before the first row
+    for col, field in enumerate(RESULT_FIELDS, start=1):
+        width = max([len(field)] + [_display_width(result.get(field)) for result in sample]) + 2
+        sheet.column_dimensions[get_column_letter(col)].width = min(width, MAX_COLUMN_WIDTH)
+
+    sheet.append(RESULT_FIELDS)
+    for result in itertools.chain(sample, rows):
+        sheet.append([
+            ILLEGAL_CHARACTERS_RE.sub("", str(result[field])) if result.get(field) is not None else None
+            for field in RESULT_FIELDS
+        ])
+    workbook.save(path)
+
+
+def export_parquet(rows: Iterable[Dict], path: str, batch_rows: int = PARQUET_BATCH_ROWS):
+    """
+    Write results to a Parquet file, `batch_rows` rows at a time
+
+    Raises:
+        ExportError: pyarrow is not installed
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("Parquet export needs pyarrow (pip install -e \".[parquet]\")")
+
+    schema = pa.schema([(field, pa.string()) for field in RESULT_FIELDS])
+    rows = iter(rows)
+    with pq.ParquetWriter(path, schema) as writer:
+        while True:
+            batch = list(itertools.islice(rows, batch_rows))
+            if not batch:
+                break
+            columns = {
+                field: [None if result.get(field) is None else str(result[field]) for result in batch]
+                for field in RESULT_FIELDS
+            }
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+
+def _display_width(value) -> int:
+    """Width of the longest line of a cell value"""
+    if value is None:
+        return 0
+    return max(len(line) for line in str(value).split("\n"))
+
+
+async def tail_results(
+    job_id: str,
+    fmt: str = "ndjson",
+    store: Optional[JobStore] = None,
+    broker: Optional[EventBroker] = None,
+    poll: float = SSE_POLL_INTERVAL
+) -> AsyncIterator[str]:
+    """
+    Stream a job's results in completion order as they are stored
+
+    Args:
+        job_id: Job (session) id
+        fmt: "ndjson" or "csv"
+        store: Job store to read from (defaults to the shared one)
+        broker: Event broker to wait on (defaults to the shared one)
+        poll: Seconds between job store checks while no wakeup arrives
+
+    Yields:
+        Encoded chunks (a CSV header first, then one chunk per batch of rows)
+    """
+    store = store or get_job_store()
+    broker = broker or get_broker()
+    encode = ndjson_line if fmt == "ndjson" else csv_result_row
+
+    if fmt == "csv":
+        yield csv_header()
+
+    cursor = 0
+    while True:
+        seq, progress, rows, cursor = await asyncio.to_thread(_read_batch, store, job_id, cursor)
+        if rows:
+            yield "".join(encode(idx, result) for idx, result in rows)
+            continue
+        if progress is None or is_final(progress):
+            return
+        await broker.wait(job_id, seq, poll)
+
+
+def _read_batch(store: JobStore, job_id: str, cursor: int) -> Tuple[int, Optional[Dict], list, int]:
+    # Event id and progress are read before the rows, so a row stored after
+    # this read always comes with a newer event that ends the wait
+    seq = store.last_event_id(job_id)
+    progress = store.get_progress(job_id)
+    rows, cursor = store.get_results_since(job_id, cursor)
+    return seq, progress, rows, cursor
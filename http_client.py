@@ -0,0 +1,173 @@
+"""
+Shared HTTP transport for the crawler
+
+A single pooled ``requests.Session`` is reused by every lookup so connections
+to masothue.com stay alive between tax codes instead of paying a fresh
+TCP+TLS handshake per request. Async code (the web handlers) uses a pooled
+``httpx.AsyncClient`` per event loop with the same headers and limits.
+"""
+import asyncio
+import os
+import threading
+import weakref
+from typing import Optional
+from urllib.parse import urlparse
+
+import httpx
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+
+
+BASE_URL = os.environ.get("MASOTHUE_BASE_URL", "https://masothue.com").rstrip("/")
+
+# Connection pool tuning (overridable through the environment)
+POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", "4"))
+POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "10"))
+MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "3"))
+BACKOFF_FACTOR = float(os.environ.get("HTTP_BACKOFF_FACTOR", "0.5"))
+REQUEST_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "10"))
+
+# 429 is not retried here: the adaptive throttle (throttle.py) needs to see it to back off
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0 Safari/537.36",
+    "Referer": "https://masothue.com/",
+    "Accept-Language": "vi,en;q=0.9",
+    # Advertises br only when a brotli decoder is installed
+    "Accept-Encoding": ACCEPT_ENCODING,
+    "Connection": "keep-alive",
+}
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def create_session(
+    pool_connections: int = POOL_CONNECTIONS,
+    pool_maxsize: int = POOL_MAXSIZE,
+    max_retries: int = MAX_RETRIES,
+    backoff_factor: float = BACKOFF_FACTOR
+) -> requests.Session:
+    """
+    Build a pooled keep-alive session with retry and backoff
+
+    Args:
+        pool_connections: Number of per-host connection pools to cache
+        pool_maxsize: Maximum connections kept alive per host
+        max_retries: Retries on connection resets and 5xx responses
+        backoff_factor: Exponential backoff factor between retries (seconds)
+
+    Returns:
+        Configured requests.Session
+    """
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=retry,
+        pool_block=False,
+    )
+
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Get the process-wide shared session, creating it on first use
+
+    Returns:
+        Shared requests.Session
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def close_session():
+    """Close the shared session and drop its pooled connections"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def create_async_client(
+    pool_maxsize: int = POOL_MAXSIZE,
+    max_retries: int = MAX_RETRIES
+) -> httpx.AsyncClient:
+    """
+    Build a pooled keep-alive async client
+
+    Connection failures are retried by the transport; 5xx answers are
+    retried by the caller (crawler.adownload_page) with backoff.
+
+    Args:
+        pool_maxsize: Maximum connections kept alive
+        max_retries: Retries on connection failures
+
+    Returns:
+        Configured httpx.AsyncClient
+    """
+    return httpx.AsyncClient(
+        headers=DEFAULT_HEADERS,
+        timeout=REQUEST_TIMEOUT,
+        limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize),
+        transport=httpx.AsyncHTTPTransport(retries=max_retries),
+        follow_redirects=True,
+    )
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Get the shared async client of the running event loop, creating it on first use
+
+    Returns:
+        httpx.AsyncClient bound to the current loop
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = _async_clients[loop] = create_async_client()
+    return client
+
+
+async def close_async_client():
+    """Close the running loop's shared async client"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def search_url(tax_code: str) -> str:
+    """Build the masothue.com search URL for a tax code"""
+    return f"{BASE_URL}/Search/?type=auto&q={tax_code}"
+
+
+def upstream_host() -> str:
+    """Host name of the upstream search site (used to key rate limiters)"""
+    return urlparse(BASE_URL).netloc
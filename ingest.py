@@ -0,0 +1,175 @@
+"""
+Streaming ingestion of uploaded tax code files
+
+Uploads are read row by row instead of loading the whole file into a
+DataFrame, so memory stays flat however large the file is and the crawl can
+start on the first codes while the rest of the file is still being read.
+
+Supported inputs:
+- CSV (``.csv``): must have a ``dinh_danh_doanh_nghiep`` column
+- Excel (``.xlsx``/``.xlsm``): first sheet, same column (read-only mode)
+- Plain text (``.txt``): one tax code per line
+"""
+import csv
+import io
+import itertools
+import os
+import re
+from typing import BinaryIO, Iterator, Optional
+
+
+TAX_CODE_COLUMN = "dinh_danh_doanh_nghiep"
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TEXT_LINE_SPLIT_RE = re.compile(r"[,;\t ]")
+
+
+class IngestError(ValueError):
+    """The uploaded file cannot be read as a list of tax codes"""
+
+
+def normalize_code(value) -> Optional[str]:
+    """
+    Turn one cell into a tax code string, or None if it is blank
+
+    Excel stores code columns that were not formatted as Text as numbers,
+    which drops the leading zero; whole numbers are turned back into
+    10-digit codes.
+    """
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, int):
+        return str(value).zfill(10)
+    code = _WHITESPACE_RE.sub("", str(value))
+    return code or None
+
+
+class TaxCodeReader:
+    """
+    Iterator over the tax codes in an uploaded file
+
+    The header and first code are read when the reader is created, so a
+    malformed or empty file fails right away (IngestError); the rest of the
+    file is read lazily as the crawl asks for more codes.
+    """
+
+    def __init__(self, fileobj: BinaryIO, filename: str = ""):
+        """
+        Args:
+            fileobj: Binary file positioned at the start of the upload
+            filename: Original file name, used to pick the format
+        """
+        self.fileobj = fileobj
+        self.format = file_format(filename)
+        self.rows_read = 0
+
+        if self.format == "xlsx":
+            codes = self._xlsx_codes()
+        elif self.format == "txt":
+            codes = self._text_codes()
+        else:
+            codes = self._csv_codes()
+
+        try:
+            first = next(codes)
+        except StopIteration:
+            self.close()
+            raise IngestError(f"No tax codes found in '{TAX_CODE_COLUMN}' column")
+        self._codes = itertools.chain([first], codes)
+
+    def __iter__(self) -> Iterator[str]:
+        return self
+
+    def __next__(self) -> str:
+        try:
+            return next(self._codes)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        if not self.fileobj.closed:
+            self.fileobj.close()
+
+    def _csv_codes(self) -> Iterator[str]:
+        text = io.TextIOWrapper(self.fileobj, encoding="utf-8-sig", errors="replace", newline="")
+        rows = csv.reader(text)
+        header = next(rows, None)
+        if not header:
+            raise IngestError("CSV file is empty")
+        column = _column_index(header, "CSV")
+        return self._codes_from_rows(rows, column)
+
+    def _xlsx_codes(self) -> Iterator[str]:
+        from openpyxl import load_workbook
+
+        try:
+            workbook = load_workbook(self.fileobj, read_only=True, data_only=True)
+        except Exception as e:
+            raise IngestError(f"Cannot read Excel file: {e}")
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if not header:
+            workbook.close()
+            raise IngestError("Excel file is empty")
+        column = _column_index(header, "Excel")
+
+        def codes():
+            try:
+                yield from self._codes_from_rows(rows, column)
+            finally:
+                workbook.close()
+        return codes()
+
+    def _text_codes(self) -> Iterator[str]:
+        text = io.TextIOWrapper(self.fileobj, encoding="utf-8-sig", errors="replace")
+        for line in text:
+            self.rows_read += 1
+            code = normalize_code(_TEXT_LINE_SPLIT_RE.split(line.strip(), 1)[0])
+            # Skip a header line or anything else without digits
+            if code and any(c.isdigit() for c in code):
+                yield code
+
+    def _codes_from_rows(self, rows, column: int) -> Iterator[str]:
+        for row in rows:
+            self.rows_read += 1
+            if column < len(row):
+                code = normalize_code(row[column])
+                if code:
+                    yield code
+
+
+def _column_index(header, kind: str) -> int:
+    names = [str(name).strip() if name is not None else "" for name in header]
+    if TAX_CODE_COLUMN not in names:
+        raise IngestError(f"{kind} file must have '{TAX_CODE_COLUMN}' column")
+    return names.index(TAX_CODE_COLUMN)
+
+
+def file_format(filename: str) -> str:
+    """Input format from the file extension: "csv", "xlsx" or "txt" (default "csv")"""
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext in (".xlsx", ".xlsm"):
+        return "xlsx"
+    if ext == ".txt":
+        return "txt"
+    return "csv"
+
+
+def open_tax_codes(fileobj: BinaryIO, filename: str = "") -> TaxCodeReader:
+    """
+    Start reading tax codes from an uploaded file
+
+    Args:
+        fileobj: Binary file positioned at the start of the upload
+        filename: Original file name, used to pick the format
+
+    Returns:
+        TaxCodeReader yielding normalized tax codes in file order
+
+    Raises:
+        IngestError: Unsupported content, missing column or no codes
+    """
+    return TaxCodeReader(fileobj, filename)
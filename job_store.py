@@ -0,0 +1,651 @@
+"""
+Durable job store for crawl progress and results
+
+Replaces the in-process ``progress_store`` dict so any uvicorn worker can
+serve ``/progress/{session_id}`` and ``/results/{session_id}`` and jobs
+survive a restart. Two backends share one interface:
+
+- SQLiteJobStore: a single node (all workers on one host/volume)
+- RedisJobStore: anything speaking the Redis protocol (``USE_REDIS=true``)
+
+Jobs expire ``JOB_TTL`` seconds after their last update.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+JOB_TTL = int(os.environ.get("JOB_TTL", str(24 * 3600)))
+JOB_STORE_PATH = os.environ.get("JOB_STORE_PATH", "data/jobs.sqlite3")
+USE_REDIS = os.environ.get("USE_REDIS", "false").lower() in ("1", "true", "yes")
+REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.environ.get("REDIS_PORT", "6379"))
+# Result keys the Redis store keeps a sorted index for; paging by them costs the same at any depth
+REDIS_SORT_KEYS = tuple(k for k in os.environ.get("REDIS_SORT_KEYS", "Tên,Tình trạng,Quản lý bởi").split(",") if k)
+# Largest job the Redis store filters (or sorts by an unindexed key) by scanning its results
+REDIS_QUERY_SCAN_MAX = int(os.environ.get("REDIS_QUERY_SCAN_MAX", "20000"))
+
+
+def sort_position(result: Dict, index: int, sort: Optional[str] = None) -> Tuple[str, int]:
+    """Where a result sits in a listing sorted by `sort`: (sort value, input index)"""
+    return (str(result.get(sort) or "") if sort else "", index)
+
+
+def _matches(result: Dict, filters: Optional[Dict[str, str]], errors: Optional[bool]) -> bool:
+    if errors is not None and bool(result.get("Error")) != errors:
+        return False
+    return all(text.casefold() in str(result.get(key) or "").casefold() for key, text in (filters or {}).items())
+
+
+def _json_path(key: str) -> str:
+    """SQLite JSON path of a top-level result key"""
+    return '$."' + key.replace('"', '\\"') + '"'
+
+
+def _casefold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+class JobStore:
+    """Interface shared by the job store backends"""
+
+    def set_progress(self, job_id: str, progress: Dict):
+        """Create or replace a job's progress record and refresh its TTL"""
+        raise NotImplementedError
+
+    def get_progress(self, job_id: str) -> Optional[Dict]:
+        """Current progress record, or None if the job is unknown or expired"""
+        raise NotImplementedError
+
+    def add_result(self, job_id: str, index: int, result: Dict):
+        """Store the result for the tax code at input position `index`"""
+        raise NotImplementedError
+
+    def get_result(self, job_id: str, index: int) -> Optional[Dict]:
+        """The stored result at input position `index`, if any"""
+        raise NotImplementedError
+
+    def get_results(self, job_id: str) -> List[Dict]:
+        """All stored results of a job, in input order"""
+        raise NotImplementedError
+
+    def iter_results(self, job_id: str, batch_size: int = 500) -> Iterator[Tuple[int, Dict]]:
+        """(input index, result) pairs in input order, read `batch_size` at a time"""
+        raise NotImplementedError
+
+    def get_results_since(self, job_id: str, cursor: int = 0, limit: int = 500) -> Tuple[List[Tuple[int, Dict]], int]:
+        """
+        Results stored after `cursor`, in the order they were stored
+
+        Returns:
+            ([(input index, result), ...], cursor to pass on the next call)
+        """
+        raise NotImplementedError
+
+    def query_results(
+        self,
+        job_id: str,
+        filters: Optional[Dict[str, str]] = None,
+        errors: Optional[bool] = None,
+        sort: Optional[str] = None,
+        descending: bool = False,
+        after: Optional[Tuple[str, int]] = None,
+        limit: int = 50,
+        count: bool = True
+    ) -> Tuple[List[Tuple[int, Dict]], Optional[int]]:
+        """
+        One page of a job's results, filtered and sorted (keyset pagination)
+
+        Args:
+            job_id: The job
+            filters: {result key: text}; a row matches if each value contains its text (case-insensitive)
+            errors: True for failed rows only, False for successful rows only
+            sort: Result key to order by (input order if None); ties are ordered by input index
+            descending: Reverse the order
+            after: sort_position() of the last row of the previous page
+            limit: Rows per page
+            count: Also count the rows matching the filters (a full pass; callers paging
+                through a listing only need it once)
+
+        Returns:
+            ([(input index, result), ...], number of rows matching the filters, or None if not counted)
+
+        Raises:
+            ValueError: The backend cannot run this query on a job this large
+        """
+        raise NotImplementedError
+
+    def append_event(self, job_id: str, event: Dict) -> int:
+        """Append to the job's event log; returns the event's sequence id (1, 2, ...)"""
+        raise NotImplementedError
+
+    def get_events(self, job_id: str, after: int = 0, limit: int = 500) -> List[Tuple[int, Dict]]:
+        """Events with a sequence id greater than `after`, oldest first"""
+        raise NotImplementedError
+
+    def last_event_id(self, job_id: str) -> int:
+        """Sequence id of the newest event (0 if none)"""
+        raise NotImplementedError
+
+    def save_spec(self, job_id: str, spec: Dict):
+        """Store what is needed to (re)run a job: input location and crawl options"""
+        raise NotImplementedError
+
+    def get_spec(self, job_id: str) -> Optional[Dict]:
+        """A job's spec, or None"""
+        raise NotImplementedError
+
+    def unfinished_jobs(self) -> List[str]:
+        """Ids of unexpired jobs that have a spec and are not completed/errored"""
+        raise NotImplementedError
+
+    def claim_job(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """
+        Take (or renew) the lease on a job so only one worker runs it
+
+        Returns:
+            True if `owner` now holds the lease, False if another owner's
+            lease has not expired yet
+        """
+        raise NotImplementedError
+
+    def release_job(self, job_id: str, owner: str):
+        """Give up `owner`'s lease on a job"""
+        raise NotImplementedError
+
+    def delete_job(self, job_id: str):
+        """Remove a job, its results and its events"""
+        raise NotImplementedError
+
+    def cleanup_expired(self) -> int:
+        """Remove expired jobs; returns how many were removed"""
+        raise NotImplementedError
+
+
+class SQLiteJobStore(JobStore):
+    """Job store backed by a SQLite file shared by every worker process on the host"""
+
+    def __init__(self, path: str = JOB_STORE_PATH, ttl: int = JOB_TTL):
+        """
+        Args:
+            path: SQLite database file
+            ttl: Seconds a job is kept after its last update
+        """
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " progress TEXT NOT NULL,"
+            " expires_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS jobs_expires_at ON jobs (expires_at);"
+            "CREATE TABLE IF NOT EXISTS job_results ("
+            " job_id TEXT NOT NULL,"
+            " idx INTEGER NOT NULL,"
+            " data TEXT NOT NULL,"
+            " PRIMARY KEY (job_id, idx));"
+            "CREATE TABLE IF NOT EXISTS job_events ("
+            " job_id TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " data TEXT NOT NULL,"
+            " PRIMARY KEY (job_id, seq));"
+            "CREATE TABLE IF NOT EXISTS job_specs ("
+            " job_id TEXT PRIMARY KEY,"
+            " spec TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS job_leases ("
+            " job_id TEXT PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " expires_at REAL NOT NULL);"
+        )
+
+    def _db(self) -> sqlite3.Connection:
+        """One connection per thread (sqlite3 connections are not thread-safe)"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA busy_timeout=30000")
+            db.create_function("casefold", 1, _casefold, deterministic=True)
+            self._local.db = db
+        return db
+
+    def set_progress(self, job_id: str, progress: Dict):
+        self._db().execute(
+            "INSERT INTO jobs (job_id, progress, expires_at) VALUES (?, ?, ?)"
+            " ON CONFLICT(job_id) DO UPDATE SET progress = excluded.progress, expires_at = excluded.expires_at",
+            (job_id, json.dumps(progress, ensure_ascii=False), time.time() + self.ttl)
+        )
+
+    def get_progress(self, job_id: str) -> Optional[Dict]:
+        row = self._db().execute(
+            "SELECT progress FROM jobs WHERE job_id = ? AND expires_at > ?", (job_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add_result(self, job_id: str, index: int, result: Dict):
+        self._db().execute(
+            "INSERT OR REPLACE INTO job_results (job_id, idx, data) VALUES (?, ?, ?)",
+            (job_id, index, json.dumps(result, ensure_ascii=False))
+        )
+
+    def get_result(self, job_id: str, index: int) -> Optional[Dict]:
+        row = self._db().execute(
+            "SELECT data FROM job_results WHERE job_id = ? AND idx = ?", (job_id, index)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_results(self, job_id: str) -> List[Dict]:
+        rows = self._db().execute(
+            "SELECT data FROM job_results WHERE job_id = ? ORDER BY idx", (job_id,)
+        ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def iter_results(self, job_id: str, batch_size: int = 500) -> Iterator[Tuple[int, Dict]]:
+        after = -1
+        while True:
+            rows = self._db().execute(
+                "SELECT idx, data FROM job_results WHERE job_id = ? AND idx > ? ORDER BY idx LIMIT ?",
+                (job_id, after, batch_size)
+            ).fetchall()
+            for idx, data in rows:
+                yield idx, json.loads(data)
+            if len(rows) < batch_size:
+                return
+            after = rows[-1][0]
+
+    def get_results_since(self, job_id: str, cursor: int = 0, limit: int = 500) -> Tuple[List[Tuple[int, Dict]], int]:
+        # rowid follows insertion order
+        rows = self._db().execute(
+            "SELECT rowid, idx, data FROM job_results WHERE job_id = ? AND rowid > ? ORDER BY rowid LIMIT ?",
+            (job_id, cursor, limit)
+        ).fetchall()
+        if rows:
+            cursor = rows[-1][0]
+        return [(idx, json.loads(data)) for _, idx, data in rows], cursor
+
+    def query_results(
+        self,
+        job_id: str,
+        filters: Optional[Dict[str, str]] = None,
+        errors: Optional[bool] = None,
+        sort: Optional[str] = None,
+        descending: bool = False,
+        after: Optional[Tuple[str, int]] = None,
+        limit: int = 50,
+        count: bool = True
+    ) -> Tuple[List[Tuple[int, Dict]], Optional[int]]:
+        where, params = ["job_id = ?"], [job_id]
+        for key, text in (filters or {}).items():
+            where.append("instr(casefold(json_extract(data, ?)), ?) > 0")
+            params += [_json_path(key), text.casefold()]
+        if errors is not None:
+            where.append("COALESCE(json_extract(data, '$.Error'), '') " + ("!= ''" if errors else "= ''"))
+        db = self._db()
+        total = None
+        if count:
+            total = db.execute(f"SELECT COUNT(*) FROM job_results WHERE {' AND '.join(where)}", params).fetchone()[0]
+
+        # Same key as sort_position(); the ORDER BY matches the keyset condition
+        key, key_params = ("COALESCE(json_extract(data, ?), '')", [_json_path(sort)]) if sort else ("''", [])
+        op, direction = ("<", "DESC") if descending else (">", "ASC")
+        if after is not None:
+            where.append(f"({key} {op} ? OR ({key} = ? AND idx {op} ?))")
+            params += key_params + [after[0]] + key_params + [after[0], after[1]]
+        rows = db.execute(
+            f"SELECT idx, data FROM job_results WHERE {' AND '.join(where)}"
+            f" ORDER BY {key} {direction}, idx {direction} LIMIT ?",
+            params + key_params + [limit]
+        ).fetchall()
+        return [(idx, json.loads(data)) for idx, data in rows], total
+
+    def append_event(self, job_id: str, event: Dict) -> int:
+        db = self._db()
+        data = json.dumps(event, ensure_ascii=False)
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            (seq,) = db.execute(
+                "SELECT COALESCE(MAX(seq), 0) + 1 FROM job_events WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            db.execute("INSERT INTO job_events (job_id, seq, data) VALUES (?, ?, ?)", (job_id, seq, data))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return seq
+
+    def get_events(self, job_id: str, after: int = 0, limit: int = 500) -> List[Tuple[int, Dict]]:
+        rows = self._db().execute(
+            "SELECT seq, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+            (job_id, after, limit)
+        ).fetchall()
+        return [(seq, json.loads(data)) for seq, data in rows]
+
+    def last_event_id(self, job_id: str) -> int:
+        (seq,) = self._db().execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM job_events WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return seq
+
+    def save_spec(self, job_id: str, spec: Dict):
+        self._db().execute(
+            "INSERT OR REPLACE INTO job_specs (job_id, spec) VALUES (?, ?)",
+            (job_id, json.dumps(spec, ensure_ascii=False))
+        )
+
+    def get_spec(self, job_id: str) -> Optional[Dict]:
+        row = self._db().execute("SELECT spec FROM job_specs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def unfinished_jobs(self) -> List[str]:
+        rows = self._db().execute(
+            "SELECT s.job_id, j.progress FROM job_specs s JOIN jobs j ON j.job_id = s.job_id"
+            " WHERE j.expires_at > ?", (time.time(),)
+        ).fetchall()
+        return [job_id for job_id, progress in rows
+                if json.loads(progress).get("status") not in ("completed", "error")]
+
+    def claim_job(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        db = self._db()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT owner, expires_at FROM job_leases WHERE job_id = ?", (job_id,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                db.execute("ROLLBACK")
+                return False
+            db.execute(
+                "INSERT OR REPLACE INTO job_leases (job_id, owner, expires_at) VALUES (?, ?, ?)",
+                (job_id, owner, now + lease_seconds)
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return True
+
+    def release_job(self, job_id: str, owner: str):
+        self._db().execute("DELETE FROM job_leases WHERE job_id = ? AND owner = ?", (job_id, owner))
+
+    def delete_job(self, job_id: str):
+        db = self._db()
+        db.execute("DELETE FROM job_leases WHERE job_id = ?", (job_id,))
+        db.execute("DELETE FROM job_specs WHERE job_id = ?", (job_id,))
+        db.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+        db.execute("DELETE FROM job_results WHERE job_id = ?", (job_id,))
+        db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def cleanup_expired(self) -> int:
+        db = self._db()
+        expired = [job_id for (job_id,) in db.execute(
+            "SELECT job_id FROM jobs WHERE expires_at <= ?", (time.time(),)
+        )]
+        for job_id in expired:
+            self.delete_job(job_id)
+        return len(expired)
+
+
+class RedisJobStore(JobStore):
+    """
+    Job store backed by a Redis-protocol server
+
+    Keys: ``job:{id}`` holds the progress JSON, ``job:{id}:results`` is a
+    hash of input index -> result JSON, ``job:{id}:done`` lists the indexes
+    in the order they were stored, ``job:{id}:events`` is a list used as the
+    event log (sequence id = list position + 1), ``job:{id}:spec`` holds the
+    job spec and ``job:{id}:lease`` the runner's lease. All carry the job
+    TTL, so the server expires them on its own; ``job:specs`` is the set of
+    jobs with a spec, pruned as they expire.
+
+    Result pages are read through sorted sets: ``job:{id}:order`` (score =
+    input index) and one ``job:{id}:sort:{key}`` per key in ``sort_keys``
+    (members ``value\\x00index``, ordered by ZRANGEBYLEX the same way as
+    sort_position()), so a page costs one range read and one HMGET however
+    deep it is. Filtered queries and sorts by other keys have no index and
+    scan the whole hash; they are refused for jobs over ``scan_max`` results.
+    """
+
+    def __init__(
+        self,
+        client,
+        ttl: int = JOB_TTL,
+        prefix: str = "job:",
+        sort_keys: Tuple[str, ...] = REDIS_SORT_KEYS,
+        scan_max: int = REDIS_QUERY_SCAN_MAX
+    ):
+        """
+        Args:
+            client: redis.Redis (or compatible) client
+            ttl: Seconds a job is kept after its last update
+            prefix: Key prefix for job records
+            sort_keys: Result keys to keep a sorted index for
+            scan_max: Most results a query without an index may scan
+        """
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.sort_keys = tuple(sort_keys)
+        self.scan_max = scan_max
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.prefix}{job_id}"
+
+    def _result_suffixes(self) -> List[str]:
+        return [":results", ":done", ":order"] + [f":sort:{key}" for key in self.sort_keys]
+
+    @staticmethod
+    def _sort_member(result: Dict, index: int, sort: str) -> str:
+        value, index = sort_position(result, index, sort)
+        return f"{value}\x00{index:010d}"
+
+    def set_progress(self, job_id: str, progress: Dict):
+        key = self._key(job_id)
+        pipe = self.client.pipeline()
+        pipe.set(key, json.dumps(progress, ensure_ascii=False), ex=self.ttl)
+        for suffix in self._result_suffixes() + [":events", ":spec"]:
+            pipe.expire(f"{key}{suffix}", self.ttl)
+        pipe.execute()
+
+    def get_progress(self, job_id: str) -> Optional[Dict]:
+        data = self.client.get(self._key(job_id))
+        return json.loads(data) if data else None
+
+    def add_result(self, job_id: str, index: int, result: Dict):
+        key = self._key(job_id)
+        previous = self.get_result(job_id, index) if self.sort_keys else None
+        pipe = self.client.pipeline()
+        pipe.hset(f"{key}:results", str(index), json.dumps(result, ensure_ascii=False))
+        pipe.rpush(f"{key}:done", index)
+        pipe.zadd(f"{key}:order", {str(index): index})
+        for sort in self.sort_keys:
+            member = self._sort_member(result, index, sort)
+            if previous is not None and self._sort_member(previous, index, sort) != member:
+                pipe.zrem(f"{key}:sort:{sort}", self._sort_member(previous, index, sort))
+            pipe.zadd(f"{key}:sort:{sort}", {member: 0})
+        for suffix in self._result_suffixes():
+            pipe.expire(f"{key}{suffix}", self.ttl)
+        pipe.execute()
+
+    def get_result(self, job_id: str, index: int) -> Optional[Dict]:
+        data = self.client.hget(f"{self._key(job_id)}:results", str(index))
+        return json.loads(data) if data else None
+
+    def get_results(self, job_id: str) -> List[Dict]:
+        rows = self.client.hgetall(f"{self._key(job_id)}:results")
+        return [json.loads(data) for _, data in sorted(rows.items(), key=lambda kv: int(kv[0]))]
+
+    def iter_results(self, job_id: str, batch_size: int = 500) -> Iterator[Tuple[int, Dict]]:
+        key = f"{self._key(job_id)}:results"
+        indexes = sorted(int(i) for i in self.client.hkeys(key))
+        for start in range(0, len(indexes), batch_size):
+            batch = indexes[start:start + batch_size]
+            for idx, data in zip(batch, self.client.hmget(key, [str(i) for i in batch])):
+                if data:
+                    yield idx, json.loads(data)
+
+    def get_results_since(self, job_id: str, cursor: int = 0, limit: int = 500) -> Tuple[List[Tuple[int, Dict]], int]:
+        key = self._key(job_id)
+        indexes = [int(i) for i in self.client.lrange(f"{key}:done", cursor, cursor + limit - 1)]
+        if not indexes:
+            return [], cursor
+        rows = self.client.hmget(f"{key}:results", [str(i) for i in indexes])
+        return [(i, json.loads(data)) for i, data in zip(indexes, rows) if data], cursor + len(indexes)
+
+    def query_results(
+        self,
+        job_id: str,
+        filters: Optional[Dict[str, str]] = None,
+        errors: Optional[bool] = None,
+        sort: Optional[str] = None,
+        descending: bool = False,
+        after: Optional[Tuple[str, int]] = None,
+        limit: int = 50,
+        count: bool = True
+    ) -> Tuple[List[Tuple[int, Dict]], Optional[int]]:
+        key = self._key(job_id)
+        if filters or errors is not None or (sort and sort not in self.sort_keys):
+            return self._scan_results(job_id, filters, errors, sort, descending, after, limit, count)
+
+        if not sort:
+            start = f"({after[1]}" if after is not None else None
+            if descending:
+                members = self.client.zrevrangebyscore(f"{key}:order", start or "+inf", "-inf", start=0, num=limit)
+            else:
+                members = self.client.zrangebyscore(f"{key}:order", start or "-inf", "+inf", start=0, num=limit)
+            indexes = [int(m) for m in members]
+        else:
+            start = "(" + self._sort_member({sort: after[0]}, int(after[1]), sort) if after is not None else None
+            if descending:
+                members = self.client.zrevrangebylex(f"{key}:sort:{sort}", start or "+", "-", start=0, num=limit)
+            else:
+                members = self.client.zrangebylex(f"{key}:sort:{sort}", start or "-", "+", start=0, num=limit)
+            indexes = [int((m.decode() if isinstance(m, bytes) else m).rsplit("\x00", 1)[1]) for m in members]
+
+        rows = self.client.hmget(f"{key}:results", [str(i) for i in indexes]) if indexes else []
+        total = self.client.hlen(f"{key}:results") if count else None
+        return [(i, json.loads(data)) for i, data in zip(indexes, rows) if data], total
+
+    def _scan_results(
+        self,
+        job_id: str,
+        filters: Optional[Dict[str, str]],
+        errors: Optional[bool],
+        sort: Optional[str],
+        descending: bool,
+        after: Optional[Tuple[str, int]],
+        limit: int,
+        count: bool
+    ) -> Tuple[List[Tuple[int, Dict]], Optional[int]]:
+        """Filter and sort the whole results hash client-side (no index covers the query)"""
+        if self.client.hlen(f"{self._key(job_id)}:results") > self.scan_max:
+            raise ValueError(f"filtering, or sorting by a key other than {', '.join(self.sort_keys) or 'input order'}, "
+                             f"is limited to jobs of {self.scan_max} results")
+        rows = [(idx, result) for idx, result in self.iter_results(job_id) if _matches(result, filters, errors)]
+        rows.sort(key=lambda row: sort_position(row[1], row[0], sort), reverse=descending)
+        total = len(rows) if count else None
+        if after is not None:
+            after = tuple(after)
+            past = (lambda position: position < after) if descending else (lambda position: position > after)
+            rows = [row for row in rows if past(sort_position(row[1], row[0], sort))]
+        return rows[:limit], total
+
+    def append_event(self, job_id: str, event: Dict) -> int:
+        key = f"{self._key(job_id)}:events"
+        pipe = self.client.pipeline()
+        pipe.rpush(key, json.dumps(event, ensure_ascii=False))
+        pipe.expire(key, self.ttl)
+        seq, _ = pipe.execute()
+        return seq
+
+    def get_events(self, job_id: str, after: int = 0, limit: int = 500) -> List[Tuple[int, Dict]]:
+        rows = self.client.lrange(f"{self._key(job_id)}:events", after, after + limit - 1)
+        return [(after + i + 1, json.loads(data)) for i, data in enumerate(rows)]
+
+    def last_event_id(self, job_id: str) -> int:
+        return self.client.llen(f"{self._key(job_id)}:events")
+
+    def save_spec(self, job_id: str, spec: Dict):
+        pipe = self.client.pipeline()
+        pipe.set(f"{self._key(job_id)}:spec", json.dumps(spec, ensure_ascii=False), ex=self.ttl)
+        pipe.sadd(f"{self.prefix}specs", job_id)
+        pipe.execute()
+
+    def get_spec(self, job_id: str) -> Optional[Dict]:
+        data = self.client.get(f"{self._key(job_id)}:spec")
+        return json.loads(data) if data else None
+
+    def unfinished_jobs(self) -> List[str]:
+        unfinished = []
+        for job_id in self.client.smembers(f"{self.prefix}specs"):
+            job_id = job_id.decode() if isinstance(job_id, bytes) else job_id
+            progress = self.get_progress(job_id)
+            if progress is None:
+                self.client.srem(f"{self.prefix}specs", job_id)
+            elif progress.get("status") not in ("completed", "error"):
+                unfinished.append(job_id)
+        return unfinished
+
+    def claim_job(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        key = f"{self._key(job_id)}:lease"
+        ms = max(1, int(lease_seconds * 1000))
+
+        def claim(pipe) -> bool:
+            # WATCHed: if the lease changes hands after the GET, EXEC fails and this runs again
+            current = pipe.get(key)
+            if current is not None and (current.decode() if isinstance(current, bytes) else current) != owner:
+                return False
+            pipe.multi()
+            pipe.set(key, owner, px=ms)
+            return True
+
+        return self.client.transaction(claim, key, value_from_callable=True)
+
+    def release_job(self, job_id: str, owner: str):
+        key = f"{self._key(job_id)}:lease"
+
+        def release(pipe):
+            current = pipe.get(key)
+            if current is not None and (current.decode() if isinstance(current, bytes) else current) == owner:
+                pipe.multi()
+                pipe.delete(key)
+
+        self.client.transaction(release, key)
+
+    def delete_job(self, job_id: str):
+        key = self._key(job_id)
+        self.client.delete(key, *(f"{key}{suffix}" for suffix in self._result_suffixes()),
+                           f"{key}:events", f"{key}:spec", f"{key}:lease")
+        self.client.srem(f"{self.prefix}specs", job_id)
+
+    def cleanup_expired(self) -> int:
+        # Redis expires keys itself
+        return 0
+
+
+_store: Optional[JobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    """
+    Get the process-wide job store (Redis when USE_REDIS is set, else SQLite)
+
+    Returns:
+        Shared JobStore
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if USE_REDIS:
+                    import redis
+                    _store = RedisJobStore(redis.Redis(host=REDIS_HOST, port=REDIS_PORT))
+                else:
+                    _store = SQLiteJobStore()
+    return _store
@@ -0,0 +1,437 @@
+"""
+Durable, resumable batch crawl jobs
+
+A job is described by a spec in the job store: where its input file was
+saved and the crawl options. Every finished row is written to the job store
+as soon as it completes, which is the job's checkpoint. If the process dies,
+the job is left "processing" with some rows stored; resuming it re-reads the
+input, skips every row that already has a result (duplicates of those codes
+are served from the store) and crawls only the rest, so no code is fetched
+twice within a job.
+
+Only one runner works on a job at a time: it holds a lease in the job store
+and renews it from a background thread while it runs. A job whose lease has
+expired (its runner crashed) is picked up again by ``resume_orphaned_jobs``,
+which the app runs at startup and then periodically, or on demand through
+``/jobs/{id}/resume``.
+"""
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import metrics
+from events import publish_progress
+from ingest import open_tax_codes
+from job_store import JobStore, get_job_store
+from scheduler import BULK, get_scheduler
+from tax_code import DedupStats, iter_deduplicated
+
+
+# Where uploaded inputs are kept until their job completes
+JOB_UPLOAD_DIR = os.environ.get("JOB_UPLOAD_DIR", "data/uploads")
+
+# Seconds a runner's lease lasts without renewal
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", "60"))
+
+# Parse pages in a process pool (pipeline.py) instead of in the fetch threads
+USE_PARSE_POOL = os.environ.get("USE_PARSE_POOL", "false").lower() in ("1", "true", "yes")
+
+# Hand codes to worker.py processes through the shared work queue (work_queue.py)
+USE_WORK_QUEUE = os.environ.get("USE_WORK_QUEUE", "false").lower() in ("1", "true", "yes")
+
+# Identifies this process as a lease owner
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+logger = logging.getLogger(__name__)
+
+_running: Dict[str, threading.Thread] = {}
+_running_lock = threading.Lock()
+
+
+class LeaseLost(Exception):
+    """The runner's lease on a job expired and another runner took the job over"""
+
+
+def renew_lease(store: JobStore, job_id: str, lease_seconds: float = JOB_LEASE_SECONDS):
+    """
+    Extend this process's lease on a job
+
+    Raises:
+        LeaseLost: another runner holds the lease now
+    """
+    if not store.claim_job(job_id, WORKER_ID, lease_seconds):
+        raise LeaseLost(f"job {job_id} was taken over by another runner")
+
+
+class JobLease:
+    """
+    Keeps this process's lease on a job alive from a background thread
+
+    The lease is renewed every third of JOB_LEASE_SECONDS for as long as the
+    runner works on the job, including while the job waits for the
+    scheduler to admit it. Once a renewal finds that another runner took the
+    job over, check() raises LeaseLost.
+    """
+
+    def __init__(self, store: JobStore, job_id: str):
+        self.store = store
+        self.job_id = job_id
+        self.lease_seconds = JOB_LEASE_SECONDS
+        self._stop = threading.Event()
+        self._lost = threading.Event()
+        self._thread = threading.Thread(target=self._renew, name=f"lease-{job_id}", daemon=True)
+
+    def start(self) -> "JobLease":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def check(self):
+        """Raise LeaseLost if another runner has taken the job over"""
+        if self._lost.is_set():
+            raise LeaseLost(f"job {self.job_id} was taken over by another runner")
+
+    def _renew(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                renew_lease(self.store, self.job_id, self.lease_seconds)
+            except LeaseLost:
+                logger.warning("job_lease_lost", extra={"job_id": self.job_id})
+                self._lost.set()
+                return
+            except Exception:
+                # e.g. the store is briefly unreachable: try again next round
+                logger.exception("job_lease_renewal_failed", extra={"job_id": self.job_id})
+
+
+class _JobMeter:
+    """Rows a job has completed since this process started (or resumed) it"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.rows = 0
+
+
+_meters: Dict[str, _JobMeter] = {}
+
+
+def _job_metrics():
+    """Per-job throughput of the jobs running in this process (scrape-time collector)"""
+    now = time.monotonic()
+    with _running_lock:
+        meters = list(_meters.items())
+    yield ("crawler_jobs_running", "gauge", "Batch jobs running in this process", [({}, len(meters))])
+    yield ("crawler_job_rows_completed", "gauge", "Rows completed by each running job since it (re)started",
+           [({"job_id": job_id}, meter.rows) for job_id, meter in meters])
+    yield ("crawler_job_rows_per_second", "gauge", "Throughput of each running job since it (re)started",
+           [({"job_id": job_id}, meter.rows / max(now - meter.started, 1e-9)) for job_id, meter in meters])
+
+
+metrics.REGISTRY.register_collector(_job_metrics)
+
+
+def iter_crawl(
+    tax_codes: Iterable[str],
+    batch_size: int,
+    progress_callback,
+    force_refresh: bool,
+    job_id: str = "",
+    on_queue = None
+) -> Iterator[Tuple[int, Dict]]:
+    """
+    Crawl on the configured engine, yielding (index, result) as each code finishes
+
+    By default codes go through the shared scheduler (at most `batch_size`
+    of this job's codes in flight); with USE_PARSE_POOL the job runs its own
+    fetch threads + parser processes instead, and with USE_WORK_QUEUE the
+    codes are queued for the worker processes and only collected here.
+    """
+    if USE_WORK_QUEUE:
+        from work_queue import iter_queued
+        return iter_queued(job_id or f"job-{uuid.uuid4()}", tax_codes, progress_callback, force_refresh)
+
+    if USE_PARSE_POOL:
+        from pipeline import iter_crawl_pipeline
+        return iter_crawl_pipeline(
+            tax_codes,
+            progress_callback=progress_callback,
+            fetch_workers=batch_size,
+            force_refresh=force_refresh
+        )
+
+    return get_scheduler().iter_crawl(
+        job_id or f"job-{uuid.uuid4()}",
+        tax_codes,
+        progress_callback=progress_callback,
+        priority=BULK,
+        max_in_flight=batch_size,
+        force_refresh=force_refresh,
+        on_queue=on_queue
+    )
+
+
+def iter_job_rows(
+    session_id: str,
+    tax_codes: Iterable,
+    batch_size: int,
+    progress_callback,
+    force_refresh: bool,
+    stats: DedupStats,
+    resume: bool = False,
+    store: Optional[JobStore] = None,
+    on_queue = None
+) -> Iterator[Tuple[int, Dict]]:
+    """
+    Crawl a job's input rows: invalid codes are rejected without a fetch and
+    each unique code is fetched once, its result fanned out to every row.
+    Later duplicates read their original's result back from the job store.
+    When resuming, rows that already have a stored result are skipped.
+    """
+    job_store = store or get_job_store()
+    return iter_deduplicated(
+        tax_codes,
+        crawl=lambda codes, progress: iter_crawl(
+            codes, batch_size, progress, force_refresh, job_id=session_id, on_queue=on_queue
+        ),
+        lookup=lambda row: job_store.get_result(session_id, row),
+        stats=stats,
+        progress_callback=progress_callback,
+        is_done=(lambda row: job_store.get_result(session_id, row) is not None) if resume else None
+    )
+
+
+def processing_progress(current: int, total: int, code: str, status: str, queue_position: int = 0) -> Dict:
+    """
+    Progress record for a running crawl (total grows while the upload is still being read)
+
+    `queue_position` is the job's place in the scheduler's line (0 once it is being served).
+    """
+    return {
+        'status': 'processing',
+        'total': total,
+        'completed': current,
+        'current': code,
+        'message': status,
+        'percentage': int((current / total) * 100) if total else 0,
+        'queue_position': queue_position
+    }
+
+
+def completed_progress(stats: DedupStats) -> Dict:
+    """Final progress record of a job, with its de-duplication summary"""
+    return {
+        'status': 'completed',
+        'total': stats.rows,
+        'completed': stats.rows,
+        'message': (
+            f'Crawling completed! {stats.fetches_saved} fetches saved '
+            f'({stats.duplicates} duplicates, {stats.invalid} invalid)'
+        ),
+        'percentage': 100,
+        **stats.as_dict()
+    }
+
+
+def save_upload(fileobj: BinaryIO, job_id: str, filename: str) -> str:
+    """
+    Copy an uploaded file to durable storage so the job can be resumed
+
+    Returns:
+        Path of the saved copy
+    """
+    os.makedirs(JOB_UPLOAD_DIR, exist_ok=True)
+    ext = os.path.splitext(filename or "")[1].lower()
+    path = os.path.join(JOB_UPLOAD_DIR, f"{job_id}{ext}")
+    with open(path, "wb") as out:
+        shutil.copyfileobj(fileobj, out, 1024 * 1024)
+    return path
+
+
+def create_job(
+    job_id: str,
+    input_path: str,
+    filename: str,
+    batch_size: int,
+    force_refresh: bool = False,
+    store: Optional[JobStore] = None
+):
+    """Record a job's spec and initial progress; run it with run_job/start_job"""
+    store = store or get_job_store()
+    store.save_spec(job_id, {
+        "input_path": input_path,
+        "filename": filename,
+        "batch_size": batch_size,
+        "force_refresh": force_refresh,
+        "created_at": time.time(),
+    })
+    publish_progress(job_id, processing_progress(0, 0, '', 'Reading file...'), store=store)
+
+
+def run_job(job_id: str, store: Optional[JobStore] = None, resume: bool = False) -> Optional[DedupStats]:
+    """
+    Run (or resume) a job to completion in the calling thread
+
+    Args:
+        job_id: Job (session) id
+        store: Job store (defaults to the shared one)
+        resume: Skip rows that already have a stored result
+
+    Returns:
+        The job's stats, or None if another runner holds the job's lease
+        (or took it over while this one was running)
+    """
+    store = store or get_job_store()
+    spec = store.get_spec(job_id)
+    if spec is None or not store.claim_job(job_id, WORKER_ID, JOB_LEASE_SECONDS):
+        return None
+
+    last = (0, 0)
+    lease = JobLease(store, job_id).start()
+
+    def progress_callback(current, total, code, status):
+        nonlocal last
+        # Raised through the crawl engine, which stops this job's fetches
+        lease.check()
+        last = (current, total)
+        publish_progress(job_id, processing_progress(current, total, code, status), store=store)
+        logger.debug("job_progress", extra={"job_id": job_id, "completed": current, "total": total,
+                                            "tax_code": code, "status": status})
+
+    def on_queue(position):
+        lease.check()
+        status = f"Queued: position {position}" if position else "Starting crawl..."
+        publish_progress(job_id, processing_progress(*last, '', status, queue_position=position), store=store)
+
+    tax_codes = rows = None
+    meter = _JobMeter()
+    with _running_lock:
+        _meters[job_id] = meter
+    try:
+        tax_codes = open_tax_codes(open(spec["input_path"], "rb"), spec["filename"])
+        stats = DedupStats()
+        # Each result is stored as soon as its code completes: that is the checkpoint
+        rows = iter_job_rows(
+            job_id, tax_codes, spec["batch_size"], progress_callback, spec["force_refresh"], stats,
+            resume=resume, store=store, on_queue=on_queue
+        )
+        for idx, info in rows:
+            lease.check()
+            store.add_result(job_id, idx, info)
+            meter.rows += 1
+            metrics.JOB_ROWS.inc()
+
+        publish_progress(job_id, completed_progress(stats), store=store)
+        logger.info("job_completed", extra={
+            "job_id": job_id, "seconds": round(time.monotonic() - meter.started, 3), **stats.as_dict()
+        })
+        _remove_upload(spec["input_path"])
+        return stats
+    except LeaseLost:
+        # The new owner carries on from the checkpoint; this runner just stops
+        logger.warning("job_lease_lost", extra={"job_id": job_id, "rows": meter.rows})
+        return None
+    except Exception as e:
+        error_msg = f'Error: {str(e)}'
+        publish_progress(job_id, {'status': 'error', 'message': error_msg}, store=store)
+        logger.exception("job_failed", extra={"job_id": job_id})
+        raise
+    finally:
+        with _running_lock:
+            _meters.pop(job_id, None)
+        if rows is not None:
+            rows.close()
+        if tax_codes is not None:
+            tax_codes.close()
+        lease.stop()
+        store.release_job(job_id, WORKER_ID)
+
+
+def start_job(job_id: str, resume: bool = False) -> bool:
+    """
+    Run a job in a background thread of this process
+
+    Returns:
+        False if this process is already running the job
+    """
+    with _running_lock:
+        thread = _running.get(job_id)
+        if thread is not None and thread.is_alive():
+            return False
+
+        def target():
+            try:
+                run_job(job_id, resume=resume)
+            except Exception:
+                pass  # already recorded as the job's error status
+            finally:
+                with _running_lock:
+                    _running.pop(job_id, None)
+
+        thread = threading.Thread(target=target, daemon=True)
+        _running[job_id] = thread
+        thread.start()
+        return True
+
+
+def resume_job(job_id: str, store: Optional[JobStore] = None) -> str:
+    """
+    Resume an unfinished job in the background
+
+    Returns:
+        "resumed", "running" (this or another runner holds it),
+        "completed" or "not_found"
+    """
+    store = store or get_job_store()
+    progress = store.get_progress(job_id)
+    spec = store.get_spec(job_id)
+    if progress is None or spec is None:
+        return "not_found"
+    if progress.get("status") == "completed":
+        return "completed"
+    with _running_lock:
+        thread = _running.get(job_id)
+        if thread is not None and thread.is_alive():
+            return "running"
+    # Probe the lease: held by a live runner elsewhere means nothing to do
+    if not store.claim_job(job_id, WORKER_ID, JOB_LEASE_SECONDS):
+        return "running"
+    return "resumed" if start_job(job_id, resume=True) else "running"
+
+
+def resume_orphaned_jobs(store: Optional[JobStore] = None) -> List[str]:
+    """Resume every unfinished job whose runner is gone; returns their ids"""
+    store = store or get_job_store()
+    resumed = []
+    for job_id in store.unfinished_jobs():
+        if resume_job(job_id, store) == "resumed":
+            resumed.append(job_id)
+    return resumed
+
+
+def cleanup_uploads(store: Optional[JobStore] = None) -> int:
+    """Delete saved inputs whose job has expired; returns how many were removed"""
+    store = store or get_job_store()
+    if not os.path.isdir(JOB_UPLOAD_DIR):
+        return 0
+    removed = 0
+    for name in os.listdir(JOB_UPLOAD_DIR):
+        job_id = os.path.splitext(name)[0]
+        if store.get_progress(job_id) is None:
+            _remove_upload(os.path.join(JOB_UPLOAD_DIR, name))
+            removed += 1
+    return removed
+
+
+def _remove_upload(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,69 @@
+"""
+Structured logging
+
+Modules log through ``logging.getLogger(__name__)`` with a short event name
+as the message and its fields in ``extra``, e.g.
+``logger.warning("fetch_failed", extra={"tax_code": code, "error": str(e)})``.
+configure_logging() installs one handler on the root logger that writes a
+JSON object per line (LOG_FORMAT=json, the default) or readable text.
+
+Per-code events are logged at DEBUG, so at the default INFO level they cost
+one level check on the hot path.
+"""
+import json
+import logging
+import os
+import sys
+import time
+
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+
+def record_fields(record: logging.LogRecord) -> dict:
+    """The `extra` fields of a record"""
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, event and the extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+            **record_fields(record),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """``time level logger event key=value ...`` for reading in a terminal"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(f"{key}={value}" for key, value in record_fields(record).items())
+        line = f"{self.formatTime(record)} {record.levelname:<7} {record.name} {record.getMessage()} {fields}".rstrip()
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, stream=None):
+    """Install the structured handler on the root logger (replacing one installed earlier)"""
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    handler._structured = True
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if getattr(existing, "_structured", False):
+            root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
@@ -2,11 +2,12 @@
 Tax Crawler - Main entry point
 """
 import sys
-from crawler import crawl_tax_code, crawl_multiple_tax_codes
 
 
 def cli_example():
     """Example CLI usage"""
+    from crawler import crawl_tax_code
+
     print("=== Tax Crawler CLI Example ===\n")
 
     # Single tax code
@@ -28,7 +29,15 @@ def cli_example():
 
 def main():
     """Main entry point"""
-    if len(sys.argv) > 1 and sys.argv[1] == "web":
+    if len(sys.argv) > 1 and sys.argv[1] == "crawl":
+        # Headless batch crawl (python main.py crawl input.csv -o out.csv ...)
+        from cli import main as cli_main
+        sys.exit(cli_main(sys.argv[1:]))
+    elif len(sys.argv) > 1 and sys.argv[1] == "worker":
+        # Crawl worker on the shared work queue (python main.py worker --concurrency 4 ...)
+        from worker import main as worker_main
+        sys.exit(worker_main(sys.argv[2:]))
+    elif len(sys.argv) > 1 and sys.argv[1] == "web":
         # Start web server
         import uvicorn
         from app import app
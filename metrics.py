@@ -0,0 +1,291 @@
+"""
+Prometheus metrics for the crawler pipeline
+
+A small dependency-free registry of counters, gauges and histograms (with
+labels), rendered by ``/metrics`` in the Prometheus text exposition format.
+An update is a lock and an add (histograms: one bisect over fixed buckets),
+cheap next to any upstream request. State that other modules already keep
+(scheduler, throttle, coalescing, running jobs) is read by collectors at
+scrape time instead of being mirrored on the hot path.
+
+With TRACE_SPANS on, each timed stage is also logged as a "span" record
+(stage, duration and the code/job it belongs to).
+"""
+import bisect
+import logging
+import math
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+
+# Log a structured record per timed stage (fetch, parse, rate_limit, queue)
+TRACE_SPANS = os.environ.get("TRACE_SPANS", "false").lower() in ("1", "true", "yes")
+
+# Latency buckets in seconds: sub-millisecond parsing up to slow upstream answers
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (labels, value) samples of one metric; collectors return [(name, kind, help, samples)]
+Samples = List[Tuple[Dict[str, str], float]]
+
+logger = logging.getLogger(__name__)
+
+
+class _Value:
+    __slots__ = ("lock", "value")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0.0
+
+
+class _CounterChild(_Value):
+    __slots__ = ()
+
+    def inc(self, amount: float = 1.0):
+        with self.lock:
+            self.value += amount
+
+
+class _GaugeChild(_Value):
+    __slots__ = ()
+
+    def inc(self, amount: float = 1.0):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ("lock", "buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._default = self.labels()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values) -> object:
+        """The child for one combination of label values (created on first use)"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _items(self):
+        with self._lock:
+            return list(self._children.items())
+
+    def _label_dict(self, key) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+
+class Counter(_Metric):
+    """Monotonic count (name it ``..._total``)"""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def render(self) -> Iterable[str]:
+        for key, child in self._items():
+            yield _sample(self.name, self._label_dict(key), child.value)
+
+
+class Gauge(_Metric):
+    """Value that goes up and down"""
+
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default.dec(amount)
+
+    def set(self, value: float):
+        self._default.set(value)
+
+    def render(self) -> Iterable[str]:
+        for key, child in self._items():
+            yield _sample(self.name, self._label_dict(key), child.value)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def render(self) -> Iterable[str]:
+        for key, child in self._items():
+            labels = self._label_dict(key)
+            with child.lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                yield _sample(f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative)
+            yield _sample(f"{self.name}_sum", labels, total)
+            yield _sample(f"{self.name}_count", labels, count)
+
+
+class Registry:
+    """Metrics and scrape-time collectors exposed together"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Samples]]]] = []
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, Samples]]]):
+        """
+        Add a function called on every scrape
+
+        It returns (name, kind, help, [(labels, value), ...]) tuples for
+        values that live elsewhere (kind is "gauge" or "counter").
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                logger.warning("metrics_collector_failed", extra={"collector": collector.__name__, "error": str(e)})
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {_escape_help(documentation)}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(_sample(name, labels, value) for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        inner = ",".join(f'{key}="{_escape_label(val)}"' for key, val in labels.items())
+        return f"{name}{{{inner}}} {_format_value(value)}"
+    return f"{name} {_format_value(value)}"
+
+
+def span(stage: str, seconds: float, **fields):
+    """Log one timed stage (call only when TRACE_SPANS is on)"""
+    logger.info("span", extra={"stage": stage, "duration_ms": round(seconds * 1000, 3), **fields})
+
+
+REGISTRY = Registry()
+
+# ==== Crawler pipeline metrics ====
+
+FETCH_SECONDS = Histogram(
+    "crawler_fetch_seconds", "Upstream request latency (one HTTP request; retries are observed separately)"
+)
+PARSE_SECONDS = Histogram("crawler_parse_seconds", "Time to parse one result page")
+QUEUE_WAIT_SECONDS = Histogram(
+    "crawler_queue_wait_seconds",
+    "Time a job's next code was ready to dispatch but waited for a scheduler worker (includes admission)",
+    ("priority",)
+)
+RATE_LIMIT_WAIT_SECONDS = Histogram(
+    "crawler_rate_limit_wait_seconds", "Politeness delay: time waiting for an adaptive throttle slot and rate limit token"
+)
+UPSTREAM_RESPONSES = Counter(
+    "crawler_upstream_responses_total", "Upstream answers by outcome class (ok, throttled, blocked, captcha, empty, error)",
+    ("outcome",)
+)
+LOOKUPS = Counter("crawler_lookups_total", "Single-code lookups by how they were answered (cache, upstream)", ("source",))
+UPSTREAM_IN_FLIGHT = Gauge("crawler_upstream_in_flight", "Upstream requests in flight")
+JOB_ROWS = Counter("crawler_job_rows_total", "Rows completed by batch jobs in this process")
+REFRESH_RESULTS = Counter(
+    "crawler_refresh_results_total",
+    "Incremental refresh checks by result (not_modified, unchanged, changed, new, error)",
+    ("status",)
+)
+
+
+def render() -> str:
+    """The process's metrics in the Prometheus text format"""
+    return REGISTRY.render()
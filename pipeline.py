@@ -0,0 +1,266 @@
+"""
+Two-stage crawl pipeline: threaded fetchers feeding a process pool of parsers
+
+I/O workers download raw search pages into a bounded queue; a dispatcher
+hands them to a ProcessPoolExecutor so HTML parsing runs on every core
+instead of being serialized by the GIL. When parsers fall behind, the queue
+fills up and fetchers block, so memory stays bounded by
+``queue_size + parse_workers`` pages.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+
+import metrics
+from cache import ResultCache, get_cache
+from company_index import index_result
+from crawler import CodeFeed, download_page
+from rate_limiter import TokenBucket
+from tax_parser import parse_result_timed
+from throttle import UpstreamError
+
+
+FETCH_WORKERS = int(os.environ.get("PIPELINE_FETCH_WORKERS", "4"))
+PARSE_WORKERS = int(os.environ.get("PIPELINE_PARSE_WORKERS", str(os.cpu_count() or 1)))
+QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "0")) or 2 * PARSE_WORKERS
+
+_DONE = object()
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def get_parse_pool(workers: int = PARSE_WORKERS) -> ProcessPoolExecutor:
+    """
+    Get the shared parser process pool, (re)creating it for a new worker count
+
+    Workers are spawned rather than forked, since the web process is
+    multi-threaded.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            _pool_workers = workers
+        return _pool
+
+
+def shutdown_parse_pool():
+    """Stop the shared parser process pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def iter_pipeline(
+    tax_codes: Iterable[str],
+    fetch_workers: int = FETCH_WORKERS,
+    parse_workers: int = PARSE_WORKERS,
+    queue_size: int = QUEUE_SIZE,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    force_refresh: bool = False,
+    cache: Optional[ResultCache] = None
+) -> Iterator[Tuple[int, Dict]]:
+    """
+    Crawl tax codes through the fetch -> parse pipeline
+
+    Args:
+        tax_codes: Tax codes to search for (read lazily by the fetchers)
+        fetch_workers: Number of downloader threads
+        parse_workers: Number of parser processes
+        queue_size: Maximum downloaded pages waiting for a parser
+        session: HTTP session to use (defaults to the shared pooled session)
+        rate_limiter: Token bucket to draw from (defaults to the shared per-host one)
+        force_refresh: Bypass the result cache and re-fetch from upstream
+        cache: Result cache to use (defaults to the shared one, if enabled)
+
+    Yields:
+        (input index, result dict) in completion order
+    """
+    cache = cache or get_cache()
+    pool = get_parse_pool(max(1, parse_workers))
+
+    codes = iter(enumerate(tax_codes))
+    codes_lock = threading.Lock()
+    pages: "queue.Queue" = queue.Queue(maxsize=max(1, queue_size))
+    results: "queue.Queue" = queue.Queue()
+    stop = threading.Event()
+
+    # Parse jobs submitted but not yet delivered; caps pages held by the pool
+    parse_slots = threading.Semaphore(max(1, parse_workers))
+    in_flight = 0
+    in_flight_done = threading.Condition()
+
+    def put_page(item) -> bool:
+        """Blocking put that gives up once the consumer has gone away"""
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetcher():
+        while not stop.is_set():
+            with codes_lock:
+                try:
+                    idx, code = next(codes)
+                except StopIteration:
+                    return
+            code = code.strip()
+
+            if cache is not None and not force_refresh:
+                cached = cache.get(code)
+                if cached is not None:
+                    metrics.LOOKUPS.labels("cache").inc()
+                    logger.debug("cache_hit", extra={"tax_code": code})
+                    results.put((idx, cached))
+                    continue
+
+            metrics.LOOKUPS.labels("upstream").inc()
+            try:
+                html = download_page(code, session, rate_limiter)
+            except UpstreamError as e:
+                logger.warning("upstream_refused", extra={"tax_code": code, "outcome": e.outcome, "error": str(e)})
+                info = {"MST": code, "Error": str(e)}
+                results.put((idx, info if e.retryable else _store(cache, code, info)))
+                continue
+            except Exception as e:
+                logger.warning("fetch_failed", extra={"tax_code": code, "error": str(e)})
+                results.put((idx, _store(cache, code, {"MST": code, "Error": str(e)})))
+                continue
+
+            if not put_page((idx, code, html)):
+                return
+
+    def deliver(idx: int, code: str, future):
+        nonlocal in_flight
+        try:
+            info, seconds = future.result()
+            metrics.PARSE_SECONDS.observe(seconds)
+        except Exception as e:
+            info = {"MST": code, "Error": str(e)}
+        results.put((idx, _store(cache, code, info)))
+        parse_slots.release()
+        with in_flight_done:
+            in_flight -= 1
+            in_flight_done.notify_all()
+
+    def dispatcher():
+        nonlocal in_flight
+        while True:
+            item = pages.get()
+            if item is _DONE:
+                break
+            idx, code, html = item
+            parse_slots.acquire()
+            with in_flight_done:
+                in_flight += 1
+            future = pool.submit(parse_result_timed, code, html)
+            future.add_done_callback(lambda f, idx=idx, code=code: deliver(idx, code, f))
+
+        with in_flight_done:
+            in_flight_done.wait_for(lambda: in_flight == 0)
+        results.put(_DONE)
+
+    fetchers = [
+        threading.Thread(target=fetcher, name=f"pipeline-fetch-{i}", daemon=True)
+        for i in range(max(1, fetch_workers))
+    ]
+    for t in fetchers:
+        t.start()
+    threading.Thread(target=dispatcher, name="pipeline-dispatch", daemon=True).start()
+
+    def close_pages():
+        for t in fetchers:
+            t.join()
+        pages.put(_DONE)
+
+    threading.Thread(target=close_pages, name="pipeline-close", daemon=True).start()
+
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def iter_crawl_pipeline(tax_codes: Iterable[str], progress_callback=None, **kwargs) -> Iterator[Tuple[int, Dict]]:
+    """
+    Crawl tax codes through the pipeline with progress, yielding results as they finish
+
+    Args:
+        tax_codes: Tax codes to search for (list or any iterable)
+        progress_callback: Callback function(current, total, code, status)
+        **kwargs: Passed to iter_pipeline
+
+    Yields:
+        (input index, result dict) in completion order
+    """
+    feed = CodeFeed(tax_codes)
+    codes: Dict[int, str] = {}
+
+    def remember():
+        # Runs under iter_pipeline's input lock, so indexes match its enumerate()
+        for idx, code in enumerate(feed):
+            codes[idx] = code.strip()
+            yield code
+
+    if progress_callback:
+        progress_callback(0, feed.total, '', 'Starting crawl...')
+
+    for completed, (idx, info) in enumerate(iter_pipeline(remember(), **kwargs), start=1):
+        tax_code = codes.pop(idx)
+        yield idx, info
+        if progress_callback:
+            progress_callback(completed, feed.total, tax_code, f"Completed {completed}/{feed.total}")
+
+
+def crawl_pipeline(tax_codes: List[str], progress_callback=None, result_callback=None, **kwargs) -> List[Dict]:
+    """
+    Crawl tax codes through the pipeline and return results in input order
+
+    Args:
+        tax_codes: List of tax codes to search for
+        progress_callback: Callback function(current, total, code, status)
+        result_callback: Callback function(index, result) as each code completes
+        **kwargs: Passed to iter_pipeline
+
+    Returns:
+        List of dictionaries containing tax information
+    """
+    results: List[Optional[Dict]] = [None] * len(tax_codes)
+
+    for idx, info in iter_crawl_pipeline(tax_codes, progress_callback, **kwargs):
+        results[idx] = info
+        if result_callback:
+            result_callback(idx, info)
+
+    return results
+
+
+def _store(cache: Optional[ResultCache], tax_code: str, info: Dict) -> Dict:
+    if cache is not None:
+        cache.set(tax_code, info)
+    index_result(info)
+    return info
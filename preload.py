@@ -0,0 +1,95 @@
+"""
+Background preloading of lazily imported dependencies
+
+The parsing (lxml), tabular (pandas) and export (openpyxl) libraries are
+imported where they are first used, so the web app starts accepting traffic
+without paying for them. Shortly after startup preload_in_background imports
+them in a daemon thread, so the first parse or Excel download does not pay
+for them either.
+"""
+import importlib
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import metrics
+
+
+# Dependencies importing the app must not load (first use or preload_in_background does)
+DEFERRED_MODULES = ("pandas", "numpy", "pyarrow", "openpyxl", "lxml", "bs4", "html5lib")
+
+PRELOAD_ENABLED = os.environ.get("PRELOAD_ENABLED", "true").lower() not in ("0", "false", "no")
+# Seconds to wait after startup before preloading, so the first requests do not compete for the GIL
+PRELOAD_DELAY = float(os.environ.get("PRELOAD_DELAY", "1.0"))
+PRELOAD_MODULES: List[str] = [
+    name.strip() for name in os.environ.get("PRELOAD_MODULES", "lxml.html,openpyxl,pandas").split(",")
+    if name.strip()
+]
+
+logger = logging.getLogger(__name__)
+
+# Seconds each preloaded module took to import (0 if something else imported it first)
+_timings: Dict[str, float] = {}
+
+
+def preload(modules: Iterable[str] = PRELOAD_MODULES) -> Dict[str, Optional[float]]:
+    """
+    Import modules now, timing each one
+
+    Args:
+        modules: Module names; missing optional dependencies are skipped
+
+    Returns:
+        {module: import seconds, or None if it is not installed}
+    """
+    timings: Dict[str, Optional[float]] = {}
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            timings[name] = None
+            continue
+        timings[name] = _timings[name] = time.perf_counter() - start
+    logger.info("preload_done", extra={"modules": {
+        name: round(seconds, 3) if seconds is not None else None for name, seconds in timings.items()
+    }})
+    return timings
+
+
+def preload_in_background(
+    modules: Iterable[str] = PRELOAD_MODULES,
+    delay: float = PRELOAD_DELAY
+) -> Optional[threading.Thread]:
+    """
+    Preload modules in a daemon thread after `delay` seconds
+
+    Returns:
+        The started thread, or None when PRELOAD_ENABLED is off
+    """
+    if not PRELOAD_ENABLED:
+        return None
+    modules = list(modules)
+
+    def run():
+        time.sleep(delay)
+        try:
+            preload(modules)
+        except Exception:
+            logger.exception("preload_failed")
+
+    thread = threading.Thread(target=run, name="preload", daemon=True)
+    thread.start()
+    return thread
+
+
+def _preload_metrics():
+    """Import time of each preloaded module (scrape-time collector)"""
+    if _timings:
+        yield ("crawler_preload_seconds", "gauge", "Seconds taken to import each preloaded module",
+               [({"module": name}, seconds) for name, seconds in _timings.items()])
+
+
+metrics.REGISTRY.register_collector(_preload_metrics)
@@ -0,0 +1,126 @@
+"""
+Process-wide per-host rate limiting for outbound crawl requests
+
+Every fetch to a host draws a token from that host's bucket, so politeness is
+enforced globally no matter how many crawl loops, threads or sessions are
+running in the process.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Dict
+
+
+DEFAULT_RATE = float(os.environ.get("RATE_LIMIT_PER_SECOND", "1.0"))
+DEFAULT_BURST = int(os.environ.get("RATE_LIMIT_BURST", "1"))
+DEFAULT_JITTER = float(os.environ.get("RATE_LIMIT_JITTER", "0.5"))
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket with random jitter
+
+    Tokens refill at `rate` per second up to `burst`. Callers that find the
+    bucket empty reserve the next token (the balance goes negative) and sleep
+    until it is due, so waiters are served in arrival order. A rate of 0 or
+    less disables limiting.
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST, jitter: float = DEFAULT_JITTER):
+        """
+        Args:
+            rate: Sustained requests per second
+            burst: Maximum number of requests allowed back-to-back
+            jitter: Extra random delay, as a fraction of one refill interval
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.jitter = max(0.0, jitter)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take one token and return how long the caller must wait for it"""
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if self.jitter:
+            wait += random.uniform(0, self.jitter / self.rate)
+        return wait
+
+    def set_rate(self, rate: float):
+        """Change the sustained rate; tokens already earned at the old rate are kept"""
+        with self._lock:
+            now = time.monotonic()
+            if self.rate > 0:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.rate = rate
+
+    def acquire(self) -> float:
+        """
+        Block until a request may be sent
+
+        Returns:
+            Seconds spent waiting
+        """
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self) -> float:
+        """acquire() for async code: waits without blocking the event loop"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+_limiters: Dict[str, TokenBucket] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(host: str) -> TokenBucket:
+    """
+    Get the shared token bucket for a host, creating it with the defaults
+
+    Args:
+        host: Host name (netloc) the requests go to
+
+    Returns:
+        TokenBucket shared by every caller in the process
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = _limiters[host] = TokenBucket()
+        return limiter
+
+
+def set_rate_limit(host: str, rate: float, burst: int = DEFAULT_BURST, jitter: float = DEFAULT_JITTER) -> TokenBucket:
+    """
+    Replace the shared token bucket for a host
+
+    Args:
+        host: Host name (netloc) the requests go to
+        rate: Sustained requests per second (0 disables limiting)
+        burst: Maximum number of requests allowed back-to-back
+        jitter: Extra random delay, as a fraction of one refill interval
+
+    Returns:
+        The new TokenBucket
+    """
+    with _limiters_lock:
+        limiter = _limiters[host] = TokenBucket(rate, burst, jitter)
+        return limiter
@@ -0,0 +1,292 @@
+"""
+Incremental refresh of previously crawled companies
+
+For every code it has checked, the refresh keeps the last-seen page
+fingerprint: the upstream's ETag/Last-Modified validators when it sends
+them, plus a content hash of the two tables the parser reads
+(tax_parser.page_fingerprint). A re-check then costs as little as possible:
+
+- validators stored: a conditional request; a 304 means nothing changed and
+  there is no body to download or parse
+- otherwise the page is downloaded and hashed; an unchanged hash skips parsing
+- only pages whose hash changed are parsed and diffed field by field against
+  the stored record
+
+Only records that actually changed (or are seen for the first time) are
+reported, each with a {field: {"old", "new"}} diff.
+"""
+import functools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+
+import metrics
+from cache import ResultCache, cache_key, get_cache
+from company_index import index_result
+from crawler import _crawl_concurrently, download_page_if_changed
+from rate_limiter import TokenBucket
+from tax_parser import RESULT_FIELDS, page_fingerprint, parse_result_timed
+
+
+REFRESH_PATH = os.environ.get("REFRESH_PATH", "data/refresh.sqlite3")
+REFRESH_CONCURRENCY = int(os.environ.get("REFRESH_CONCURRENCY", os.environ.get("DEFAULT_BATCH_SIZE", "3")))
+
+# Result of checking one code
+NOT_MODIFIED = "not_modified"   # 304 to a conditional request
+UNCHANGED = "unchanged"         # downloaded, but same fingerprint (or same fields)
+CHANGED = "changed"             # parsed, and at least one field differs
+NEW = "new"                     # no fingerprint stored yet
+FAILED = "error"                # blocked, empty or failed; the stored record is kept
+
+# Statuses refresh_tax_codes reports
+REPORTED = (CHANGED, NEW)
+
+logger = logging.getLogger(__name__)
+
+
+def diff_records(old: Dict, new: Dict) -> Dict[str, Dict]:
+    """
+    Field-level difference between two result dicts
+
+    Returns:
+        {field: {"old": value or None, "new": value or None}} for every
+        field whose value differs, in RESULT_FIELDS order
+    """
+    fields = RESULT_FIELDS + [key for key in {**old, **new} if key not in RESULT_FIELDS]
+    return {
+        field: {"old": old.get(field), "new": new.get(field)}
+        for field in fields
+        if old.get(field) != new.get(field)
+    }
+
+
+class FingerprintStore:
+    """
+    SQLite store of the last-seen fingerprint and record of each code
+
+    Thread-safe; a single instance is shared by all refresh threads.
+    """
+
+    def __init__(self, path: str = REFRESH_PATH):
+        """
+        Args:
+            path: SQLite database file (":memory:" keeps everything in RAM)
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            " tax_code TEXT PRIMARY KEY,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " content_hash TEXT NOT NULL,"
+            " data TEXT NOT NULL,"
+            " checked_at REAL NOT NULL,"
+            " changed_at REAL NOT NULL)"
+        )
+
+    def get(self, tax_code: str) -> Optional[Dict]:
+        """
+        Stored fingerprint of a code
+
+        Returns:
+            {"validators", "content_hash", "data", "checked_at", "changed_at"},
+            or None if the code was never refreshed
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT etag, last_modified, content_hash, data, checked_at, changed_at"
+                " FROM fingerprints WHERE tax_code = ?",
+                (cache_key(tax_code),)
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, content_hash, data, checked_at, changed_at = row
+        validators = {"etag": etag, "last_modified": last_modified}
+        return {
+            "validators": {key: value for key, value in validators.items() if value},
+            "content_hash": content_hash,
+            "data": json.loads(data),
+            "checked_at": checked_at,
+            "changed_at": changed_at,
+        }
+
+    def put(self, tax_code: str, validators: Dict[str, str], content_hash: str, info: Dict):
+        """Store a freshly parsed record and its fingerprint"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO fingerprints"
+                " (tax_code, etag, last_modified, content_hash, data, checked_at, changed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (cache_key(tax_code), validators.get("etag"), validators.get("last_modified"),
+                 content_hash, json.dumps(info, ensure_ascii=False), now, now)
+            )
+
+    def touch(self, tax_code: str, validators: Dict[str, str]):
+        """Record that a code was checked and found unchanged (validators may have been renewed)"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE fingerprints SET etag = ?, last_modified = ?, checked_at = ? WHERE tax_code = ?",
+                (validators.get("etag"), validators.get("last_modified"), time.time(), cache_key(tax_code))
+            )
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+        return {"entries": entries}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_store: Optional[FingerprintStore] = None
+_store_lock = threading.Lock()
+
+
+def get_fingerprint_store() -> FingerprintStore:
+    """Get the process-wide fingerprint store, creating it on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = FingerprintStore()
+    return _store
+
+
+def refresh_tax_code(
+    tax_code: str,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    force_refresh: bool = False,
+    store: Optional[FingerprintStore] = None,
+    cache: Optional[ResultCache] = None
+) -> Dict:
+    """
+    Re-check one code against its stored fingerprint
+
+    Fresh records (changed or not) are also written to the result cache, so
+    lookups right after a refresh are served locally.
+
+    Args:
+        tax_code: The tax code to re-check
+        session: HTTP session to use (defaults to the shared pooled session)
+        rate_limiter: Token bucket to draw from (defaults to the shared per-host one)
+        force_refresh: Ignore the stored validators and hash: download and parse the page
+        store: Fingerprint store (defaults to the shared one)
+        cache: Result cache to update (defaults to the shared one, if enabled)
+
+    Returns:
+        {"MST", "status" (see the statuses above), "changes" (field diff,
+        empty unless changed/new), "info" (current record, None on error),
+        "error"}
+    """
+    store = store or get_fingerprint_store()
+    cache = cache or get_cache()
+    previous = store.get(tax_code)
+    validators = previous["validators"] if previous and not force_refresh else None
+
+    try:
+        html, fresh_validators = download_page_if_changed(tax_code, validators, session, rate_limiter)
+    except Exception as e:
+        logger.warning("refresh_failed", extra={"tax_code": tax_code, "error": str(e)})
+        return _result(tax_code, FAILED, error=str(e))
+
+    if html is None:
+        store.touch(tax_code, fresh_validators)
+        return _unchanged(tax_code, NOT_MODIFIED, previous["data"], cache)
+
+    content_hash = page_fingerprint(html)
+    if previous is not None and not force_refresh and content_hash == previous["content_hash"]:
+        store.touch(tax_code, fresh_validators)
+        return _unchanged(tax_code, UNCHANGED, previous["data"], cache)
+
+    info, seconds = parse_result_timed(tax_code, html)
+    metrics.PARSE_SECONDS.observe(seconds)
+    store.put(tax_code, fresh_validators, content_hash, info)
+    index_result(info)
+    if cache is not None:
+        cache.set(tax_code, info)
+
+    changes = diff_records(previous["data"] if previous else {}, info)
+    if previous is None:
+        return _result(tax_code, NEW, info, changes)
+    if not changes:
+        # Markup outside the parsed fields moved; the new hash is stored so it is skipped next time
+        return _result(tax_code, UNCHANGED, info)
+    logger.info("refresh_changed", extra={"tax_code": tax_code, "fields": list(changes)})
+    return _result(tax_code, CHANGED, info, changes)
+
+
+def _unchanged(tax_code: str, status: str, info: Dict, cache: Optional[ResultCache]) -> Dict:
+    if cache is not None:
+        cache.set(tax_code, info)
+    return _result(tax_code, status, info)
+
+
+def _result(tax_code: str, status: str, info: Optional[Dict] = None, changes: Optional[Dict] = None,
+            error: Optional[str] = None) -> Dict:
+    metrics.REFRESH_RESULTS.labels(status).inc()
+    return {"MST": tax_code, "status": status, "changes": changes or {}, "info": info, "error": error}
+
+
+def iter_refresh(
+    tax_codes: Iterable[str],
+    concurrency: int = REFRESH_CONCURRENCY,
+    store: Optional[FingerprintStore] = None,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    force_refresh: bool = False
+) -> Iterator[Tuple[int, Dict]]:
+    """
+    Re-check codes concurrently, yielding every check as it finishes
+
+    Pacing comes from the shared rate limiter, as for a regular crawl.
+
+    Yields:
+        (input index, refresh_tax_code result) in completion order
+    """
+    store = store or get_fingerprint_store()
+    check = functools.partial(refresh_tax_code, store=store)
+    yield from _crawl_concurrently(tax_codes, concurrency, session, rate_limiter, force_refresh, fetch=check)
+
+
+def refresh_tax_codes(
+    tax_codes: Iterable[str],
+    concurrency: int = REFRESH_CONCURRENCY,
+    store: Optional[FingerprintStore] = None,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    force_refresh: bool = False
+) -> Tuple[List[Dict], Dict[str, int]]:
+    """
+    Re-check a portfolio of codes and keep only what changed
+
+    Args:
+        tax_codes: Tax codes to re-check
+        concurrency: Number of concurrent checks
+        store: Fingerprint store (defaults to the shared one)
+        session: HTTP session to use (defaults to the shared pooled session)
+        rate_limiter: Token bucket to draw from (defaults to the shared per-host one)
+        force_refresh: Download and parse every page regardless of its fingerprint
+
+    Returns:
+        (changed and new records in input order, count of checks per status)
+    """
+    counts = {status: 0 for status in (NOT_MODIFIED, UNCHANGED, CHANGED, NEW, FAILED)}
+    reported: Dict[int, Dict] = {}
+    for idx, result in iter_refresh(tax_codes, concurrency, store, session, rate_limiter, force_refresh):
+        counts[result["status"]] += 1
+        if result["status"] in REPORTED:
+            reported[idx] = result
+    return [reported[idx] for idx in sorted(reported)], counts
@@ -0,0 +1,353 @@
+"""
+Central crawl scheduler: one bounded worker pool shared by every job
+
+Instead of each job running its own fetch threads, all jobs hand their codes
+to a fixed pool of SCHEDULER_WORKERS threads, so the number of requests in
+flight to masothue.com is bounded however many users upload at once (pacing
+still comes from the shared per-host rate limiter, the global request
+budget).
+
+- Fair sharing: each time a worker frees up it takes the next code from the
+  job that has been served least relative to its weight (stride
+  scheduling), so concurrent jobs advance round-robin, or in proportion to
+  their weights.
+- Priorities: codes of INTERACTIVE jobs are dispatched before any bulk
+  job's next code. (The web lookups do not go through the pool: they fetch
+  on the event loop and get their priority from the throttle instead.)
+- Admission: at most SCHEDULER_MAX_ACTIVE_JOBS bulk jobs share the workers;
+  later ones wait in FIFO order and are told their queue position.
+
+A job's input is read lazily, one code per dispatch, so an upload still
+being parsed (or a de-duplicating generator) can feed the scheduler.
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import metrics
+from crawler import fetch_tax_info
+
+
+SCHEDULER_WORKERS = int(os.environ.get("SCHEDULER_WORKERS", "4"))
+SCHEDULER_MAX_ACTIVE_JOBS = int(os.environ.get("SCHEDULER_MAX_ACTIVE_JOBS", "8"))
+
+# Priority classes: lower is served first
+INTERACTIVE = 0
+BULK = 1
+
+_PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+
+def _default_fetch(tax_code: str, force_refresh: bool) -> Dict:
+    return fetch_tax_info(tax_code, force_refresh=force_refresh)
+
+
+class _Job:
+    """Scheduler-side state of one job"""
+
+    def __init__(self, job_id: str, codes: Iterable[str], priority: int, weight: float,
+                 max_in_flight: int, force_refresh: bool):
+        self.job_id = job_id
+        self.codes = iter(codes)
+        self.priority = priority
+        self.weight = max(weight, 0.001)
+        self.max_in_flight = max(1, max_in_flight)
+        self.force_refresh = force_refresh
+        self.events: "queue.Queue[Tuple[str, object, object]]" = queue.Queue()
+        self.read = 0              # codes taken from the input so far
+        self.in_flight = 0
+        self.unconsumed = 0        # dispatched codes whose result the consumer has not taken yet
+        self.pass_ = 0.0           # virtual time: dispatches / weight
+        self.reading = False
+        self.exhausted = False
+        self.finished = False
+        self.submitted = time.monotonic()
+        self.ready_since: Optional[float] = None   # when the job last became dispatchable
+
+    def dispatchable(self) -> bool:
+        """Has input left and room for another code in flight"""
+        return (not self.reading and not self.exhausted and not self.finished
+                and self.in_flight < self.max_in_flight and self.unconsumed < self.max_in_flight * 2)
+
+    def mark_ready(self):
+        """Start the queue-wait clock if the job can take another code now (lock held)"""
+        if self.ready_since is None and self.dispatchable():
+            self.ready_since = time.monotonic()
+
+
+class Scheduler:
+    """Fixed worker pool dispatching codes from many jobs fairly"""
+
+    def __init__(
+        self,
+        workers: int = SCHEDULER_WORKERS,
+        max_active_jobs: int = SCHEDULER_MAX_ACTIVE_JOBS,
+        fetch: Callable[[str, bool], Dict] = _default_fetch
+    ):
+        """
+        Args:
+            workers: Number of fetch threads shared by all jobs
+            max_active_jobs: Bulk jobs served at once; others wait in line
+            fetch: Function(tax_code, force_refresh) -> result dict
+        """
+        self.workers = max(1, workers)
+        self.max_active_jobs = max(1, max_active_jobs)
+        self.fetch = fetch
+        self._cond = threading.Condition()
+        self._active: List[_Job] = []
+        self._waiting: Deque[_Job] = deque()
+        self._busy = 0
+        self._dispatched = 0
+        self._threads: List[threading.Thread] = []
+
+    def _start(self):
+        # Called with the lock held
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"scheduler-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def iter_crawl(
+        self,
+        job_id: str,
+        tax_codes: Iterable[str],
+        progress_callback = None,
+        priority: int = BULK,
+        weight: float = 1.0,
+        max_in_flight: int = 3,
+        force_refresh: bool = False,
+        on_queue: Optional[Callable[[int], None]] = None
+    ) -> Iterator[Tuple[int, Dict]]:
+        """
+        Crawl a job's codes on the shared workers, yielding results as they finish
+
+        Same contract as crawler.iter_crawl_tax_codes: the input is read
+        lazily, callbacks run on the calling thread and closing the
+        generator stops dispatching the job's codes.
+
+        Args:
+            job_id: Job (session) id
+            tax_codes: Tax codes to search for (list or any iterable)
+            progress_callback: Callback function(current, total, code, status)
+            priority: INTERACTIVE or BULK
+            weight: Share of the workers relative to other jobs of the same priority
+            max_in_flight: Most of this job's codes fetched at once
+            force_refresh: Bypass the result cache and re-fetch from upstream
+            on_queue: Called with the job's queue position (jobs ahead + 1)
+                while it waits for admission, and 0 once it is admitted
+
+        Yields:
+            (input index, result dict) in completion order
+        """
+        job = _Job(job_id, tax_codes, priority, weight, max_in_flight, force_refresh)
+        self._submit(job)
+        completed = 0
+        in_flight: Dict[int, str] = {}
+
+        if progress_callback:
+            progress_callback(0, job.read, '', 'Starting crawl...')
+
+        try:
+            while True:
+                kind, idx, value = job.events.get()
+                if kind == "queued":
+                    if on_queue:
+                        on_queue(value)
+                    elif progress_callback and value:
+                        progress_callback(completed, job.read, '', f"Queued: position {value}")
+                elif kind == "start":
+                    in_flight[idx] = value
+                    if progress_callback:
+                        progress_callback(completed, job.read, value, f"Crawling {value}...")
+                elif kind == "done":
+                    with self._cond:
+                        job.unconsumed -= 1
+                        job.mark_ready()
+                        self._cond.notify()
+                    completed += 1
+                    tax_code = in_flight.pop(idx, '')
+                    yield idx, value
+                    if progress_callback:
+                        progress_callback(completed, job.read, tax_code, f"Completed {completed}/{job.read}")
+                elif kind == "end":
+                    if value is not None:
+                        raise value
+                    return
+        finally:
+            self._retire(job)
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        """0 if the job is being served, its 1-based place in line if waiting, None if unknown"""
+        with self._cond:
+            if any(job.job_id == job_id for job in self._active):
+                return 0
+            for position, job in enumerate(self._waiting, start=1):
+                if job.job_id == job_id:
+                    return position
+        return None
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "busy": self._busy,
+                "active_jobs": len(self._active),
+                "queued_jobs": len(self._waiting),
+                "dispatched": self._dispatched,
+            }
+
+    def _submit(self, job: _Job):
+        with self._cond:
+            self._start()
+            bulk_active = sum(1 for j in self._active if j.priority != INTERACTIVE)
+            if job.priority == INTERACTIVE or (bulk_active < self.max_active_jobs and not self._waiting):
+                self._admit(job)
+            else:
+                self._waiting.append(job)
+                job.events.put(("queued", None, len(self._waiting)))
+            self._cond.notify_all()
+
+    def _admit(self, job: _Job):
+        # Start at the current minimum virtual time so a new job gets its fair
+        # share from now on, not a catch-up burst
+        peers = [j.pass_ for j in self._active if j.priority == job.priority]
+        job.pass_ = min(peers) if peers else 0.0
+        # The first code's queue wait includes the time spent waiting for admission
+        job.ready_since = job.submitted
+        self._active.append(job)
+        if job.priority != INTERACTIVE and job.read == 0:
+            job.events.put(("queued", None, 0))
+
+    def _retire(self, job: _Job):
+        """Remove a finished or abandoned job and admit waiting ones"""
+        with self._cond:
+            if job.finished:
+                return
+            job.finished = True
+            if job in self._active:
+                self._active.remove(job)
+            elif job in self._waiting:
+                self._waiting.remove(job)
+            bulk_active = sum(1 for j in self._active if j.priority != INTERACTIVE)
+            while self._waiting and bulk_active < self.max_active_jobs:
+                self._admit(self._waiting.popleft())
+                bulk_active += 1
+            for position, waiting in enumerate(self._waiting, start=1):
+                waiting.events.put(("queued", None, position))
+            self._cond.notify_all()
+
+    def _pick(self) -> Optional[_Job]:
+        best = None
+        for job in self._active:
+            if not job.dispatchable():
+                continue
+            if best is None or (job.priority, job.pass_) < (best.priority, best.pass_):
+                best = job
+        return best
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._pick()
+                while job is None:
+                    self._cond.wait()
+                    job = self._pick()
+                job.reading = True
+
+            # Read outside the lock: the input may be a file still being parsed
+            try:
+                code = next(job.codes)
+                error = None
+            except StopIteration:
+                code = error = None
+            except Exception as e:
+                code, error = None, e
+
+            with self._cond:
+                job.reading = False
+                if code is None:
+                    job.exhausted = True
+                    if error is not None:
+                        job.events.put(("end", None, error))
+                    elif job.in_flight == 0:
+                        job.events.put(("end", None, None))
+                    self._cond.notify_all()
+                    continue
+                idx = job.read
+                job.read += 1
+                job.in_flight += 1
+                job.unconsumed += 1
+                job.pass_ += 1 / job.weight
+                self._busy += 1
+                self._dispatched += 1
+                now = time.monotonic()
+                waited = now - job.ready_since if job.ready_since is not None else 0.0
+                job.ready_since = now if job.dispatchable() else None
+                self._cond.notify_all()
+
+            metrics.QUEUE_WAIT_SECONDS.labels(_PRIORITY_NAMES.get(job.priority, str(job.priority))).observe(waited)
+            if metrics.TRACE_SPANS:
+                metrics.span("queue", waited, job_id=job.job_id, tax_code=code.strip())
+
+            code = code.strip()
+            job.events.put(("start", idx, code))
+            try:
+                info = self.fetch(code, job.force_refresh)
+            except Exception as e:
+                info = {"MST": code, "Error": str(e)}
+
+            with self._cond:
+                self._busy -= 1
+                job.in_flight -= 1
+                job.mark_ready()
+                job.events.put(("done", idx, info))
+                if job.exhausted and job.in_flight == 0:
+                    job.events.put(("end", None, None))
+                self._cond.notify_all()
+
+
+_scheduler: Optional[Scheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    """Get the process-wide scheduler"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
+
+
+def configure_scheduler(workers: int) -> Scheduler:
+    """
+    Replace the process-wide scheduler with one of `workers` fetch threads
+
+    Only for a process that has not started any job yet (the CLI sizes the
+    pool from --concurrency).
+    """
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = Scheduler(workers=workers)
+        return _scheduler
+
+
+def _scheduler_metrics():
+    """Worker pool state of the process-wide scheduler (scrape-time collector)"""
+    if _scheduler is None:
+        return
+    stats = _scheduler.stats()
+    yield ("crawler_scheduler_workers", "gauge", "Scheduler worker threads", [({}, stats["workers"])])
+    yield ("crawler_scheduler_busy_workers", "gauge", "Scheduler workers fetching a code", [({}, stats["busy"])])
+    yield ("crawler_scheduler_active_jobs", "gauge", "Jobs admitted to the worker pool", [({}, stats["active_jobs"])])
+    yield ("crawler_scheduler_queued_jobs", "gauge", "Bulk jobs waiting for admission", [({}, stats["queued_jobs"])])
+    yield ("crawler_scheduler_dispatched_total", "counter", "Codes handed to scheduler workers",
+           [({}, stats["dispatched"])])
+
+
+metrics.REGISTRY.register_collector(_scheduler_metrics)
@@ -0,0 +1,131 @@
+"""
+Request coalescing ("single flight") for upstream fetches
+
+When several callers ask for the same tax code at the same time, only the
+first one fetches it; the others wait for and share that result. Nothing
+is remembered after the fetch completes (that is the result cache's job).
+
+One process-wide map of in-flight calls serves both kinds of caller:
+threads (fetch_tax_info) wait on the call's future, coroutines on any event
+loop (afetch_tax_info) await it, so a batch job and a web lookup asking for
+the same code at the same time share one upstream fetch.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, Hashable, Set, TypeVar
+
+import metrics
+
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Thread-safe call coalescing keyed by an arbitrary hashable key"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        # Async leaders' tasks (the loop only keeps weak references)
+        self._tasks: Set[asyncio.Task] = set()
+        self.calls = 0
+        self.coalesced = 0
+
+    def _join(self, key: Hashable):
+        """The call in flight for `key` and whether the caller has to run it"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = self._calls[key] = Future()
+            # A running future cannot be cancelled by a waiter that goes away
+            call.set_running_or_notify_cancel()
+            self.calls += 1
+            return call, True
+
+    def _finish(self, key: Hashable):
+        with self._lock:
+            del self._calls[key]
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """
+        Run fn() unless a call with the same key is already running, in which
+        case wait for it and return (or raise) its outcome
+
+        Args:
+            key: Identifies identical work (e.g. the tax code)
+            fn: The work itself
+
+        Returns:
+            fn()'s result, possibly from another caller's run
+        """
+        call, leader = self._join(key)
+        if not leader:
+            return call.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key)
+            call.set_exception(e)
+            raise
+        self._finish(key)
+        call.set_result(result)
+        return result
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        do() for coroutines: await fn() unless the same key is already in
+        flight (on a thread or any event loop), then share its outcome
+
+        The shared work runs as its own task, so a caller that is cancelled
+        (client went away) does not cancel it for the others.
+        """
+        call, leader = self._join(key)
+        if leader:
+            task = asyncio.ensure_future(fn())
+            self._tasks.add(task)
+            task.add_done_callback(lambda done: self._settle(key, call, done))
+        return await asyncio.wrap_future(call)
+
+    def _settle(self, key: Hashable, call: Future, task: asyncio.Task):
+        """Hand an async leader's outcome to every waiter"""
+        self._tasks.discard(task)
+        self._finish(key)
+        if task.cancelled():
+            call.set_exception(asyncio.CancelledError())
+        elif task.exception() is not None:
+            call.set_exception(task.exception())
+        else:
+            call.set_result(task.result())
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+
+_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    """The process-wide SingleFlight shared by threaded and async fetches"""
+    return _flight
+
+
+def stats() -> Dict:
+    """Coalescing counters of the process-wide flight"""
+    return _flight.stats()
+
+
+def _coalescing_metrics():
+    """Coalescing counters (scrape-time collector)"""
+    totals = stats()
+    yield ("crawler_coalesced_lookups_total", "counter", "Lookups that shared another caller's upstream fetch",
+           [({}, totals["coalesced"])])
+    yield ("crawler_coalesced_in_flight", "gauge", "Distinct codes being fetched with coalescing",
+           [({}, totals["in_flight"])])
+
+
+metrics.REGISTRY.register_collector(_coalescing_metrics)
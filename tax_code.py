@@ -0,0 +1,295 @@
+"""
+Vietnamese tax code (MST) normalization, validation and de-duplication
+
+An MST is 10 digits, where the 10th is a check digit over the first nine
+(weights 31, 29, 23, 19, 17, 13, 7, 5, 3, mod 11), optionally followed by a
+``-NNN`` branch suffix (001-999) for dependent units. Codes are cleaned up
+(spaces, punctuation, a lost leading zero), validated, and each unique code
+is fetched once; rows with an invalid code get an error result without
+touching the network and duplicate rows share the first row's result.
+"""
+import os
+import queue
+import re
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+CHECK_WEIGHTS = (31, 29, 23, 19, 17, 13, 7, 5, 3)
+
+# Most rows (results, invalid rows, duplicates) read ahead of the consumer
+DEDUP_READ_AHEAD = int(os.environ.get("DEDUP_READ_AHEAD", "1000"))
+
+_DONE = object()
+
+_NOT_DIGIT_OR_DASH_RE = re.compile(r"[^0-9-]")
+
+
+class InvalidTaxCode(ValueError):
+    """The value is not a well-formed MST"""
+
+
+def check_digit(first9: str) -> Optional[int]:
+    """
+    Check digit for the first nine digits of an MST
+
+    Returns:
+        The expected 10th digit, or None if no valid MST starts with these digits
+    """
+    remainder = sum(int(d) * w for d, w in zip(first9, CHECK_WEIGHTS)) % 11
+    digit = 10 - remainder
+    return digit if digit < 10 else None
+
+
+def with_check_digit(first9: str) -> Optional[str]:
+    """Complete nine digits into a valid 10-digit MST (None if impossible)"""
+    digit = check_digit(first9)
+    return f"{first9}{digit}" if digit is not None else None
+
+
+def normalize_tax_code(raw) -> str:
+    """
+    Canonical form of an MST: ``NNNNNNNNNN`` or ``NNNNNNNNNN-NNN``
+
+    Accepts stray spaces/punctuation, a 13-digit branch code without the
+    dash and a leading zero lost by a spreadsheet.
+
+    Raises:
+        InvalidTaxCode: Wrong length, bad branch suffix or check digit mismatch
+    """
+    text = str(raw).strip() if raw is not None else ""
+    parts = [p for p in _NOT_DIGIT_OR_DASH_RE.sub("", text).split("-") if p]
+    if not parts or len(parts) > 2:
+        raise InvalidTaxCode(f"Invalid tax code '{text}': expected 10 digits or 10 digits + '-NNN'")
+
+    main = parts[0]
+    branch = parts[1] if len(parts) == 2 else None
+    if branch is None and len(main) in (12, 13):
+        main, branch = main[:-3], main[-3:]
+
+    if len(main) == 9:
+        main = "0" + main
+    if len(main) != 10:
+        raise InvalidTaxCode(f"Invalid tax code '{text}': expected 10 digits, got {len(main)}")
+    if branch is not None and (len(branch) != 3 or branch == "000"):
+        raise InvalidTaxCode(f"Invalid tax code '{text}': branch suffix must be 001-999")
+    if check_digit(main[:9]) != int(main[9]):
+        raise InvalidTaxCode(f"Invalid tax code '{text}': check digit mismatch")
+
+    return f"{main}-{branch}" if branch else main
+
+
+def is_valid_tax_code(raw) -> bool:
+    """True if the value normalizes to a valid MST"""
+    try:
+        normalize_tax_code(raw)
+        return True
+    except InvalidTaxCode:
+        return False
+
+
+class DedupStats:
+    """Counters for a de-duplicated crawl"""
+
+    def __init__(self):
+        self.rows = 0
+        self.unique = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.resumed = 0
+
+    @property
+    def fetches_saved(self) -> int:
+        """Upstream requests not made thanks to de-duplication and validation"""
+        return self.duplicates + self.invalid
+
+    def as_dict(self) -> Dict:
+        return {
+            "rows": self.rows,
+            "unique": self.unique,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "fetches_saved": self.fetches_saved,
+            "resumed": self.resumed,
+        }
+
+
+def iter_deduplicated(
+    tax_codes: Iterable,
+    crawl: Callable,
+    lookup: Optional[Callable[[int], Optional[Dict]]] = None,
+    stats: Optional[DedupStats] = None,
+    progress_callback = None,
+    is_done: Optional[Callable[[int], bool]] = None
+) -> Iterator[Tuple[int, Dict]]:
+    """
+    Crawl only the unique valid codes of an input and fan results back out to every row
+
+    Args:
+        tax_codes: Raw input values (read lazily)
+        crawl: Function(codes, progress_callback) -> iterator of (index, result),
+            e.g. a partial of iter_crawl_tax_codes; it gets the unique
+            normalized codes and indexes results by their position among them
+        lookup: Function(row) -> stored result of an earlier row, used for a
+            duplicate whose original already finished. Defaults to keeping
+            finished results in memory.
+        stats: Counters to fill in (rows, unique, duplicates, invalid)
+        progress_callback: Callback function(current, total, code, status) in input rows
+        is_done: Function(row) -> True if the row already has a stored result
+            (resuming a job). Such rows are neither fetched nor yielded, and
+            later duplicates of their code are served through `lookup`.
+
+    Yields:
+        (input row, result dict); duplicate rows get the same result as their
+        original, invalid rows {"MST": raw, "Error": reason}
+    """
+    stats = stats if stats is not None else DedupStats()
+    lock = threading.Lock()
+    # Everything for the consumer, in the order it is produced: invalid rows
+    # and duplicates as they are read, fetched codes as they finish. Bounded,
+    # so a long run of rows that need no fetch is handed over as it is read.
+    out: "queue.Queue" = queue.Queue(maxsize=max(1, DEDUP_READ_AHEAD))
+    stop = threading.Event()
+    seen: Dict[str, int] = {}          # normalized code -> unique index
+    codes: List[str] = []              # unique index -> normalized code
+    first_row: List[int] = []          # unique index -> first input row
+    waiting: Dict[int, List[int]] = {}  # unique index -> duplicate rows until its result is out
+    finished: Dict[int, Dict] = {}     # unique index -> result (only without lookup)
+    resumed: Dict[str, int] = {}       # normalized code -> row already stored (is_done)
+    rows_done = 0
+
+    def put(item) -> bool:
+        """Blocking put that gives up once the consumer has gone away"""
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def unique_codes() -> Iterator[str]:
+        # Pulled by the crawl engine (possibly from several fetcher threads)
+        for row, raw in enumerate(tax_codes):
+            if stop.is_set():
+                return
+            if is_done is not None and is_done(row):
+                with lock:
+                    stats.rows += 1
+                    stats.resumed += 1
+                    code = _normalized_or_none(raw)
+                    if code is not None and code not in seen:
+                        # Checkpointed before a restart: later duplicates read it back
+                        resumed.setdefault(code, row)
+                continue
+            try:
+                code = normalize_tax_code(raw)
+            except InvalidTaxCode as e:
+                with lock:
+                    stats.rows += 1
+                    stats.invalid += 1
+                if not put(("row", row, {"MST": str(raw).strip(), "Error": str(e)})):
+                    return
+                continue
+
+            with lock:
+                stats.rows += 1
+                done_row = resumed.get(code)
+                u = seen.get(code)
+                if done_row is None and u is None:
+                    seen[code] = len(first_row)
+                    codes.append(code)
+                    first_row.append(row)
+                    waiting[len(first_row) - 1] = []
+                    stats.unique += 1
+                else:
+                    stats.duplicates += 1
+                    if done_row is None and u in waiting:
+                        waiting[u].append(row)
+                        continue
+            if done_row is not None:
+                stored = lookup(done_row) if lookup else None
+            elif u is None:
+                yield code
+                continue
+            else:
+                stored = lookup(first_row[u]) if lookup else finished.get(u)
+            if not put(("row", row, stored if stored is not None else {"MST": code})):
+                return
+
+    def progress(current, total, code, status):
+        if progress_callback and not status.startswith("Completed"):
+            progress_callback(rows_done + stats.resumed, stats.rows, code, status)
+
+    def run_crawl():
+        # The crawl runs on its own thread so that the consumer stays free to
+        # take rows off `out` while the engine is still reading the input
+        results = crawl(unique_codes(), progress)
+        try:
+            for u, info in results:
+                if not put(("fetched", u, info)):
+                    return
+        except BaseException as e:
+            put(("error", e, None))
+            return
+        finally:
+            close = getattr(results, "close", None)
+            if close is not None:
+                close()
+        put(_DONE)
+
+    threading.Thread(target=run_crawl, name="dedup-crawl", daemon=True).start()
+
+    reported = 0
+    try:
+        while True:
+            item = out.get()
+            if item is _DONE:
+                break
+            kind, key, info = item
+            if kind == "error":
+                raise key
+            if kind == "row":
+                rows_done += 1
+                yield key, info
+                code = ''
+                if not out.empty():
+                    # Report a run of rows once it has been handed over
+                    continue
+            else:
+                u = key
+                code = codes[u]
+                rows = [first_row[u]]
+                sent = 0
+                while True:
+                    for row in rows[sent:]:
+                        rows_done += 1
+                        yield row, info
+                    sent = len(rows)
+                    with lock:
+                        # Duplicates may have been read while we were yielding
+                        if len(waiting[u]) + 1 == sent:
+                            del waiting[u]
+                            if lookup is None:
+                                finished[u] = info
+                            break
+                        rows = [first_row[u]] + waiting[u]
+
+            if progress_callback:
+                reported = rows_done
+                done = rows_done + stats.resumed
+                progress_callback(done, stats.rows, code, f"Completed {done}/{stats.rows}")
+    finally:
+        stop.set()
+
+    # Rows handed over after the last report
+    if progress_callback and rows_done != reported:
+        done = rows_done + stats.resumed
+        progress_callback(done, stats.rows, '', f"Completed {done}/{stats.rows}")
+
+
+def _normalized_or_none(raw) -> Optional[str]:
+    try:
+        return normalize_tax_code(raw)
+    except InvalidTaxCode:
+        return None
@@ -0,0 +1,380 @@
+"""
+Parser for masothue.com search result pages
+
+The page holds two tables we care about: the company-info table
+(``table.table-taxinfo``) and, after the last "Ngành nghề kinh doanh" heading,
+the industries table. Both are located directly on the raw bytes (no full
+decode, no scan past the industries table) and parsed together in a single
+lxml pass. When lxml is not installed the original html5lib/BeautifulSoup
+path is used instead; both produce identical dicts.
+
+lxml itself is imported on the first parse, not with this module, so
+importing the crawler (and starting the web app) does not pay for it.
+"""
+import hashlib
+import importlib.util
+import logging
+import re
+import time
+from typing import Dict, Iterator, List, Tuple, Union
+
+HAS_LXML = importlib.util.find_spec("lxml") is not None
+
+
+# Keys a result dict can have, in display/export order
+RESULT_FIELDS = [
+    "Tên", "MST", "Địa chỉ thuế", "Địa chỉ", "Tình trạng", "Người đại diện", "Điện thoại",
+    "Ngày hoạt động", "Quản lý bởi", "Loại hình DN", "Ngành nghề kinh doanh", "Error",
+]
+
+INDUSTRIES_MARKER = "Ngành nghề kinh doanh"
+_INDUSTRIES_MARKER_BYTES = INDUSTRIES_MARKER.encode("utf-8")
+_TABLE_RE = re.compile(r"<table.*?>.*?</table>", re.DOTALL | re.IGNORECASE)
+_TABLE_RE_BYTES = re.compile(rb"<table.*?>.*?</table>", re.DOTALL | re.IGNORECASE)
+
+# Markup that changes between otherwise identical pages (ads, scripts), left out of page fingerprints
+_VOLATILE_RE_BYTES = re.compile(rb"<(script|style|ins|iframe)\b.*?</\1\s*>", re.DOTALL | re.IGNORECASE)
+_WHITESPACE_RE_BYTES = re.compile(rb"\s+")
+
+# Subtrees dropped from the company-info table before reading text
+_JUNK_TAGS = ("script", "style", "ins", "iframe", "div")
+# Tags whose text BeautifulSoup's get_text() never returns
+_NON_TEXT_TAGS = ("script", "style", "template")
+
+
+logger = logging.getLogger(__name__)
+
+
+class ParseError(Exception):
+    """The page does not have the expected search result structure"""
+
+
+def parse_tax_page(html: Union[bytes, str]) -> Dict:
+    """
+    Parse a masothue.com search result page
+
+    Args:
+        html: Raw page, as UTF-8 bytes (preferred) or text
+
+    Returns:
+        Dictionary containing tax information (same keys as fetch_tax_info)
+
+    Raises:
+        ParseError: The page has no industries marker or no company table
+    """
+    if HAS_LXML:
+        return _parse_lxml(html if isinstance(html, bytes) else html.encode("utf-8"))
+    return _parse_html5lib(html.decode("utf-8", "replace") if isinstance(html, bytes) else html)
+
+
+def has_company_data(html: Union[bytes, str]) -> bool:
+    """Cheap check that a page has the company table parse_tax_page needs"""
+    data = html if isinstance(html, bytes) else html.encode("utf-8")
+    split_at = data.rfind(_INDUSTRIES_MARKER_BYTES)
+    return split_at >= 0 and _TABLE_RE_BYTES.search(data, 0, split_at) is not None
+
+
+def page_fingerprint(html: Union[bytes, str]) -> str:
+    """
+    Content hash of the parts of a page the parser reads
+
+    Covers the company-info and industries tables only, with scripts, ads
+    and whitespace left out, so a page whose hash has not changed would
+    parse to the same result and can be skipped.
+
+    Args:
+        html: Raw page, as UTF-8 bytes (preferred) or text
+
+    Returns:
+        Hex SHA-256 digest (of the whole page when it has no company table)
+    """
+    data = html if isinstance(html, bytes) else html.encode("utf-8")
+    split_at = data.rfind(_INDUSTRIES_MARKER_BYTES)
+    match = _TABLE_RE_BYTES.search(data, 0, split_at) if split_at >= 0 else None
+    if match is None:
+        return hashlib.sha256(data).hexdigest()
+
+    digest = hashlib.sha256()
+    match2 = _TABLE_RE_BYTES.search(data, split_at + len(_INDUSTRIES_MARKER_BYTES))
+    for table in (match, match2):
+        if table is not None:
+            stripped = _VOLATILE_RE_BYTES.sub(b"", table.group(0))
+            digest.update(_WHITESPACE_RE_BYTES.sub(b" ", stripped))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def parse_result(tax_code: str, html: Union[bytes, str]) -> Dict:
+    """
+    Parse a page into a fetch_tax_info result, never raising
+
+    Top-level and picklable so it can run in a parser worker process.
+
+    Args:
+        tax_code: The tax code the page was fetched for
+        html: Raw page, as UTF-8 bytes (preferred) or text
+
+    Returns:
+        Dictionary containing tax information, or {"MST": tax_code} when the
+        page has no company data ({"MST", "Error"} on unexpected failures)
+    """
+    try:
+        info = parse_tax_page(html)
+    except ParseError as e:
+        logger.debug("no_company_data", extra={"tax_code": tax_code, "reason": str(e)})
+        return {"MST": tax_code}
+    except Exception as e:
+        logger.warning("parse_failed", extra={"tax_code": tax_code, "error": str(e)})
+        return {"MST": tax_code, "Error": str(e)}
+
+    logger.debug("crawled", extra={"tax_code": tax_code})
+    return info
+
+
+def parse_result_timed(tax_code: str, html: Union[bytes, str]) -> Tuple[Dict, float]:
+    """parse_result plus the seconds it took (for the parse-time metric; picklable too)"""
+    start = time.perf_counter()
+    info = parse_result(tax_code, html)
+    return info, time.perf_counter() - start
+
+
+def _assign_field(info: Dict, key: str, val: str, rep_name=None):
+    """Map one company-info row onto the result dict"""
+    if "Mã số thuế" in key:
+        info["MST"] = val
+    elif "Địa chỉ Thuế" in key:
+        info["Địa chỉ thuế"] = val
+    elif re.fullmatch(r"Địa chỉ", key):
+        info["Địa chỉ"] = val
+    elif "Tình trạng" in key:
+        info["Tình trạng"] = val
+    elif "Người đại diện" in key:
+        info["Người đại diện"] = rep_name() if rep_name else val
+    elif "Điện thoại" in key:
+        info["Điện thoại"] = val.split("Ẩn")[0].strip()
+    elif "Ngày hoạt động" in key:
+        info["Ngày hoạt động"] = val
+    elif "Quản lý bởi" in key:
+        info["Quản lý bởi"] = val
+    elif "Loại hình DN" in key:
+        info["Loại hình DN"] = val
+
+
+def format_industries(industries: List[Dict]) -> str:
+    """Format industries as a multi-line string with **bold** main industry"""
+    formatted_industries = []
+    for ind in industries:
+        prefix = "**" if ind["Đậm"] else ""
+        suffix = "**" if ind["Đậm"] else ""
+        line = f"{prefix}{ind['Mã ngành']} - {ind['Ngành']}{suffix}"
+        if ind["Chi tiết"]:
+            line += f" | Chi tiết: {ind['Chi tiết']}"
+        formatted_industries.append(line)
+    return "\n".join(formatted_industries)
+
+
+_INDUSTRY_LINE_RE = re.compile(r"^(\*\*)?(\d+) - (.*?)(?(1)\*\*)(?: \| Chi tiết: (.*))?$")
+
+
+def parse_industries(text: str) -> List[Dict]:
+    """
+    Inverse of format_industries: turn the stored multi-line string back into industry dicts
+
+    Lines that don't start a new "code - name" entry continue the previous
+    entry's details (a detail text may itself span lines).
+    """
+    industries: List[Dict] = []
+    for line in (text or "").split("\n"):
+        match = _INDUSTRY_LINE_RE.match(line)
+        if match:
+            bold, code, name, detail = match.groups()
+            industries.append({
+                "Mã ngành": code,
+                "Ngành": name,
+                "Chi tiết": detail or "",
+                "Đậm": bool(bold)
+            })
+        elif industries and line:
+            previous = industries[-1]
+            previous["Chi tiết"] = f"{previous['Chi tiết']}\n{line}" if previous["Chi tiết"] else line
+    return industries
+
+
+def _industry(code: str, raw_text: str, is_main: bool) -> Dict:
+    parts = raw_text.split("Chi tiết:", 1)
+    return {
+        "Mã ngành": code,
+        "Ngành": parts[0].strip(),
+        "Chi tiết": parts[1].strip() if len(parts) > 1 else "",
+        "Đậm": is_main
+    }
+
+
+# ==== lxml implementation ====
+
+def _strings(el, skip=_NON_TEXT_TAGS) -> Iterator[str]:
+    """Yield the stripped, non-empty text nodes under el, like bs4's get_text(strip=True)"""
+    if isinstance(el.tag, str) and el.tag not in skip:
+        if el.text and el.text.strip():
+            yield el.text.strip()
+        for child in el:
+            yield from _strings(child, skip)
+            if child.tail and child.tail.strip():
+                yield child.tail.strip()
+
+
+def _text(el, sep: str = "", skip=_NON_TEXT_TAGS) -> str:
+    return sep.join(_strings(el, skip))
+
+
+def _parse_lxml(data: bytes) -> Dict:
+    split_at = data.rfind(_INDUSTRIES_MARKER_BYTES)
+    if split_at < 0:
+        raise ParseError("Cannot split HTML")
+
+    match = _TABLE_RE_BYTES.search(data, 0, split_at)
+    if not match:
+        raise ParseError("No company info table found")
+    match2 = _TABLE_RE_BYTES.search(data, split_at + len(_INDUSTRIES_MARKER_BYTES))
+
+    # One parse for both fragments; a marker element separates them
+    fragment = match.group(0) + b"<hr>" + (match2.group(0) if match2 else b"")
+    lxml_html, parser = _lxml()
+    root = lxml_html.fragment_fromstring(fragment, create_parent="div", parser=parser)
+    separator = root.find("hr")
+    table = root[0] if len(root) and root[0].tag == "table" else None
+    table2 = separator.getnext() if separator is not None else None
+
+    info = {}
+    if table is not None:
+        junk = _JUNK_TAGS + _NON_TEXT_TAGS
+
+        name_tag = next(
+            (span for th in table.iter("th") if th.get("colspan") == "2"
+             for span in th.iter("span")
+             if "copy" in span.get("class", "").split() and not _inside(span, table, junk)),
+            None
+        )
+        if name_tag is not None:
+            info["Tên"] = _text(name_tag, skip=junk)
+
+        if "table-taxinfo" in table.get("class", "").split():
+            for tr in table.iter("tr"):
+                if _inside(tr, table, junk):
+                    continue
+                tds = [td for td in tr.iter("td") if not _inside(td, tr, junk)]
+                if len(tds) < 2:
+                    continue
+                key = _text(tds[0], skip=junk)
+                val = _text(tds[1], " ", skip=junk)
+
+                def rep_name(td=tds[1]):
+                    for span in td.iter("span"):
+                        if span.get("itemprop") == "name" and not _inside(span, td, junk):
+                            return _text(span, skip=junk)
+                    return val
+
+                _assign_field(info, key, val, rep_name)
+
+    if table2 is not None and table2.tag == "table":
+        industries = []
+        for tr in _body_rows(table2):
+            tds = list(tr.iter("td"))
+            if len(tds) < 2:
+                continue
+            is_main = next(tr.iter("strong"), None) is not None
+            industries.append(_industry(_text(tds[0]), _text(tds[1], " "), is_main))
+        info["Ngành nghề kinh doanh"] = format_industries(industries)
+
+    return info
+
+
+def _inside(el, root, tags) -> bool:
+    """True if any ancestor of el (below root) is one of tags"""
+    parent = el.getparent()
+    while parent is not None and parent is not root:
+        if parent.tag in tags:
+            return True
+        parent = parent.getparent()
+    return False
+
+
+def _body_rows(table) -> Iterator:
+    """Rows html5lib would place in a <tbody> (explicit tbody or bare table rows)"""
+    for child in table:
+        if child.tag in ("tbody", "tr"):
+            yield from child.iter("tr")
+
+
+_LXML_PARSER = None
+
+
+def _lxml():
+    """lxml.html and the shared parser, imported/created on first use"""
+    global _LXML_PARSER
+    import lxml.html
+    if _LXML_PARSER is None:
+        _LXML_PARSER = lxml.html.HTMLParser(encoding="utf-8", remove_comments=True, remove_pis=True)
+    return lxml.html, _LXML_PARSER
+
+
+# ==== html5lib fallback ====
+
+def _parse_html5lib(html: str) -> Dict:
+    from bs4 import BeautifulSoup
+
+    html_parts = html.rsplit(INDUSTRIES_MARKER, 1)
+    if len(html_parts) < 2:
+        raise ParseError("Cannot split HTML")
+
+    html, html2 = html_parts
+    match = _TABLE_RE.search(html)
+    match2 = _TABLE_RE.search(html2)
+    if not match:
+        raise ParseError("No company info table found")
+
+    # ==== TABLE 1: Company Information ====
+    soup = BeautifulSoup(match.group(0), "html5lib")
+
+    # Remove junk tags
+    for tag in soup(list(_JUNK_TAGS)):
+        tag.decompose()
+
+    info = {}
+
+    # Get company name
+    name_tag = soup.select_one("th[colspan='2'] span.copy")
+    if name_tag:
+        info["Tên"] = name_tag.get_text(strip=True)
+
+    # Parse all table rows
+    for tr in soup.select("table.table-taxinfo tr"):
+        tds = tr.find_all("td")
+        if len(tds) < 2:
+            continue
+        key = tds[0].get_text(strip=True)
+        val = tds[1].get_text(" ", strip=True)
+
+        def rep_name(td=tds[1]):
+            rep = td.find("span", {"itemprop": "name"})
+            return rep.get_text(strip=True) if rep else val
+
+        _assign_field(info, key, val, rep_name)
+
+    # ==== TABLE 2: Industries (Ngành nghề kinh doanh) ====
+    if match2:
+        soup2 = BeautifulSoup(match2.group(0), "html5lib")
+        industries = []
+
+        for tr in soup2.select("tbody tr"):
+            tds = tr.find_all("td")
+            if len(tds) < 2:
+                continue
+            is_main = bool(tr.find("strong"))
+            industries.append(_industry(
+                tds[0].get_text(strip=True), tds[1].get_text(" ", strip=True), is_main
+            ))
+
+        info["Ngành nghề kinh doanh"] = format_industries(industries)
+
+    return info
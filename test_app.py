@@ -0,0 +1,309 @@
+"""
+Tests for the web app's async request handling
+"""
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+import requests
+import uvicorn
+
+import app
+import company_index
+import crawler
+import http_client
+import job_store
+import jobs
+import rate_limiter
+import refresh
+from benchmarks.stub_server import StubServer, render_company_page
+from crawler import afetch_tax_info, fetch_tax_info
+from events import publish_progress
+from rate_limiter import TokenBucket
+from tax_code import with_check_digit
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    server = StubServer().start()
+    monkeypatch.setattr(http_client, "BASE_URL", server.base_url)
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def base_url(tmp_path, monkeypatch):
+    """The app served by uvicorn on a background thread"""
+    monkeypatch.setattr(job_store, "_store", job_store.SQLiteJobStore(path=str(tmp_path / "jobs.sqlite3")))
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app.app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+    thread.join(5)
+
+
+def test_async_fetch_matches_sync(upstream, monkeypatch):
+    monkeypatch.setattr(crawler, "UPSTREAM_BLOCK_BACKOFF", 0.01)
+    limiter = TokenBucket(rate=0)
+    expected = fetch_tax_info("0318735609", rate_limiter=limiter)
+    assert asyncio.run(afetch_tax_info("0318735609", rate_limiter=limiter)) == expected
+    assert expected["Tên"] == "CÔNG TY TNHH MẪU 0318735609"
+
+    upstream.mode = "blocked"
+    info = asyncio.run(afetch_tax_info("0318735609", rate_limiter=limiter, force_refresh=True))
+    assert info["Error"] == "Upstream refused the request (HTTP 403)"
+
+
+def test_async_fetch_keeps_the_loop_free(upstream, monkeypatch):
+    """Slow cache I/O, parsing and index writes run on threads, not on the event loop"""
+    limiter = TokenBucket(rate=0)
+    parse = crawler._parse
+
+    class SlowCache:
+        def get(self, tax_code):
+            time.sleep(0.2)
+
+        def set(self, tax_code, info):
+            time.sleep(0.2)
+
+    def slow_parse(tax_code, html):
+        time.sleep(0.2)
+        return parse(tax_code, html)
+
+    monkeypatch.setattr(crawler, "_parse", slow_parse)
+    indexed = []
+    monkeypatch.setattr(crawler, "index_result", lambda info: (time.sleep(0.2), indexed.append(info["MST"])))
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        info = await afetch_tax_info("0318735609", rate_limiter=limiter, cache=SlowCache())
+        task.cancel()
+        return info, ticks
+
+    info, ticks = asyncio.run(run())
+    assert info["MST"] == "0318735609" and indexed == ["0318735609"]
+    # About 0.8s spent in the slow calls, during which the loop kept ticking
+    assert ticks >= 40
+
+
+def test_progress_stays_responsive_during_slow_lookup(upstream, base_url):
+    upstream.latency = 1.5
+    publish_progress("finished-job", {"status": "completed", "total": 1, "completed": 1, "percentage": 100})
+
+    lookup = {}
+
+    def slow_lookup():
+        start = time.perf_counter()
+        r = requests.post(f"{base_url}/crawl", data={"tax_code": "0318735609"}, timeout=10)
+        lookup["seconds"] = time.perf_counter() - start
+        lookup["ok"] = "CÔNG TY TNHH MẪU 0318735609" in r.text
+
+    thread = threading.Thread(target=slow_lookup)
+    thread.start()
+    time.sleep(0.2)
+
+    latencies = []
+    while thread.is_alive():
+        start = time.perf_counter()
+        r = requests.get(f"{base_url}/progress/finished-job", timeout=5)
+        latencies.append(time.perf_counter() - start)
+        assert "completed" in r.text
+        time.sleep(0.1)
+    thread.join()
+
+    assert lookup["ok"] and lookup["seconds"] >= 1.5
+    assert len(latencies) >= 5
+    # Served while the lookup waits on the upstream, not after it
+    assert max(latencies) < 0.5, latencies
+
+
+def test_api_lookup_returns_structured_results(upstream, base_url):
+    rate_limiter.set_rate_limit(http_client.upstream_host(), 0)
+    r = requests.post(f"{base_url}/api/lookup", json=["0318735609", 318735609, "123"], timeout=10)
+    assert r.status_code == 200
+    body = r.json()
+    assert body["stats"] == {"rows": 3, "unique": 1, "duplicates": 1, "invalid": 1, "fetches_saved": 2, "resumed": 0}
+
+    first, second, invalid = body["results"]
+    assert first["query"] == "0318735609" and first["tax_code"] == "0318735609"
+    assert first["name"] == "CÔNG TY TNHH MẪU 0318735609"
+    assert first["industries"] == [
+        {"code": "4649", "name": "Bán buôn đồ dùng khác cho gia đình", "detail": None, "main": False},
+        {"code": "4659", "name": "Bán buôn máy móc, thiết bị và phụ tùng máy khác", "detail": None, "main": True},
+        {"code": "6201", "name": "Lập trình máy vi tính", "detail": "Sản xuất phần mềm", "main": False},
+    ]
+    assert first["error"] is None
+    assert second == {**first, "query": "0318735609"}
+    assert invalid["error"].startswith("Invalid tax code '123'") and invalid["industries"] == []
+    assert upstream.requests == 1
+
+    assert requests.post(f"{base_url}/api/lookup", json=["0318735609"] * 51, timeout=10).status_code == 413
+    assert requests.post(f"{base_url}/api/lookup", json=["0318735609", " "], timeout=10).status_code == 400
+
+
+def test_api_lookup_coalesces_concurrent_identical_requests(upstream, base_url):
+    rate_limiter.set_rate_limit(http_client.upstream_host(), 0)
+    upstream.latency = 0.5
+
+    responses = []
+
+    def lookup():
+        responses.append(requests.post(f"{base_url}/api/lookup", json=["0318735609"], timeout=10).json())
+
+    threads = [threading.Thread(target=lookup) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(responses) == 5
+    assert all(r["results"][0]["name"] == "CÔNG TY TNHH MẪU 0318735609" for r in responses)
+    assert upstream.requests == 1
+    assert requests.get(f"{base_url}/scheduler/stats", timeout=5).json()["coalescing"]["coalesced"] >= 4
+
+
+def test_api_job_for_large_batches(upstream, base_url, tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_UPLOAD_DIR", str(tmp_path / "uploads"))
+    rate_limiter.set_rate_limit(http_client.upstream_host(), 0)
+    codes = [with_check_digit(f"{i:09d}") for i in range(100, 140)]
+    codes = [code for code in codes if code][:20] + ["bad"]
+
+    r = requests.post(f"{base_url}/api/jobs", json=codes, timeout=10)
+    assert r.status_code == 202
+    job_id = r.json()["job_id"]
+    assert r.json()["results_url"] == f"/api/jobs/{job_id}/results"
+
+    deadline = time.monotonic() + 20
+    while requests.get(f"{base_url}/api/jobs/{job_id}", timeout=5).json()["status"] != "completed":
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+
+    results = requests.get(f"{base_url}/api/jobs/{job_id}/results", timeout=5).json()
+    assert [r["tax_code"] for r in results[:-1]] == codes[:-1]
+    assert all(r["industries"][1]["main"] for r in results[:-1])
+    assert results[-1]["tax_code"] == "bad" and results[-1]["error"]
+    assert requests.get(f"{base_url}/api/jobs/missing/results", timeout=5).status_code == 404
+
+
+def test_results_pages_and_lazy_results_page(base_url, monkeypatch):
+    store = job_store.get_job_store()
+    counted = []
+    query_results = store.query_results
+    monkeypatch.setattr(store, "query_results", lambda *args, **kwargs: (
+        counted.append(kwargs["count"]) or query_results(*args, **kwargs)))
+    store.set_progress("job-p", {"status": "completed", "total": 120, "completed": 120})
+    for i in range(120):
+        store.add_result("job-p", i, {"MST": f"0100{i:06d}", "Tên": f"CÔNG TY {i:03d}",
+                                      "Tình trạng": "Ngừng hoạt động" if i % 4 == 0 else "Đang hoạt động",
+                                      "Quản lý bởi": "Chi cục Thuế Quận Ba Đình" if i % 2 else "Thuế cơ sở 1"})
+
+    url = f"{base_url}/api/jobs/job-p/results/page"
+    seen, cursor = [], None
+    while True:
+        page = requests.get(url, params={"limit": 25, "sort": "name", "order": "desc", "cursor": cursor},
+                            timeout=5).json()
+        assert page["total"] == 120 and page["job_status"] == "completed" and len(page["results"]) <= 25
+        seen += [result["index"] for result in page["results"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == list(range(119, -1, -1))
+    # Only the first page counts the rows; the total rides along in the cursor
+    assert counted == [True, False, False, False, False]
+
+    page = requests.get(url, params={"status": "ngừng", "managed_by": "ba đình"}, timeout=5).json()
+    assert page["total"] == 0
+    page = requests.get(url, params={"status": "ngừng", "limit": 500}, timeout=5).json()
+    assert page["total"] == 30 and page["next_cursor"] is None
+    assert all(result["status"] == "Ngừng hoạt động" for result in page["results"])
+    assert page["results"][0]["tax_code"] == "0100000000"
+
+    assert requests.get(url, params={"sort": "bogus"}, timeout=5).status_code == 400
+    assert requests.get(url, params={"cursor": "not-a-cursor"}, timeout=5).status_code == 400
+    # A cursor only continues the listing it came from
+    first = requests.get(url, params={"limit": 5}, timeout=5).json()
+    assert requests.get(url, params={"cursor": first["next_cursor"], "sort": "name"}, timeout=5).status_code == 400
+    assert requests.get(f"{base_url}/api/jobs/missing/results/page", timeout=5).status_code == 404
+
+    # The results page no longer embeds the rows
+    html = requests.get(f"{base_url}/results/job-p", timeout=5).text
+    assert 'id="lazyResults"' in html and "CÔNG TY 000" not in html
+
+
+def test_api_refresh_returns_only_changes(upstream, base_url, monkeypatch):
+    monkeypatch.setattr(refresh, "_store", refresh.FingerprintStore(path=":memory:"))
+    rate_limiter.set_rate_limit(http_client.upstream_host(), 0)
+    upstream.etags = True
+    codes = ["0318735609", "0316549660-001"]
+
+    body = requests.post(f"{base_url}/api/refresh", json=codes + ["123"], timeout=10).json()
+    assert [c["status"] for c in body["changes"]] == ["new", "new"]
+    assert body["stats"]["error"] == 1
+
+    upstream.corpus["0318735609"] = (200, render_company_page("0318735609").replace(
+        "Sản xuất phần mềm", "Sản xuất phần mềm, tư vấn máy vi tính"))
+    body = requests.post(f"{base_url}/api/refresh", json=codes, timeout=10).json()
+    assert body["stats"] == {"codes": 2, "not_modified": 1, "unchanged": 0, "changed": 1, "new": 0, "error": 0}
+    change = body["changes"][0]
+    assert change["tax_code"] == "0318735609" and change["status"] == "changed"
+    assert list(change["changes"]) == ["industries"]
+    assert change["changes"]["industries"]["old"][2]["detail"] == "Sản xuất phần mềm"
+    assert change["changes"]["industries"]["new"][2]["detail"] == "Sản xuất phần mềm, tư vấn máy vi tính"
+    assert change["result"]["name"] == "CÔNG TY TNHH MẪU 0318735609"
+
+
+def test_search_serves_crawled_companies(upstream, base_url, monkeypatch):
+    monkeypatch.setattr(company_index, "_index", company_index.CompanyIndex(path=":memory:"))
+    rate_limiter.set_rate_limit(http_client.upstream_host(), 0)
+    codes = [code for code in (with_check_digit(f"{i:09d}") for i in range(500, 520)) if code][:5]
+    requests.post(f"{base_url}/api/lookup", json=codes, timeout=10)
+    upstream.reset_stats()
+
+    r = requests.get(f"{base_url}/search", params={"q": "cong ty mau", "industry": "6201", "page_size": 2}, timeout=5)
+    body = r.json()
+    assert body["total"] == 5 and body["pages"] == 3 and len(body["results"]) == 2
+    assert body["results"][0]["industries"][2]["code"] == "6201"
+    page3 = requests.get(f"{base_url}/search", params={"q": "cong ty mau", "page": 3, "page_size": 2}, timeout=5).json()
+    assert len(page3["results"]) == 1
+    found = {r["tax_code"] for r in body["results"] + page3["results"]}
+    assert found <= set(codes)
+    assert requests.get(f"{base_url}/search", params={"q": codes[0]}, timeout=5).json()["results"][0]["tax_code"] == codes[0]
+    assert requests.get(f"{base_url}/search", params={"page_size": 1000}, timeout=5).status_code == 422
+    assert upstream.requests == 0
+
+
+def test_healthz(base_url):
+    r = requests.get(f"{base_url}/healthz", timeout=5)
+    assert r.status_code == 200 and r.json() == {"status": "ok"}
+
+
+def test_metrics_endpoint(upstream, base_url):
+    rate_limiter.set_rate_limit(http_client.upstream_host(), 0)
+    requests.post(f"{base_url}/api/lookup", json=["0318735609"], timeout=10)
+
+    r = requests.get(f"{base_url}/metrics", timeout=5)
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain")
+    for name in ("crawler_fetch_seconds_bucket", "crawler_parse_seconds_count", "crawler_upstream_in_flight",
+                 'crawler_upstream_responses_total{outcome="ok"}', "crawler_coalesced_lookups_total",
+                 "crawler_jobs_running", "# TYPE crawler_queue_wait_seconds histogram"):
+        assert name in r.text
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,79 @@
+"""
+Tests for the result cache
+"""
+import time
+
+import http_client
+from cache import ResultCache
+from crawler import fetch_tax_info
+from rate_limiter import TokenBucket
+from benchmarks.stub_server import StubServer
+
+
+def test_hit_miss_and_error_ttl():
+    cache = ResultCache(path=":memory:", ttl=60, error_ttl=0.05)
+    assert cache.get("0318735609") is None
+
+    cache.set("0318735609", {"Tên": "CÔNG TY A", "MST": "0318735609"})
+    cache.set("0200837003", {"MST": "0200837003"})
+
+    assert cache.get(" 0318735609 ")["Tên"] == "CÔNG TY A"
+    assert cache.get("0200837003") == {"MST": "0200837003"}
+
+    time.sleep(0.06)
+    # Error/empty results expire on the shorter TTL
+    assert cache.get("0200837003") is None
+    assert cache.get("0318735609") is not None
+
+    stats = cache.stats()
+    assert stats["hits"] == 3
+    assert stats["misses"] == 2
+    assert stats["expired"] == 1
+
+
+def test_size_bounded_eviction(tmp_path):
+    cache = ResultCache(path=str(tmp_path / "cache.sqlite3"), memory_size=2, max_entries=3)
+    for i in range(5):
+        cache.set(f"{i:010d}", {"Tên": f"CÔNG TY {i}", "MST": f"{i:010d}"})
+
+    stats = cache.stats()
+    assert stats["memory_entries"] == 2
+    assert stats["disk_entries"] == 3
+    assert stats["memory_evictions"] == 3
+    assert stats["disk_evictions"] == 2
+    # Oldest entries are gone; newer ones survive in the on-disk tier
+    assert cache.get("0000000000") is None
+    assert cache.get("0000000002")["Tên"] == "CÔNG TY 2"
+    cache.close()
+
+    # Entries persist across instances
+    reopened = ResultCache(path=str(tmp_path / "cache.sqlite3"))
+    assert reopened.get("0000000004")["Tên"] == "CÔNG TY 4"
+
+
+def test_fetch_uses_cache_and_force_refresh():
+    server = StubServer().start()
+    cache = ResultCache(path=":memory:")
+    original_base = http_client.BASE_URL
+    http_client.BASE_URL = server.base_url
+    limiter = TokenBucket(rate=0)
+    try:
+        first = fetch_tax_info("0318735609", rate_limiter=limiter, cache=cache)
+        second = fetch_tax_info("0318735609", rate_limiter=limiter, cache=cache)
+        assert server.requests == 1
+        assert first == second
+
+        fetch_tax_info("0318735609", rate_limiter=limiter, force_refresh=True, cache=cache)
+        assert server.requests == 2
+    finally:
+        http_client.BASE_URL = original_base
+        server.stop()
+
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+    test_hit_miss_and_error_ttl()
+    with tempfile.TemporaryDirectory() as tmp:
+        test_size_bounded_eviction(pathlib.Path(tmp))
+    test_fetch_uses_cache_and_force_refresh()
+    print("✅ All cache tests passed")
@@ -0,0 +1,149 @@
+"""
+Tests for the headless batch CLI
+"""
+import csv
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tomllib
+
+import pytest
+
+import crawler
+import http_client
+import scheduler
+from benchmarks.stub_server import StubServer
+from cli import checkpoint_id, main
+from ingest import TAX_CODE_COLUMN
+from job_store import SQLiteJobStore
+from tax_code import with_check_digit
+
+CODES = [code for code in (with_check_digit(f"{i:09d}") for i in range(400, 440)) if code][:24]
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    server = StubServer().start()
+    monkeypatch.setattr(http_client, "BASE_URL", server.base_url)
+    monkeypatch.setattr(crawler, "UPSTREAM_BLOCK_BACKOFF", 0.01)
+    monkeypatch.setattr(scheduler, "_scheduler", None)
+    # main() installs its own log handler
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield server
+    root.handlers[:] = handlers
+    root.setLevel(level)
+    server.stop()
+
+
+def write_input(path, codes):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([TAX_CODE_COLUMN])
+        writer.writerows([code] for code in codes)
+    return str(path)
+
+
+def run(tmp_path, input_path, output, *extra):
+    return main(["crawl", input_path, "-o", str(tmp_path / output), "--rate", "0", "--concurrency", "4",
+                 "--checkpoint", str(tmp_path / "checkpoint.sqlite3"), "--no-progress", *extra])
+
+
+def test_crawl_to_csv_in_input_order(upstream, tmp_path, capsys):
+    codes = CODES[:10] + [CODES[0], "123"] + CODES[10:15]
+    input_path = write_input(tmp_path / "input.csv", codes)
+
+    assert run(tmp_path, input_path, "out.csv", "--summary", str(tmp_path / "summary.json")) == 0
+
+    with open(tmp_path / "out.csv", encoding="utf-8-sig") as f:
+        rows = list(csv.DictReader(f))
+    assert [row["MST"] for row in rows] == codes
+    assert rows[10]["Tên"] == rows[0]["Tên"] == f"CÔNG TY TNHH MẪU {CODES[0]}"
+    assert rows[11]["Error"].startswith("Invalid tax code")
+    assert upstream.requests == 15
+
+    summary = json.loads((tmp_path / "summary.json").read_text())
+    assert summary["rows"] == 17 and summary["duplicates"] == 1 and summary["invalid"] == 1
+    assert summary["errors"] == 1 and summary["written"] == 17
+    assert "17 rows" in capsys.readouterr().err
+
+
+def test_error_thresholds_and_resume(upstream, tmp_path):
+    input_path = write_input(tmp_path / "input.csv", CODES)
+
+    # Every answer empty: stop early, then finish with --resume
+    upstream.mode = "empty"
+    assert run(tmp_path, input_path, "out.ndjson", "--max-errors", "2") == 1
+    store = SQLiteJobStore(path=str(tmp_path / "checkpoint.sqlite3"))
+    job_id = checkpoint_id(input_path, str(tmp_path / "out.ndjson"))
+    stored = len(store.get_results(job_id))
+    assert 3 <= stored < len(CODES)
+
+    upstream.mode = None
+    upstream.reset_stats()
+    # Failed rows stay failed in the checkpoint: 3+ of 24 is over a 10% limit
+    assert run(tmp_path, input_path, "out.ndjson", "--resume", "--max-error-rate", "0.1") == 1
+    assert upstream.requests >= len(CODES) - stored
+
+    lines = [json.loads(line) for line in (tmp_path / "out.ndjson").read_text(encoding="utf-8").splitlines()]
+    assert [line["index"] for line in lines] == list(range(len(CODES)))
+    assert [line["MST"] for line in lines] == CODES
+    # Only the rows missing from the checkpoint were fetched again
+    assert sum("Tên" in line for line in lines) == len(CODES) - stored
+
+    # A plain rerun starts over
+    upstream.reset_stats()
+    assert run(tmp_path, input_path, "out.ndjson") == 0
+    assert upstream.requests == len(CODES)
+
+
+def test_resume_refuses_a_changed_input(upstream, tmp_path, capsys):
+    input_path = write_input(tmp_path / "input.csv", CODES[:3])
+    assert run(tmp_path, input_path, "out.csv") == 0
+    write_input(tmp_path / "input.csv", CODES[:4])
+    assert run(tmp_path, input_path, "out.csv", "--resume") == 2
+    assert "input changed" in capsys.readouterr().err
+
+    assert run(tmp_path, input_path, "out.txt") == 2
+    assert run(tmp_path, str(tmp_path / "missing.csv"), "out.csv") == 2
+
+
+def test_installed_entry_points(tmp_path):
+    """The package installs, and its console scripts run without touching the network"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(root, "pyproject.toml"), "rb") as f:
+        project = tomllib.load(f)
+    # Build from a copy so the checkout gets no build/ or egg-info directories
+    src = tmp_path / "src"
+    src.mkdir()
+    for name in ["pyproject.toml", "README.md"] + [f"{m}.py" for m in project["tool"]["setuptools"]["py-modules"]]:
+        shutil.copy(os.path.join(root, name), src / name)
+
+    site = tmp_path / "site"
+    install = subprocess.run(
+        [sys.executable, "-m", "pip", "install", "--quiet", "--no-deps", "--target", str(site), str(src)],
+        capture_output=True, text=True
+    )
+    if install.returncode != 0 and re.search(r"No matching distribution|Could not find a version|NewConnectionError",
+                                             install.stderr):
+        pytest.skip("build requirements cannot be downloaded here")
+    assert install.returncode == 0, install.stderr
+
+    env = dict(os.environ, PYTHONPATH=str(site), MASOTHUE_BASE_URL="http://127.0.0.1:9")
+    for script in project["project"]["scripts"]:
+        help_run = subprocess.run([str(site / "bin" / script), "--help"], capture_output=True, text=True,
+                                  env=env, cwd=tmp_path, timeout=60)
+        assert help_run.returncode == 0 and help_run.stdout.startswith("usage:"), help_run.stderr
+
+    # No command: a usage error, not a crawl
+    bare = subprocess.run([str(site / "bin" / "tax-crawler")], capture_output=True, text=True,
+                          env=env, cwd=tmp_path, timeout=60)
+    assert bare.returncode == 2 and "usage:" in bare.stderr
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
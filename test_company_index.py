@@ -0,0 +1,95 @@
+"""
+Tests for the local company search index
+"""
+import pytest
+
+import company_index
+import crawler
+import http_client
+from benchmarks.stub_server import StubServer
+from company_index import CompanyIndex, fts_query
+from crawler import fetch_tax_info
+from rate_limiter import TokenBucket
+
+
+def company(code, name, office="Thuế cơ sở 1 Thành phố Hồ Chí Minh", industries="**6201 - Lập trình máy vi tính**",
+            address="Số 1 Đường Mẫu, Quận 1"):
+    return {"Tên": name, "MST": code, "Địa chỉ thuế": address, "Quản lý bởi": office,
+            "Ngành nghề kinh doanh": industries}
+
+
+@pytest.fixture
+def index():
+    index = CompanyIndex(path=":memory:")
+    index.add(company("0100000001", "CÔNG TY TNHH ĐẦU TƯ AN PHÁT"))
+    index.add(company("0100000002", "CÔNG TY CỔ PHẦN XÂY DỰNG BÌNH MINH", office="Chi cục Thuế Quận Ba Đình",
+                      industries="4100 - Xây dựng nhà các loại\n**4290 - Xây dựng công trình kỹ thuật dân dụng khác**"))
+    index.add(company("0100000003", "CÔNG TY TNHH PHẦN MỀM AN BÌNH",
+                      industries="4649 - Bán buôn đồ dùng khác\n**6201 - Lập trình máy vi tính**"))
+    index.add({"MST": "0100000004", "Error": "No company data on the page"})
+    yield index
+    index.close()
+
+
+def codes(found):
+    return [info["MST"] for info in found["results"]]
+
+
+def test_full_text_ignores_accents(index):
+    assert codes(index.search("cong ty dau tu")) == ["0100000001"]
+    assert codes(index.search("đầu tư")) == ["0100000001"]
+    assert sorted(codes(index.search("an"))) == ["0100000001", "0100000003"]
+    assert sorted(codes(index.search("01000000"))) == sorted(codes(index.search()))
+    assert index.search("nothing here")["total"] == 0
+    # FTS syntax in user input is treated as plain words
+    assert codes(index.search('AN" *(^')) == codes(index.search("an"))
+
+
+def test_industry_and_office_filters(index):
+    # Without a text query results are ordered by name
+    assert codes(index.search(industry="6201")) == ["0100000003", "0100000001"]
+    assert codes(index.search(industry="4649", main_industry=True)) == []
+    assert codes(index.search(industry="4290", main_industry=True)) == ["0100000002"]
+    assert codes(index.search(managed_by="ba dinh")) == ["0100000002"]
+    assert sorted(codes(index.search("an", industry="6201", managed_by="ho chi minh"))) == ["0100000001", "0100000003"]
+
+
+def test_pagination_and_upsert(index):
+    first = index.search(page_size=2)
+    second = index.search(page=2, page_size=2)
+    assert first["total"] == 3 and first["pages"] == 2
+    assert len(first["results"]) == 2 and codes(second) == ["0100000001"]
+
+    # Error results are not indexed; a new record replaces the old one everywhere
+    assert index.get("0100000004") is None
+    index.add(company("0100000002", "CÔNG TY CỔ PHẦN BÌNH MINH", industries="**6201 - Lập trình máy vi tính**"))
+    assert index.search("xay dung")["total"] == 0
+    assert index.search(industry="4100")["total"] == 0
+    assert "0100000002" in codes(index.search(industry="6201"))
+    assert index.count() == 3
+
+
+def test_fts_query():
+    assert fts_query("Công ty  Đà") == '"Công"* "ty"* "Dà"*'
+    assert fts_query(" ,; ") is None
+
+
+def test_crawled_companies_are_indexed(monkeypatch):
+    server = StubServer().start()
+    monkeypatch.setattr(http_client, "BASE_URL", server.base_url)
+    monkeypatch.setattr(crawler, "UPSTREAM_BLOCK_BACKOFF", 0.01)
+    monkeypatch.setattr(company_index, "_index", CompanyIndex(path=":memory:"))
+    try:
+        fetch_tax_info("0318735609", rate_limiter=TokenBucket(rate=0))
+        server.mode = "empty"
+        fetch_tax_info("0100109113", rate_limiter=TokenBucket(rate=0))
+    finally:
+        server.stop()
+
+    found = company_index.get_company_index().search("mau", industry="4659", main_industry=True)
+    assert codes(found) == ["0318735609"]
+    assert company_index.get_company_index().get("0100109113") is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
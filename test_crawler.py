@@ -1,36 +1,76 @@
 """
-Test script for the tax crawler
+Tests for the tax crawler against the offline replay corpus
 """
 import json
-import time
-from crawler import fetch_tax_info, crawl_multiple_tax_codes
-
-def test_single():
-    """Test single tax code"""
-    print("=== Test Single Tax Code ===")
-    tax_code = "0318735609"
-    result = fetch_tax_info(tax_code)
-    print(json.dumps(result, ensure_ascii=False, indent=2))
-    print()
-
-def test_multiple():
-    """Test multiple tax codes"""
-    print("=== Test Multiple Tax Codes ===")
-    tax_codes = ["0318735609", "0200837003"]
-    results = crawl_multiple_tax_codes(tax_codes, delay_range=(1, 2))
-    
-    for result in results:
-        print(json.dumps(result, ensure_ascii=False, indent=2))
-        print()
-    
-    # Save to file
-    with open("company_data.json", "w", encoding="utf-8") as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
-    
-    print("✅ Results saved to company_data.json")
+import os
+
+import pytest
+
+import crawler
+import http_client
+from benchmarks.stub_server import FIXTURES_DIR, StubServer, corpus_kinds, load_corpus
+from crawler import crawl_multiple_tax_codes, fetch_tax_info
+from rate_limiter import TokenBucket
+from tax_code import with_check_digit
+
+CODES = {kind: code for code, kind in corpus_kinds().items()}
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    server = StubServer(corpus=load_corpus(), seed=1).start()
+    monkeypatch.setattr(http_client, "BASE_URL", server.base_url)
+    monkeypatch.setattr(crawler, "UPSTREAM_BLOCK_BACKOFF", 0.01)
+    yield server
+    server.stop()
+
+
+def expected(page: str):
+    with open(os.path.join(FIXTURES_DIR, "pages", f"{page}.expected.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("kind", ["company", "branch", "no_industries"])
+def test_recorded_pages(upstream, kind):
+    assert fetch_tax_info(CODES[kind], rate_limiter=TokenBucket(rate=0)) == expected(kind)
+    assert upstream.requests == 1
 
-if __name__ == "__main__":
-    test_single()
-    print("\n" + "="*60 + "\n")
-    test_multiple()
 
+@pytest.mark.parametrize("kind, error, requests", [
+    ("no_results", "No company data on the page", 1),
+    ("malformed", "No company data on the page", 1),
+    ("blocked", "Upstream refused the request (HTTP 403)", 1 + crawler.UPSTREAM_BLOCK_RETRIES),
+    ("captcha", "Upstream answered with a captcha page (HTTP 200)", 1 + crawler.UPSTREAM_BLOCK_RETRIES),
+])
+def test_recorded_failures(upstream, kind, error, requests):
+    code = CODES[kind]
+    assert fetch_tax_info(code, rate_limiter=TokenBucket(rate=0)) == {"MST": code, "Error": error}
+    assert upstream.requests == requests
+
+
+def test_crawl_multiple_keeps_input_order(upstream):
+    generated = [code for code in (with_check_digit(f"{i:09d}") for i in range(200, 230)) if code]
+    codes = generated[:10] + [CODES["company"], CODES["branch"], CODES["no_results"]] + generated[10:20]
+
+    results = crawl_multiple_tax_codes(codes, batch_size=4, rate_limiter=TokenBucket(rate=0))
+
+    assert [r["MST"] for r in results] == codes
+    assert results[10] == expected("company")
+    assert results[12]["Error"] == "No company data on the page"
+    assert all(r["Tên"] == f"CÔNG TY TNHH MẪU {r['MST']}" for r in results[:10] + results[13:])
+
+
+def test_error_rates():
+    server = StubServer(seed=7)
+    server.error_rates = {"throttled": 0.2, "captcha": 0.1}
+    answers = [server.respond("0318735609") for _ in range(5000)]
+
+    throttled = sum(1 for status, _ in answers if status == 429) / len(answers)
+    captcha = sum(1 for status, body in answers if status == 200 and "Just a moment" in body) / len(answers)
+    assert throttled == pytest.approx(0.2, abs=0.03)
+    assert captcha == pytest.approx(0.1, abs=0.03)
+    server.server_close()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
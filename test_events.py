@@ -0,0 +1,120 @@
+"""
+Tests for push-based progress events and the SSE stream
+"""
+import asyncio
+import json
+import threading
+
+import pytest
+
+from events import EventBroker, publish_progress, stream_events
+from job_store import SQLiteJobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteJobStore(path=str(tmp_path / "jobs.sqlite3"))
+
+
+def progress(completed, total=3, status="processing"):
+    return {"status": status, "total": total, "completed": completed}
+
+
+def parse(messages):
+    """(id, data) for each data message in a list of raw SSE messages"""
+    events = []
+    for message in messages:
+        fields = dict(line.split(": ", 1) for line in message.strip().splitlines() if not line.startswith(":"))
+        if "data" in fields:
+            events.append((int(fields["id"]) if "id" in fields else None, json.loads(fields["data"])))
+    return events
+
+
+async def collect(stream, limit=50):
+    messages = []
+    async for message in stream:
+        messages.append(message)
+        if len(messages) >= limit:
+            break
+    return messages
+
+
+def test_new_subscriber_gets_snapshot_then_pushed_deltas(store):
+    broker = EventBroker()
+    publish_progress("job", progress(0), store, broker)
+    publish_progress("job", progress(1), store, broker)
+
+    async def run():
+        stream = stream_events("job", store=store, broker=broker, heartbeat=5, poll=5, min_interval=0)
+
+        def crawl():
+            publish_progress("job", progress(2), store, broker)
+            publish_progress("job", progress(3, status="completed"), store, broker)
+
+        asyncio.get_running_loop().call_later(0.05, threading.Thread(target=crawl).start)
+        return await asyncio.wait_for(collect(stream), 2)
+
+    events = parse(asyncio.run(run()))
+    # Only the latest state on connect, then each new event once
+    assert events == [
+        (2, progress(1)),
+        (3, progress(2)),
+        (4, progress(3, status="completed")),
+    ]
+
+
+def test_reconnect_with_last_event_id_resumes_from_the_job_store(store):
+    for i in range(3):
+        publish_progress("job", progress(i), store, EventBroker())
+
+    async def run():
+        # Another worker process: empty broker, events come from the job store
+        stream = stream_events("job", 1, store=store, broker=EventBroker(), poll=0.05, min_interval=0)
+        first = await stream.__anext__(), await stream.__anext__()
+        publish_progress("job", progress(3, status="completed"), store, EventBroker())
+        return list(first) + await asyncio.wait_for(collect(stream), 2)
+
+    events = parse(asyncio.run(run()))
+    # Missed snapshots collapse to the newest one, then the stream follows the log
+    assert events == [(3, progress(2)), (4, progress(3, status="completed"))]
+
+
+def test_bursts_are_coalesced_to_the_newest_snapshot(store):
+    broker = EventBroker()
+    publish_progress("job", progress(0, total=50), store, broker)
+
+    async def run():
+        stream = stream_events("job", store=store, broker=broker, heartbeat=5, poll=5, min_interval=0.2)
+
+        def crawl():
+            for i in range(1, 50):
+                publish_progress("job", progress(i, total=50), store, broker)
+            publish_progress("job", progress(50, total=50, status="completed"), store, broker)
+
+        asyncio.get_running_loop().call_later(0.05, threading.Thread(target=crawl).start)
+        return await asyncio.wait_for(collect(stream), 5)
+
+    events = parse(asyncio.run(run()))
+    assert events[0] == (1, progress(0, total=50))
+    assert events[-1] == (51, progress(50, total=50, status="completed"))
+    assert len(events) < 10
+    assert [seq for seq, _ in events] == sorted(seq for seq, _ in events)
+
+
+def test_idle_stream_sends_heartbeats_not_repeated_progress(store):
+    broker = EventBroker()
+    publish_progress("job", progress(0), store, broker)
+
+    async def run():
+        stream = stream_events("job", store=store, broker=broker, heartbeat=0.05, poll=0.05)
+        return await collect(stream, limit=4)
+
+    messages = asyncio.run(run())
+    assert messages[0].startswith("retry:")
+    assert len(parse(messages)) == 1
+    assert messages[2:] == [": heartbeat\n\n", ": heartbeat\n\n"]
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(pytest.main([__file__, "-q"]))
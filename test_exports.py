@@ -0,0 +1,115 @@
+"""
+Tests for streaming crawl results (generator/async variants and the result tail)
+"""
+import asyncio
+import csv
+import io
+import json
+import threading
+
+import pytest
+
+import http_client
+from crawler import aiter_crawl_tax_codes, iter_crawl_tax_codes
+from events import EventBroker, publish_progress
+from exports import export_csv, export_parquet, export_xlsx, tail_results
+from job_store import SQLiteJobStore
+from rate_limiter import TokenBucket
+from benchmarks.stub_server import StubServer
+
+
+def test_crawl_iterators_yield_every_code():
+    server = StubServer().start()
+    original_base = http_client.BASE_URL
+    http_client.BASE_URL = server.base_url
+    codes = [f"{i:010d}" for i in range(8)]
+    try:
+        results = dict(iter_crawl_tax_codes(codes, batch_size=3, rate_limiter=TokenBucket(rate=0)))
+
+        async def consume():
+            return [item async for item in aiter_crawl_tax_codes(codes, batch_size=3, rate_limiter=TokenBucket(rate=0))]
+
+        async_results = dict(asyncio.run(consume()))
+
+        # Stopping early closes the crawl instead of fetching everything
+        server.reset_stats()
+        crawl = iter_crawl_tax_codes(codes, batch_size=2, rate_limiter=TokenBucket(rate=0))
+        next(crawl)
+        crawl.close()
+    finally:
+        http_client.BASE_URL = original_base
+        server.stop()
+
+    assert sorted(results) == list(range(len(codes)))
+    assert [results[i]["MST"] for i in range(len(codes))] == codes
+    assert async_results == results
+    assert server.requests < len(codes)
+
+
+def test_tail_streams_rows_while_job_runs(tmp_path):
+    store = SQLiteJobStore(path=str(tmp_path / "jobs.sqlite3"))
+    broker = EventBroker()
+    codes = ["0318735609", "0200837003", "0316549660-001"]
+    publish_progress("job", {"status": "processing", "total": 3, "completed": 0}, store, broker)
+    store.add_result("job", 1, {"MST": codes[1], "Tên": "CÔNG TY B"})
+
+    def crawl():
+        for completed, idx in enumerate((2, 0), start=2):
+            store.add_result("job", idx, {"MST": codes[idx]})
+            publish_progress("job", {"status": "processing", "total": 3, "completed": completed}, store, broker)
+        publish_progress("job", {"status": "completed", "total": 3, "completed": 3}, store, broker)
+
+    async def run(fmt, on_first_chunk=None):
+        chunks = []
+        async for chunk in tail_results("job", fmt, store=store, broker=broker, poll=5):
+            chunks.append(chunk)
+            if on_first_chunk and len(chunks) == 1:
+                on_first_chunk()
+        return "".join(chunks)
+
+    # The first row arrives before the rest of the job has run
+    ndjson = asyncio.run(asyncio.wait_for(run("ndjson", threading.Thread(target=crawl).start), 5))
+    rows = [json.loads(line) for line in ndjson.splitlines()]
+    assert [(r["index"], r["MST"]) for r in rows] == [(1, codes[1]), (2, codes[2]), (0, codes[0])]
+
+    # Job finished: the CSV tail returns everything and ends
+    table = list(csv.DictReader(io.StringIO(asyncio.run(run("csv")).lstrip("﻿"))))
+    assert [row["MST"] for row in table] == [codes[1], codes[2], codes[0]]
+    assert table[0]["Tên"] == "CÔNG TY B"
+
+
+ROWS = [
+    {"Tên": "CÔNG TY A", "MST": "0318735609", "Ngành nghề kinh doanh": "**4659 - Bán buôn**\n6201 - " + "x" * 80},
+    {"MST": "0200837003", "Error": "timeout\x07"},
+]
+
+
+def test_xlsx_export_sizes_columns_from_sample(tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    path = str(tmp_path / "out.xlsx")
+    export_xlsx(iter(ROWS), path)
+
+    sheet = openpyxl.load_workbook(path).active
+    header = [cell.value for cell in sheet[1]]
+    assert header[:2] == ["Tên", "MST"]
+    assert [cell.value for cell in sheet[3]][header.index("Error")] == "timeout"
+    widths = {letter: dim.width for letter, dim in sheet.column_dimensions.items()}
+    assert widths["A"] == len("CÔNG TY A") + 2
+    assert widths[openpyxl.utils.get_column_letter(header.index("Ngành nghề kinh doanh") + 1)] == 50
+
+
+def test_csv_and_parquet_exports(tmp_path):
+    table = list(csv.DictReader(io.StringIO("".join(export_csv(iter(ROWS))).lstrip("\ufeff"))))
+    assert [row["MST"] for row in table] == ["0318735609", "0200837003"]
+
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "out.parquet")
+    export_parquet(iter(ROWS), path, batch_rows=1)
+    data = pq.read_table(path).to_pylist()
+    assert [row["MST"] for row in data] == ["0318735609", "0200837003"]
+    assert data[0]["Error"] is None
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(pytest.main([__file__, "-q"]))
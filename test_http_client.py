@@ -0,0 +1,68 @@
+"""
+Tests for the shared HTTP transport (offline, against a local stub server)
+"""
+import http_client
+from crawler import crawl_multiple_tax_codes, fetch_tax_info
+from rate_limiter import TokenBucket
+from benchmarks.stub_server import StubHandler, StubServer
+
+
+class FlakyHandler(StubHandler):
+    """Answers 503 to the first request, then behaves like the stub"""
+
+    def do_GET(self):
+        with self.server.stats_lock:
+            first = self.server.requests == 0
+            if first:
+                self.server.requests += 1
+        if first:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        super().do_GET()
+
+
+def test_session_reuses_connections():
+    """Consecutive lookups share one keep-alive connection"""
+    server = StubServer().start()
+    session = http_client.create_session()
+    original_base = http_client.BASE_URL
+    http_client.BASE_URL = server.base_url
+    try:
+        results = crawl_multiple_tax_codes(
+            ["0318735609", "0200837003", "5801554055"],
+            batch_size=1,
+            session=session,
+            rate_limiter=TokenBucket(rate=0)
+        )
+    finally:
+        http_client.BASE_URL = original_base
+        session.close()
+        server.stop()
+
+    assert [r["MST"] for r in results] == ["0318735609", "0200837003", "5801554055"]
+    assert server.connections == 1
+
+
+def test_session_retries_on_5xx():
+    """A transient 503 is retried with backoff instead of failing the lookup"""
+    server = StubServer(handler=FlakyHandler).start()
+    session = http_client.create_session(backoff_factor=0)
+    original_base = http_client.BASE_URL
+    http_client.BASE_URL = server.base_url
+    try:
+        info = fetch_tax_info("0318735609", session=session, rate_limiter=TokenBucket(rate=0))
+    finally:
+        http_client.BASE_URL = original_base
+        session.close()
+        server.stop()
+
+    assert info.get("Tên", "").startswith("CÔNG TY")
+    assert server.requests == 2
+
+
+if __name__ == "__main__":
+    test_session_reuses_connections()
+    test_session_retries_on_5xx()
+    print("✅ All HTTP client tests passed")
@@ -0,0 +1,79 @@
+"""
+Tests for streaming ingestion of uploaded tax code files
+"""
+import io
+
+import pytest
+
+import http_client
+from crawler import iter_crawl_tax_codes
+from ingest import IngestError, open_tax_codes
+from rate_limiter import TokenBucket
+from benchmarks.stub_server import StubServer
+
+
+def test_csv_codes_are_read_lazily_and_keep_leading_zeros():
+    data = "ten_doanh_nghiep,dinh_danh_doanh_nghiep\nA, 0200837003 \nB,\nC,0316549660-001\n"
+    reader = open_tax_codes(io.BytesIO(("﻿" + data).encode("utf-8")), "codes.csv")
+    # Only the header and first row have been consumed
+    assert reader.rows_read == 1
+    assert list(reader) == ["0200837003", "0316549660-001"]
+    assert reader.rows_read == 3
+
+
+def test_xlsx_numeric_cells_get_leading_zero_back():
+    openpyxl = pytest.importorskip("openpyxl")
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["dinh_danh_doanh_nghiep", "ten_doanh_nghiep"])
+    sheet.append([200837003, "A"])
+    sheet.append(["0318735609", "B"])
+    buf = io.BytesIO()
+    workbook.save(buf)
+    buf.seek(0)
+
+    assert list(open_tax_codes(buf, "codes.xlsx")) == ["0200837003", "0318735609"]
+
+
+def test_text_file_one_code_per_line():
+    data = b"mst\n0200837003\n\n0318735609, CONG TY B\n"
+    assert list(open_tax_codes(io.BytesIO(data), "codes.txt")) == ["0200837003", "0318735609"]
+
+
+@pytest.mark.parametrize("data, message", [
+    (b"", "CSV file is empty"),
+    (b"mst,ten\n0200837003,A\n", "must have 'dinh_danh_doanh_nghiep' column"),
+    (b"dinh_danh_doanh_nghiep\n\n,\n", "No tax codes found"),
+])
+def test_bad_csv_fails_before_crawling(data, message):
+    with pytest.raises(IngestError, match=message):
+        open_tax_codes(io.BytesIO(data), "codes.csv")
+
+
+def test_crawl_starts_before_the_file_is_fully_read():
+    rows = "".join(f"{i:010d}\n" for i in range(50))
+    reader = open_tax_codes(io.BytesIO(f"dinh_danh_doanh_nghiep\n{rows}".encode()), "codes.csv")
+    server = StubServer().start()
+    original_base = http_client.BASE_URL
+    http_client.BASE_URL = server.base_url
+    totals = []
+    try:
+        crawl = iter_crawl_tax_codes(
+            reader, batch_size=2, rate_limiter=TokenBucket(rate=0),
+            progress_callback=lambda current, total, code, status: totals.append(total)
+        )
+        next(crawl)
+        read_at_first_result = reader.rows_read
+        done = 1 + sum(1 for _ in crawl)
+    finally:
+        http_client.BASE_URL = original_base
+        server.stop()
+
+    assert read_at_first_result <= 3
+    assert done == 50
+    assert totals[-1] == 50
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,221 @@
+"""
+Tests for the job store backends (SQLite file and a Redis stand-in)
+"""
+import time
+
+import pytest
+
+from job_store import RedisJobStore, SQLiteJobStore, sort_position
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def make_store(request, tmp_path):
+    """Factory returning stores that share one backend, like separate uvicorn workers"""
+    if request.param == "sqlite":
+        path = str(tmp_path / "jobs.sqlite3")
+        return lambda ttl=60: SQLiteJobStore(path=path, ttl=ttl)
+
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    return lambda ttl=60: RedisJobStore(fakeredis.FakeRedis(server=server), ttl=ttl)
+
+
+def test_progress_and_results_visible_across_workers(make_store):
+    writer, reader = make_store(), make_store()
+
+    writer.set_progress("job-1", {"status": "processing", "total": 3, "completed": 0})
+    writer.add_result("job-1", 2, {"MST": "0316549660-001"})
+    writer.add_result("job-1", 0, {"MST": "0318735609", "Tên": "CÔNG TY A"})
+    writer.add_result("job-1", 1, {"MST": "0200837003"})
+    writer.set_progress("job-1", {"status": "completed", "total": 3, "completed": 3})
+
+    assert reader.get_progress("job-1") == {"status": "completed", "total": 3, "completed": 3}
+    assert [r["MST"] for r in reader.get_results("job-1")] == ["0318735609", "0200837003", "0316549660-001"]
+    assert reader.get_progress("missing") is None
+
+    assert [idx for idx, _ in reader.iter_results("job-1", batch_size=2)] == [0, 1, 2]
+    assert reader.get_result("job-1", 2) == {"MST": "0316549660-001"}
+    assert reader.get_result("job-1", 3) is None
+
+    rows, cursor = reader.get_results_since("job-1", limit=2)
+    assert [idx for idx, _ in rows] == [2, 0]
+    rows, cursor = reader.get_results_since("job-1", cursor)
+    assert [idx for idx, _ in rows] == [1]
+    assert reader.get_results_since("job-1", cursor) == ([], cursor)
+
+    reader.delete_job("job-1")
+    assert writer.get_progress("job-1") is None
+    assert writer.get_results("job-1") == []
+
+
+def test_query_results_filters_sorts_and_pages(make_store):
+    store = make_store()
+    statuses = ["Đang hoạt động", "Ngừng hoạt động", "đang hoạt động (đã cấp GCN)"]
+    for i in range(9):
+        store.add_result("job-q", i, {"MST": f"01000000{i:02d}", "Tên": f"CÔNG TY {'CBA'[i % 3]}{i}",
+                                      "Tình trạng": statuses[i % 3]})
+    store.add_result("job-q", 9, {"MST": "bad", "Error": "Invalid tax code"})
+
+    rows, total = store.query_results("job-q", limit=4)
+    assert [idx for idx, _ in rows] == [0, 1, 2, 3] and total == 10
+
+    # Keyset pages over a sorted, filtered listing
+    seen, after = [], None
+    while True:
+        rows, total = store.query_results("job-q", filters={"Tình trạng": "ĐANG HOẠT"}, sort="Tên",
+                                          descending=True, after=after, limit=2)
+        if not rows:
+            break
+        seen += [idx for idx, _ in rows]
+        after = sort_position(rows[-1][1], rows[-1][0], "Tên")
+    assert total == 6
+    assert seen == [6, 3, 0, 8, 5, 2]
+
+    assert [idx for idx, _ in store.query_results("job-q", errors=True)[0]] == [9]
+    assert store.query_results("job-q", errors=False)[1] == 9
+    # Rows without the sort field come first, ties in input order
+    rows, _ = store.query_results("job-q", sort="Tên", limit=3)
+    assert [idx for idx, _ in rows] == [9, 2, 5]
+
+
+def test_sorted_pages_follow_rewritten_results(make_store):
+    store = make_store()
+    for i in range(6):
+        store.add_result("job-s", i, {"MST": f"01000000{i:02d}", "Tên": f"CÔNG TY {'CBA'[i % 3]}{i}"})
+    # A rewritten result (a resumed job) moves to its new place in the order
+    store.add_result("job-s", 1, {"MST": "0100000001", "Tên": "CÔNG TY Z1"})
+
+    for descending, expected in ((False, [2, 5, 4, 0, 3, 1]), (True, [1, 3, 0, 4, 5, 2])):
+        seen, after, totals = [], None, []
+        while True:
+            rows, total = store.query_results("job-s", sort="Tên", descending=descending, after=after,
+                                              limit=4, count=after is None)
+            totals.append(total)
+            if not rows:
+                break
+            seen += [idx for idx, _ in rows]
+            after = sort_position(rows[-1][1], rows[-1][0], "Tên")
+        assert seen == expected
+        assert totals == [6, None, None]
+
+    rows, _ = store.query_results("job-s", descending=True, after=("", 4), limit=2)
+    assert [idx for idx, _ in rows] == [3, 2]
+
+
+def test_redis_pages_use_indexes_and_cap_scans():
+    fakeredis = pytest.importorskip("fakeredis")
+    store = RedisJobStore(fakeredis.FakeRedis(), scan_max=5)
+    for i in range(8):
+        store.add_result("job-r", i, {"MST": f"01000000{i:02d}", "Tên": f"CÔNG TY {i}", "Ghi chú": str(i % 2)})
+
+    def no_scan(*_args, **_kwargs):
+        raise AssertionError("indexed query scanned the results")
+
+    store.iter_results = no_scan
+    rows, total = store.query_results("job-r", sort="Tên", descending=True, limit=3)
+    assert [idx for idx, _ in rows] == [7, 6, 5] and total == 8
+    rows, _ = store.query_results("job-r", after=("", 5), limit=3)
+    assert [idx for idx, _ in rows] == [6, 7]
+
+    # No index covers filters or other sort keys: refused past scan_max
+    with pytest.raises(ValueError):
+        store.query_results("job-r", filters={"Tên": "1"})
+    with pytest.raises(ValueError):
+        store.query_results("job-r", sort="Ghi chú")
+
+    store.delete_job("job-r")
+    assert store.client.keys("job:job-r*") == []
+
+
+def test_event_log_sequence_shared_across_workers(make_store):
+    writer, reader = make_store(), make_store()
+
+    seqs = [writer.append_event("job-3", {"completed": i}) for i in range(5)]
+    assert seqs == [1, 2, 3, 4, 5]
+    assert reader.last_event_id("job-3") == 5
+    assert reader.get_events("job-3", after=3) == [(4, {"completed": 3}), (5, {"completed": 4})]
+    assert reader.get_events("job-3", after=0, limit=2) == [(1, {"completed": 0}), (2, {"completed": 1})]
+    assert reader.get_events("job-3", after=5) == []
+    assert reader.last_event_id("missing") == 0
+
+    reader.delete_job("job-3")
+    assert writer.get_events("job-3") == []
+
+
+def test_specs_and_leases_shared_across_workers(make_store):
+    a, b = make_store(), make_store()
+    a.save_spec("job-4", {"input_path": "data/uploads/job-4.csv", "batch_size": 3})
+    a.set_progress("job-4", {"status": "processing"})
+    assert b.get_spec("job-4") == {"input_path": "data/uploads/job-4.csv", "batch_size": 3}
+    assert "job-4" in b.unfinished_jobs()
+
+    # One runner at a time; the holder can renew, others wait for release or expiry
+    assert a.claim_job("job-4", "worker-a", 60)
+    assert a.claim_job("job-4", "worker-a", 60)
+    assert not b.claim_job("job-4", "worker-b", 60)
+    a.release_job("job-4", "worker-a")
+    assert b.claim_job("job-4", "worker-b", 0.2)
+    time.sleep(0.3)
+    assert a.claim_job("job-4", "worker-a", 60)
+
+    a.set_progress("job-4", {"status": "completed"})
+    assert "job-4" not in b.unfinished_jobs()
+
+
+def test_expired_lease_taken_over_cannot_be_renewed_by_its_old_owner(make_store):
+    a, b = make_store(), make_store()
+    assert a.claim_job("job-5", "worker-a", 0.2)
+    time.sleep(0.3)
+    assert b.claim_job("job-5", "worker-b", 60)
+
+    assert not a.claim_job("job-5", "worker-a", 60)
+    # Releasing a lease it no longer holds leaves the new owner's in place
+    a.release_job("job-5", "worker-a")
+    assert not a.claim_job("job-5", "worker-c", 60)
+    assert b.claim_job("job-5", "worker-b", 60)
+
+
+def test_redis_renewal_is_atomic_with_its_ownership_check(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    a = RedisJobStore(fakeredis.FakeRedis(server=server))
+    b = RedisJobStore(fakeredis.FakeRedis(server=server))
+    assert a.claim_job("job-6", "worker-a", 60)
+
+    # The lease expires and worker B claims it right after worker A has read it
+    takeovers = [lambda: (b.client.delete("job:job-6:lease"), b.claim_job("job-6", "worker-b", 60))]
+    pipeline = a.client.pipeline
+
+    def racing_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        get = pipe.get
+
+        def get_then_take_over(key):
+            value = get(key)
+            if takeovers:
+                takeovers.pop()()
+            return value
+
+        pipe.get = get_then_take_over
+        return pipe
+
+    monkeypatch.setattr(a.client, "pipeline", racing_pipeline)
+    assert not a.claim_job("job-6", "worker-a", 60)
+    assert b.client.get("job:job-6:lease") == b"worker-b"
+
+
+def test_jobs_expire_after_ttl(make_store):
+    store = make_store(ttl=1)
+    store.set_progress("job-2", {"status": "processing"})
+    store.add_result("job-2", 0, {"MST": "0318735609"})
+    assert store.get_progress("job-2") is not None
+
+    time.sleep(1.1)
+    store.cleanup_expired()
+    assert store.get_progress("job-2") is None
+    assert store.get_results("job-2") == []
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(pytest.main([__file__, "-q"]))
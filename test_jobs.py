@@ -0,0 +1,146 @@
+"""
+Tests for checkpointed, resumable crawl jobs
+"""
+import io
+import os
+import time
+
+import pytest
+
+import jobs
+from job_store import SQLiteJobStore
+from tax_code import with_check_digit
+
+
+class Crash(BaseException):
+    """Stands in for the process dying mid-crawl (not handled as a job error)"""
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_UPLOAD_DIR", str(tmp_path / "uploads"))
+    return SQLiteJobStore(path=str(tmp_path / "jobs.sqlite3"))
+
+
+def fake_crawl(fetched, crash_after=None):
+    """Crawl engine stand-in: records every code fetched, optionally dies after N"""
+    def crawl(codes, batch_size, progress_callback, force_refresh, **kwargs):
+        for u, code in enumerate(codes):
+            if crash_after is not None and len(fetched) == crash_after:
+                raise Crash()
+            fetched.append(code)
+            yield u, {"MST": code, "Tên": f"CÔNG TY {code}"}
+    return crawl
+
+
+def make_job(store, job_id, codes):
+    path = jobs.save_upload(
+        io.BytesIO(("dinh_danh_doanh_nghiep\n" + "\n".join(codes) + "\n").encode()),
+        job_id, "codes.csv"
+    )
+    jobs.create_job(job_id, path, "codes.csv", batch_size=2, store=store)
+    return path
+
+
+def test_resume_fetches_only_the_remaining_codes(store, monkeypatch):
+    unique = [with_check_digit(f"{i:09d}") for i in range(100, 120)]
+    unique = [code for code in unique if code][:6]
+    # Duplicates on both sides of the crash point and an invalid row
+    codes = unique[:3] + [unique[0]] + unique[3:] + [unique[1], "123", unique[5]]
+    path = make_job(store, "job", codes)
+
+    fetched = []
+    monkeypatch.setattr(jobs, "iter_crawl", fake_crawl(fetched, crash_after=3))
+    with pytest.raises(Crash):
+        jobs.run_job("job", store=store)
+    assert store.get_progress("job")["status"] == "processing"
+    assert store.unfinished_jobs() == ["job"]
+    checkpointed = len(store.get_results("job"))
+    assert checkpointed >= 3
+
+    monkeypatch.setattr(jobs, "iter_crawl", fake_crawl(fetched))
+    stats = jobs.run_job("job", store=store, resume=True)
+
+    # Every unique code fetched exactly once across the crash
+    assert sorted(fetched) == sorted(unique)
+    assert stats.resumed == checkpointed
+    results = store.get_results("job")
+    assert [r["MST"] for r in results] == codes
+    assert "Error" in results[codes.index("123")]
+    progress = store.get_progress("job")
+    assert progress["status"] == "completed" and progress["total"] == len(codes)
+    assert store.unfinished_jobs() == []
+    # The saved input is dropped once the job is done
+    assert not os.path.exists(path)
+
+
+def test_lease_keeps_a_job_to_one_runner(store, monkeypatch):
+    make_job(store, "job", [with_check_digit("010000000") or "0100000000"])
+    assert store.claim_job("job", "other-worker", 60)
+
+    assert jobs.run_job("job", store=store) is None
+    assert jobs.resume_job("job", store=store) == "running"
+    assert jobs.resume_orphaned_jobs(store=store) == []
+
+    # Once the other runner's lease lapses the job is picked up
+    store.release_job("job", "other-worker")
+    fetched = []
+    monkeypatch.setattr(jobs, "iter_crawl", fake_crawl(fetched))
+    monkeypatch.setattr(jobs, "get_job_store", lambda: store)
+    assert jobs.resume_orphaned_jobs(store=store) == ["job"]
+    thread = jobs._running.get("job")
+    if thread is not None:
+        thread.join(5)
+    assert store.get_progress("job")["status"] == "completed"
+    assert jobs.resume_job("job", store=store) == "completed"
+
+
+def test_runner_stops_when_its_lease_is_taken_over(store, monkeypatch):
+    codes = [code for code in (with_check_digit(f"{i:09d}") for i in range(200, 230)) if code][:6]
+    make_job(store, "job", codes)
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", 0.3)
+    fetched = []
+
+    def crawl(codes, batch_size, progress_callback, force_refresh, **kwargs):
+        for u, code in enumerate(codes):
+            if len(fetched) == 2:
+                # The lease lapsed and another runner took the job over
+                store.release_job("job", jobs.WORKER_ID)
+                assert store.claim_job("job", "other-worker", 60)
+                time.sleep(0.3)  # the next renewal notices
+            progress_callback(u, u, code, f"Crawling {code}...")
+            fetched.append(code)
+            yield u, {"MST": code}
+
+    monkeypatch.setattr(jobs, "iter_crawl", crawl)
+    assert jobs.run_job("job", store=store) is None
+    # Stopped before fetching anything else, and left the job to the new owner
+    assert fetched == codes[:2]
+    assert len(store.get_results("job")) == 2
+    assert store.get_progress("job")["status"] == "processing"
+    assert not store.claim_job("job", jobs.WORKER_ID, 60)
+
+
+def test_lease_is_renewed_while_the_job_waits_for_admission(store, monkeypatch):
+    code = with_check_digit("010000000") or "0100000000"
+    make_job(store, "job", [code])
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", 0.3)
+    taken_over = []
+
+    def crawl(codes, batch_size, progress_callback, force_refresh, on_queue=None, **kwargs):
+        # Queued behind other jobs for several lease lengths, without progress
+        on_queue(1)
+        time.sleep(1.0)
+        taken_over.append(store.claim_job("job", "other-worker", 60))
+        on_queue(0)
+        for u, code in enumerate(codes):
+            yield u, {"MST": code}
+
+    monkeypatch.setattr(jobs, "iter_crawl", crawl)
+    assert jobs.run_job("job", store=store) is not None
+    assert taken_over == [False]
+    assert store.get_progress("job")["status"] == "completed"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
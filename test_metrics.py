@@ -0,0 +1,117 @@
+"""
+Tests for the metrics registry, crawler instrumentation and structured logs
+"""
+import io
+import json
+import logging
+
+import pytest
+
+import crawler
+import http_client
+import metrics
+from benchmarks.stub_server import StubServer
+from crawler import fetch_tax_info
+from logs import configure_logging
+from metrics import Counter, Gauge, Histogram, Registry
+from rate_limiter import TokenBucket
+from scheduler import Scheduler
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    server = StubServer().start()
+    monkeypatch.setattr(http_client, "BASE_URL", server.base_url)
+    monkeypatch.setattr(crawler, "UPSTREAM_BLOCK_BACKOFF", 0.01)
+    yield server
+    server.stop()
+
+
+def sample(text: str, line_prefix: str) -> float:
+    """Value of the first exposition line starting with `line_prefix`"""
+    for line in text.splitlines():
+        if line.startswith(line_prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_exposition_format():
+    registry = Registry()
+    requests_total = Counter("app_requests_total", "Requests", ("path",), registry=registry)
+    in_flight = Gauge("app_in_flight", "In flight", registry=registry)
+    latency = Histogram("app_latency_seconds", "Latency", buckets=(0.1, 1), registry=registry)
+    registry.register_collector(lambda: [("app_jobs", "gauge", "Jobs", [({"job_id": "a"}, 2)])])
+
+    requests_total.labels('/x"y').inc()
+    requests_total.labels('/x"y').inc(2)
+    in_flight.inc()
+    for value in (0.05, 0.5, 5):
+        latency.observe(value)
+
+    text = registry.render()
+    assert "# TYPE app_requests_total counter" in text
+    assert 'app_requests_total{path="/x\\"y"} 3' in text
+    assert "app_in_flight 1" in text
+    assert 'app_latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'app_latency_seconds_bucket{le="1"} 2' in text
+    assert 'app_latency_seconds_bucket{le="+Inf"} 3' in text
+    assert "app_latency_seconds_count 3" in text
+    assert 'app_jobs{job_id="a"} 2' in text
+
+    with pytest.raises(ValueError):
+        requests_total.labels("a", "b")
+
+
+def test_fetch_records_latency_outcomes_and_parse_time(upstream):
+    before = metrics.render()
+    fetch_tax_info("0318735609", rate_limiter=TokenBucket(rate=0))
+    upstream.mode = "blocked"
+    fetch_tax_info("0318735609", rate_limiter=TokenBucket(rate=0), force_refresh=True)
+    after = metrics.render()
+
+    def delta(name):
+        return sample(after, name) - sample(before, name)
+
+    retries = crawler.UPSTREAM_BLOCK_RETRIES
+    assert delta("crawler_fetch_seconds_count") == 2 + retries
+    assert delta('crawler_upstream_responses_total{outcome="ok"}') == 1
+    assert delta('crawler_upstream_responses_total{outcome="blocked"}') == 1 + retries
+    assert delta("crawler_parse_seconds_count") == 1
+    assert delta('crawler_lookups_total{source="upstream"}') == 2
+    assert sample(after, "crawler_upstream_in_flight") == 0
+
+
+def test_scheduler_records_queue_wait():
+    before = sample(metrics.render(), 'crawler_queue_wait_seconds_count{priority="bulk"}')
+    scheduler = Scheduler(workers=1, fetch=lambda code, force: {"MST": code})
+    results = list(scheduler.iter_crawl("job", [f"{i:010d}" for i in range(5)]))
+    assert len(results) == 5
+    assert sample(metrics.render(), 'crawler_queue_wait_seconds_count{priority="bulk"}') - before == 5
+
+
+def test_json_logs_carry_fields():
+    stream = io.StringIO()
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    configure_logging(level="DEBUG", fmt="json", stream=stream)
+    try:
+        logging.getLogger("crawler").warning("fetch_failed", extra={"tax_code": "0318735609", "error": "boom"})
+    finally:
+        root.handlers[:] = handlers
+        root.setLevel(level)
+    entry = json.loads(stream.getvalue().splitlines()[-1])
+    assert entry["event"] == "fetch_failed" and entry["level"] == "warning" and entry["logger"] == "crawler"
+    assert entry["tax_code"] == "0318735609" and entry["error"] == "boom"
+
+
+def test_spans_are_logged_when_enabled(upstream, monkeypatch, caplog):
+    monkeypatch.setattr(metrics, "TRACE_SPANS", True)
+    with caplog.at_level(logging.INFO, logger="metrics"):
+        fetch_tax_info("0318735609", rate_limiter=TokenBucket(rate=0))
+    stages = {r.stage for r in caplog.records if r.getMessage() == "span"}
+    assert stages == {"rate_limit", "fetch", "parse"}
+    assert all(r.tax_code == "0318735609" for r in caplog.records if r.getMessage() == "span")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
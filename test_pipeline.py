@@ -0,0 +1,60 @@
+"""
+Tests for the fetch -> parse process-pool pipeline
+"""
+import http_client
+from cache import ResultCache
+from crawler import crawl_multiple_tax_codes
+from pipeline import crawl_pipeline, shutdown_parse_pool
+from rate_limiter import TokenBucket
+from benchmarks.stub_server import StubServer
+
+
+def test_pipeline_matches_threaded_crawl():
+    server = StubServer().start()
+    original_base = http_client.BASE_URL
+    http_client.BASE_URL = server.base_url
+    codes = [f"{i:010d}" for i in range(12)]
+    progress = []
+    try:
+        expected = crawl_multiple_tax_codes(codes, batch_size=4, rate_limiter=TokenBucket(rate=0))
+        results = crawl_pipeline(
+            codes,
+            progress_callback=lambda current, total, code, status: progress.append(current),
+            fetch_workers=3,
+            parse_workers=2,
+            queue_size=2,
+            rate_limiter=TokenBucket(rate=0),
+            cache=ResultCache(path=":memory:")
+        )
+    finally:
+        http_client.BASE_URL = original_base
+        server.stop()
+        shutdown_parse_pool()
+
+    assert results == expected
+    assert [r["MST"] for r in results] == codes
+    assert progress[-1] == len(codes)
+
+
+def test_pipeline_reports_fetch_errors():
+    original_base = http_client.BASE_URL
+    # Nothing listens on port 9 (discard); connections are refused
+    http_client.BASE_URL = "http://127.0.0.1:9"
+    session = http_client.create_session(max_retries=0)
+    try:
+        results = crawl_pipeline(
+            ["0318735609"], parse_workers=1, session=session, rate_limiter=TokenBucket(rate=0)
+        )
+    finally:
+        http_client.BASE_URL = original_base
+        session.close()
+        shutdown_parse_pool()
+
+    assert results[0]["MST"] == "0318735609"
+    assert "Error" in results[0]
+
+
+if __name__ == "__main__":
+    test_pipeline_matches_threaded_crawl()
+    test_pipeline_reports_fetch_errors()
+    print("✅ All pipeline tests passed")
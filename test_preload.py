@@ -0,0 +1,47 @@
+"""
+Tests for lazy dependency loading and background preloading
+"""
+import json
+import subprocess
+import sys
+
+import pytest
+
+import metrics
+import preload
+from preload import DEFERRED_MODULES
+
+
+def loaded_after(code: str):
+    """Deferred modules loaded after running `code` in a fresh interpreter"""
+    check = f"{code}; import sys, json; print(json.dumps([m for m in {list(DEFERRED_MODULES)!r} if m in sys.modules]))"
+    child = subprocess.run([sys.executable, "-c", check], capture_output=True, text=True, check=True)
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+
+def test_app_import_defers_heavy_dependencies():
+    assert loaded_after("import app") == []
+    assert loaded_after("import main") == []
+    # lxml loads on the first parse
+    assert loaded_after(
+        "from benchmarks.stub_server import render_company_page; from tax_parser import parse_tax_page; "
+        "assert parse_tax_page(render_company_page('0318735609'))['MST'] == '0318735609'"
+    ) == ["lxml"]
+
+
+def test_preload_times_modules(monkeypatch):
+    monkeypatch.setattr(preload, "_timings", {})
+    timings = preload.preload(["json", "no_such_module_for_preload"])
+    assert timings["json"] >= 0 and timings["no_such_module_for_preload"] is None
+    assert 'crawler_preload_seconds{module="json"}' in metrics.render()
+
+    thread = preload.preload_in_background(["csv"], delay=0)
+    thread.join(timeout=10)
+    assert "csv" in preload._timings
+
+    monkeypatch.setattr(preload, "PRELOAD_ENABLED", False)
+    assert preload.preload_in_background(["csv"]) is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,123 @@
+"""
+Tests for conditional revalidation and incremental refresh
+"""
+import pytest
+
+import crawler
+import http_client
+import metrics
+from benchmarks.stub_server import StubServer, render_company_page
+from rate_limiter import TokenBucket
+from refresh import FingerprintStore, diff_records, refresh_tax_code, refresh_tax_codes
+from tax_code import with_check_digit
+from tax_parser import page_fingerprint
+
+CODES = [code for code in (with_check_digit(f"{i:09d}") for i in range(300, 320)) if code][:6]
+ACTIVE = "Đang hoạt động (đã được cấp GCN ĐKT)"
+CLOSED = "Ngừng hoạt động và đã đóng MST"
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    server = StubServer().start()
+    monkeypatch.setattr(http_client, "BASE_URL", server.base_url)
+    monkeypatch.setattr(crawler, "UPSTREAM_BLOCK_BACKOFF", 0.01)
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def store():
+    store = FingerprintStore(path=":memory:")
+    yield store
+    store.close()
+
+
+def parses() -> float:
+    for line in metrics.render().splitlines():
+        if line.startswith("crawler_parse_seconds_count "):
+            return float(line.split()[1])
+    return 0.0
+
+
+def run(store, codes=CODES, **kwargs):
+    return refresh_tax_codes(codes, concurrency=3, store=store, rate_limiter=TokenBucket(rate=0), **kwargs)
+
+
+def test_fingerprint_ignores_ads_and_whitespace():
+    page = render_company_page("0318735609")
+    assert page_fingerprint(page) == page_fingerprint(page.replace("<ins>ad</ins>", "<ins>other ad</ins>"))
+    assert page_fingerprint(page) == page_fingerprint(page.replace("</tr>\n<tr>", "</tr>  <tr>"))
+    assert page_fingerprint(page) != page_fingerprint(page.replace(ACTIVE, CLOSED))
+
+
+def test_diff_records():
+    old = {"MST": "1", "Tên": "A", "Tình trạng": ACTIVE}
+    new = {"MST": "1", "Tên": "A", "Tình trạng": CLOSED, "Điện thoại": "0901"}
+    assert diff_records(old, new) == {
+        "Tình trạng": {"old": ACTIVE, "new": CLOSED},
+        "Điện thoại": {"old": None, "new": "0901"},
+    }
+
+
+def test_content_hash_skips_parsing_and_reports_only_changes(upstream, store):
+    changes, counts = run(store)
+    assert [c["MST"] for c in changes] == CODES
+    assert all(c["status"] == "new" and c["changes"]["Tên"]["old"] is None for c in changes)
+
+    before = parses()
+    changes, counts = run(store)
+    assert changes == []
+    assert counts["unchanged"] == len(CODES)
+    assert parses() == before
+
+    # One company closes; another only has its ads rotated
+    closed, rotated = CODES[1], CODES[2]
+    upstream.corpus[closed] = (200, render_company_page(closed).replace(ACTIVE, CLOSED))
+    upstream.corpus[rotated] = (200, render_company_page(rotated).replace("<ins>ad</ins>", "<ins>new ad</ins>"))
+    changes, counts = run(store)
+    assert [c["MST"] for c in changes] == [closed]
+    assert changes[0]["status"] == "changed"
+    assert changes[0]["changes"] == {"Tình trạng": {"old": ACTIVE, "new": CLOSED}}
+    assert changes[0]["info"]["Tình trạng"] == CLOSED
+    assert counts == {"not_modified": 0, "unchanged": len(CODES) - 1, "changed": 1, "new": 0, "error": 0}
+    assert parses() == before + 1
+
+    # The new state is the baseline for the next refresh
+    assert run(store)[0] == []
+
+
+def test_etag_revalidation(upstream, store):
+    upstream.etags = True
+    run(store)
+    assert store.get(CODES[0])["validators"]["etag"].startswith('"')
+    upstream.reset_stats()
+
+    changes, counts = run(store)
+    assert changes == [] and counts["not_modified"] == len(CODES)
+    assert upstream.statuses[304] == len(CODES)
+
+    upstream.corpus[CODES[0]] = (200, render_company_page(CODES[0]).replace("0901234567", "0909999999"))
+    changes, counts = run(store)
+    assert changes[0]["changes"] == {"Điện thoại": {"old": "0901234567", "new": "0909999999"}}
+    assert counts["not_modified"] == len(CODES) - 1
+
+    # force_refresh ignores the validators and re-parses everything
+    upstream.reset_stats()
+    changes, counts = run(store, force_refresh=True)
+    assert changes == [] and counts["unchanged"] == len(CODES)
+    assert upstream.statuses[200] == len(CODES)
+
+
+def test_failures_keep_the_stored_record(upstream, store):
+    limiter = TokenBucket(rate=0)
+    refresh_tax_code(CODES[0], rate_limiter=limiter, store=store)
+    upstream.mode = "blocked"
+    result = refresh_tax_code(CODES[0], rate_limiter=limiter, store=store)
+    assert result["status"] == "error" and "403" in result["error"]
+    upstream.mode = None
+    assert refresh_tax_code(CODES[0], rate_limiter=limiter, store=store)["status"] == "unchanged"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
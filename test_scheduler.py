@@ -0,0 +1,112 @@
+"""
+Tests for the shared crawl scheduler (bounded workers, fair sharing, priorities, admission)
+"""
+import threading
+import time
+
+import pytest
+
+from scheduler import BULK, INTERACTIVE, Scheduler
+
+
+class RecordingFetch:
+    """Fetch stand-in: records the order codes are fetched and the peak concurrency"""
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.order = []
+        self.running = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, code, force_refresh):
+        with self.lock:
+            self.order.append(code)
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        return {"MST": code}
+
+
+def run_jobs(scheduler, jobs, stagger=0.0):
+    """Run several jobs concurrently, each consumed on its own thread"""
+    results = {}
+
+    def consume(job_id, codes, kwargs):
+        results[job_id] = dict(scheduler.iter_crawl(job_id, codes, **kwargs))
+
+    threads = [threading.Thread(target=consume, args=job) for job in jobs]
+    for thread in threads:
+        thread.start()
+        time.sleep(stagger)
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def test_jobs_share_a_bounded_pool_fairly():
+    fetch = RecordingFetch()
+    scheduler = Scheduler(workers=2, fetch=fetch)
+    jobs = [(name, [f"{name}{i}" for i in range(20)], {"max_in_flight": 2}) for name in "abc"]
+    results = run_jobs(scheduler, jobs)
+
+    assert fetch.peak <= 2
+    assert all(sorted(results[name]) == list(range(20)) for name in "abc")
+    # While all three were running, none fell more than a couple of codes behind
+    first_30 = fetch.order[:30]
+    counts = [sum(code.startswith(name) for code in first_30) for name in "abc"]
+    assert max(counts) - min(counts) <= 3, counts
+
+
+def test_weights_set_the_share():
+    fetch = RecordingFetch(delay=0.005)
+    scheduler = Scheduler(workers=1, fetch=fetch)
+    jobs = [
+        ("heavy", [f"h{i}" for i in range(40)], {"weight": 3}),
+        ("light", [f"l{i}" for i in range(40)], {"weight": 1}),
+    ]
+    run_jobs(scheduler, jobs)
+
+    first_20 = fetch.order[:20]
+    heavy = sum(code.startswith("h") for code in first_20)
+    assert 12 <= heavy <= 17, first_20
+
+
+def test_interactive_lookup_jumps_ahead_of_bulk_work():
+    fetch = RecordingFetch(delay=0.02)
+    scheduler = Scheduler(workers=1, fetch=fetch)
+    bulk = threading.Thread(target=lambda: list(scheduler.iter_crawl("bulk", [f"b{i}" for i in range(30)])))
+    bulk.start()
+    time.sleep(0.1)
+
+    assert list(scheduler.iter_crawl("lookup", ["lookup"], priority=INTERACTIVE)) == [(0, {"MST": "lookup"})]
+    bulk.join(10)
+    # Served right after the bulk fetch that was running when it arrived (~5 in)
+    assert fetch.order.index("lookup") < 10
+    assert len(fetch.order) == 31
+
+
+def test_jobs_beyond_the_limit_wait_in_line_with_their_position():
+    fetch = RecordingFetch(delay=0.01)
+    scheduler = Scheduler(workers=1, max_active_jobs=1, fetch=fetch)
+    positions = {"first": [], "second": [], "third": []}
+    jobs = [
+        (name, [f"{name}{i}" for i in range(5)], {"priority": BULK, "on_queue": positions[name].append})
+        for name in positions
+    ]
+
+    results = run_jobs(scheduler, jobs, stagger=0.01)
+
+    assert positions["first"] == [0]
+    assert positions["second"][0] == 1 and positions["second"][-1] == 0
+    assert positions["third"][:2] == [2, 1] and positions["third"][-1] == 0
+    assert all(len(results[name]) == 5 for name in positions)
+    # One job at a time: each finished before the next started
+    assert [code[:-1] for code in fetch.order] == ["first"] * 5 + ["second"] * 5 + ["third"] * 5
+    assert scheduler.stats()["active_jobs"] == scheduler.stats()["queued_jobs"] == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,136 @@
+"""
+Tests for request coalescing
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def work():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return {"MST": "0318735609"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("0318735609", work))) for _ in range(8)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 8 and all(r is results[0] for r in results)
+    assert flight.stats() == {"calls": 1, "coalesced": 7, "in_flight": 0}
+
+    # Nothing is remembered once the call has finished
+    flight.do("0318735609", work)
+    assert len(calls) == 2
+
+
+def test_error_is_shared_with_waiters():
+    flight = SingleFlight()
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError("boom")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("key", fail)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=call)
+    follower.start()
+    leader.join()
+    follower.join()
+    assert errors == ["boom", "boom"]
+
+
+def test_async_calls_share_one_run_and_survive_a_cancelled_caller():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return "result"
+
+        leader = asyncio.ensure_future(flight.do_async("key", work))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(flight.do_async("key", work)) for _ in range(4)]
+        await asyncio.sleep(0)
+        # The caller that started the fetch goes away; the others still get the result
+        leader.cancel()
+        results = await asyncio.gather(*followers)
+        return calls, results, flight.stats()
+
+    calls, results, stats = asyncio.run(scenario())
+    assert calls == [1]
+    assert results == ["result"] * 4
+    assert stats == {"calls": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_threads_and_coroutines_share_one_run():
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def work():
+        calls.append("thread")
+        started.set()
+        time.sleep(0.2)
+        return {"MST": "0318735609"}
+
+    async def awork():
+        calls.append("async")
+        return {"MST": "other"}
+
+    result = []
+    thread = threading.Thread(target=lambda: result.append(flight.do("0318735609", work)))
+    thread.start()
+    started.wait()
+    # A web lookup arriving while a batch thread fetches the same code waits for that fetch
+    assert asyncio.run(flight.do_async("0318735609", awork)) == {"MST": "0318735609"}
+    thread.join()
+    assert calls == ["thread"] and result == [{"MST": "0318735609"}]
+
+    # ...and the other way round, across event loops too
+    async def slow():
+        calls.append("async")
+        started.set()
+        await asyncio.sleep(0.2)
+        return "from loop"
+
+    started.clear()
+    runner = threading.Thread(target=lambda: result.append(asyncio.run(flight.do_async("key", slow))))
+    runner.start()
+    started.wait()
+    assert flight.do("key", lambda: calls.append("thread")) == "from loop"
+    runner.join()
+    assert calls == ["thread", "async"] and result[-1] == "from loop"
+    assert flight.stats() == {"calls": 2, "coalesced": 2, "in_flight": 0}
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
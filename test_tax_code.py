@@ -0,0 +1,115 @@
+"""
+Tests for MST normalization, validation and de-duplicated crawling
+"""
+import pytest
+
+import tax_code
+from tax_code import DedupStats, InvalidTaxCode, iter_deduplicated, normalize_tax_code, with_check_digit
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("0318735609", "0318735609"),
+    (" 0318 735 609 ", "0318735609"),
+    ("'0318735609", "0318735609"),
+    ("318735609", "0318735609"),
+    ("0316549660-001", "0316549660-001"),
+    ("0316549660 - 001", "0316549660-001"),
+    ("0316549660001", "0316549660-001"),
+    ("316549660001", "0316549660-001"),
+])
+def test_normalize(raw, expected):
+    assert normalize_tax_code(raw) == expected
+
+
+@pytest.mark.parametrize("raw, reason", [
+    ("0318735608", "check digit"),
+    ("031873560", "check digit"),
+    ("03187356", "expected 10 digits"),
+    ("0316549660-01", "branch suffix"),
+    ("0316549660-000", "branch suffix"),
+    ("abc", "expected 10 digits or"),
+    ("", "expected 10 digits or"),
+])
+def test_invalid_codes(raw, reason):
+    with pytest.raises(InvalidTaxCode, match=reason):
+        normalize_tax_code(raw)
+
+
+def test_sample_codes_are_valid():
+    with open("sample_tax_codes.csv", encoding="utf-8") as f:
+        codes = f.read().split()[1:]
+    assert [normalize_tax_code(code) for code in codes] == codes
+
+
+def fake_crawl(fetched):
+    def crawl(codes, progress):
+        for idx, code in enumerate(codes):
+            progress(0, 0, code, f"Crawling {code}...")
+            fetched.append(code)
+            yield idx, {"MST": code, "Tên": f"CÔNG TY {code}"}
+    return crawl
+
+
+def test_each_unique_code_is_fetched_once_and_fanned_out():
+    rows = ["0318735609", "bad", "0318 735 609", "5801554055", "0316549660001", "0318735609", "0316549660-001"]
+    fetched, progress, stats = [], [], DedupStats()
+
+    results = dict(iter_deduplicated(
+        rows, fake_crawl(fetched), stats=stats,
+        progress_callback=lambda current, total, code, status: progress.append((current, total))
+    ))
+
+    assert fetched == ["0318735609", "5801554055", "0316549660-001"]
+    assert sorted(results) == list(range(len(rows)))
+    assert [results[i]["MST"] for i in (0, 2, 5)] == ["0318735609"] * 3
+    assert results[4] == results[6] == {"MST": "0316549660-001", "Tên": "CÔNG TY 0316549660-001"}
+    assert results[1]["MST"] == "bad" and "Invalid tax code" in results[1]["Error"]
+    assert stats.as_dict() == {"rows": 7, "unique": 3, "duplicates": 3, "invalid": 1, "fetches_saved": 4, "resumed": 0}
+    assert progress[-1] == (7, 7)
+
+
+def test_late_duplicates_are_read_back_through_lookup():
+    stored = {}
+    code = with_check_digit("010010000")
+    rows = [code] + [with_check_digit(f"0100100{i:02d}") or code for i in range(1, 20)] + [code]
+
+    for row, info in iter_deduplicated(rows, fake_crawl([]), lookup=stored.get):
+        stored[row] = info
+
+    assert stored[len(rows) - 1] == stored[0]
+
+
+
+def test_rows_without_a_fetch_are_handed_over_as_they_are_read(monkeypatch):
+    monkeypatch.setattr(tax_code, "DEDUP_READ_AHEAD", 4)
+    read = []
+
+    def rows():
+        for i in range(1000):
+            read.append(i)
+            yield "bad"
+        yield "0318735609"
+
+    results = iter_deduplicated(rows(), fake_crawl([]))
+    assert next(results)[0] == 0
+    # Only the bounded read-ahead was buffered, not the whole run of invalid rows
+    assert len(read) <= 4 + 2
+
+    rest = list(results)
+    assert len(rest) == 1000
+    assert rest[-1] == (1000, {"MST": "0318735609", "Tên": "CÔNG TY 0318735609"})
+
+
+def test_crawl_errors_reach_the_consumer():
+    def crawl(codes, progress):
+        for code in codes:
+            raise RuntimeError("lease lost")
+        yield
+
+    with pytest.raises(RuntimeError, match="lease lost"):
+        list(iter_deduplicated(["bad", "0318735609"], crawl))
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(pytest.main([__file__, "-q"]))
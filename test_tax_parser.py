@@ -0,0 +1,63 @@
+"""
+Tests for the search page parser against saved HTML fixtures
+"""
+import glob
+import json
+import os
+
+import pytest
+
+import tax_parser
+from tax_parser import ParseError, parse_tax_page
+
+FIXTURES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "fixtures", "pages", "*.html")))
+
+
+def load_fixture(path):
+    with open(path, "rb") as f:
+        html = f.read()
+    with open(path[:-len(".html")] + ".expected.json", encoding="utf-8") as f:
+        expected = json.load(f)
+    return html, expected
+
+
+def parse_or_error(parse, html):
+    try:
+        return parse(html)
+    except ParseError as e:
+        return {"ParseError": str(e)}
+
+
+@pytest.mark.parametrize("path", FIXTURES, ids=os.path.basename)
+def test_lxml_matches_expected(path):
+    html, expected = load_fixture(path)
+    assert parse_or_error(tax_parser._parse_lxml, html) == expected
+
+
+@pytest.mark.parametrize("path", FIXTURES, ids=os.path.basename)
+def test_html5lib_fallback_matches_expected(path):
+    html, expected = load_fixture(path)
+    assert parse_or_error(tax_parser._parse_html5lib, html.decode("utf-8")) == expected
+
+
+def test_parse_accepts_text():
+    html, expected = load_fixture(FIXTURES[0])
+    assert parse_tax_page(html.decode("utf-8")) == parse_tax_page(html)
+
+
+@pytest.mark.parametrize("path", FIXTURES, ids=os.path.basename)
+def test_parse_industries_round_trips(path):
+    _, expected = load_fixture(path)
+    text = expected.get("Ngành nghề kinh doanh", "")
+    industries = tax_parser.parse_industries(text)
+    assert tax_parser.format_industries(industries) == text
+    assert sum(ind["Đậm"] for ind in industries) <= 1
+
+
+if __name__ == "__main__":
+    for path in FIXTURES:
+        test_lxml_matches_expected(path)
+        test_html5lib_fallback_matches_expected(path)
+        test_parse_industries_round_trips(path)
+    test_parse_accepts_text()
+    print("✅ All parser tests passed")
@@ -0,0 +1,213 @@
+"""
+Tests for upstream outcome classification and the adaptive (AIMD) throttle
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import crawler
+import http_client
+from benchmarks.stub_server import CAPTCHA_PAGE, EMPTY_PAGE, StubServer, render_company_page
+from cache import ResultCache
+from crawler import download_page, fetch_tax_info
+from rate_limiter import TokenBucket
+from throttle import (
+    BLOCKED, CAPTCHA, EMPTY, ERROR, OK, THROTTLED, AdaptiveThrottle, UpstreamError, classify_response
+)
+
+
+@pytest.mark.parametrize("status, body, outcome", [
+    (200, render_company_page("0318735609"), OK),
+    (429, "Too Many Requests", THROTTLED),
+    (403, "Forbidden", BLOCKED),
+    (200, CAPTCHA_PAGE, CAPTCHA),
+    (200, EMPTY_PAGE, EMPTY),
+    (404, "Not Found", EMPTY),
+    (503, "Service Unavailable", ERROR),
+    # A real result page that happens to embed a captcha widget is still a result
+    (200, render_company_page("0318735609").replace("</body>", '<div class="g-recaptcha"></div></body>'), OK),
+])
+def test_classify_response(status, body, outcome):
+    assert classify_response(status, body.encode("utf-8")) == outcome
+
+
+def make_throttle(**kwargs):
+    options = dict(min_rate=0.5, max_rate=4.0, rate_step=0.5, concurrency=1, max_concurrency=4, cooldown=0)
+    options.update(kwargs)
+    return AdaptiveThrottle(TokenBucket(rate=1.0, jitter=0), **options)
+
+
+def report(throttle, outcome, latency=0.01, times=1):
+    for _ in range(times):
+        throttle.acquire()
+        throttle.release(outcome, latency)
+
+
+def test_additive_increase_multiplicative_decrease():
+    throttle = make_throttle()
+    report(throttle, OK, times=20)
+    assert throttle.limit == 4 and throttle.rate == 4.0
+
+    report(throttle, THROTTLED)
+    assert throttle.limit == 2 and throttle.rate == 2.0
+    report(throttle, CAPTCHA)
+    report(throttle, BLOCKED)
+    assert throttle.limit == 1 and throttle.rate == 0.5
+
+    # One congestion event per cooldown
+    throttle = make_throttle(cooldown=60)
+    report(throttle, OK, times=20)
+    report(throttle, THROTTLED, times=3)
+    assert throttle.rate == 2.0 and throttle.backoffs == 1
+
+
+def test_latency_rise_and_empty_pages_back_off():
+    throttle = make_throttle()
+    report(throttle, OK, latency=0.01, times=20)
+    report(throttle, OK, latency=0.2, times=3)
+    assert throttle.rate < 4.0
+
+    throttle = make_throttle()
+    report(throttle, OK, times=20)
+    report(throttle, EMPTY, times=2)
+    assert throttle.rate == 4.0
+    report(throttle, EMPTY)
+    assert throttle.rate == 2.0
+
+
+def test_in_flight_limit_blocks_until_release():
+    throttle = make_throttle(concurrency=1)
+    throttle.acquire()
+    entered = threading.Event()
+
+    def second():
+        throttle.acquire()
+        entered.set()
+        throttle.release(OK, 0.01)
+
+    threading.Thread(target=second).start()
+    assert not entered.wait(0.1)
+    throttle.release(OK, 0.01)
+    assert entered.wait(1)
+
+
+def test_async_acquire_waits_for_a_release_without_polling():
+    throttle = make_throttle(concurrency=1)
+    throttle.acquire()
+
+    async def run():
+        waiter = asyncio.create_task(throttle.acquire_async())
+        cancelled = asyncio.create_task(throttle.acquire_async())
+        await asyncio.sleep(0.1)
+        assert not waiter.done() and len(throttle._async_waiters) == 2
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        assert len(throttle._async_waiters) == 1
+
+        # Released from another thread, as the crawl threads do
+        threading.Thread(target=throttle.release, args=(OK, 0.01)).start()
+        await asyncio.wait_for(waiter, 1)
+        assert throttle.stats()["in_flight"] == 1 and throttle._async_waiters == []
+
+    asyncio.run(run())
+
+
+def test_interactive_callers_get_the_next_slot_before_bulk_callers():
+    throttle = make_throttle(concurrency=1, max_concurrency=1)
+    throttle.acquire()
+    order = []
+
+    def bulk(name):
+        throttle.acquire()
+        order.append(name)
+
+    threads = [threading.Thread(target=bulk, args=(f"bulk{i}",), daemon=True) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+
+    async def run():
+        gave_up = asyncio.create_task(throttle.acquire_async(interactive=True))
+        lookup = asyncio.create_task(throttle.acquire_async(interactive=True))
+        await asyncio.sleep(0.05)
+        gave_up.cancel()
+        await asyncio.sleep(0)
+
+        threading.Thread(target=throttle.release, args=(OK, 0.01)).start()
+        await asyncio.wait_for(lookup, 1)
+        order.append("lookup")
+
+    asyncio.run(run())
+    time.sleep(0.1)
+    assert order == ["lookup"]
+
+    # Once no interactive caller waits, the bulk callers go on one by one
+    for expected in (1, 2, 3):
+        throttle.release(OK, 0.01)
+        for _ in range(100):
+            if len(order) == 1 + expected:
+                break
+            time.sleep(0.01)
+        assert len(order) == 1 + expected
+    for thread in threads:
+        thread.join(1)
+
+
+@pytest.fixture
+def upstream():
+    server = StubServer().start()
+    original_base = http_client.BASE_URL
+    http_client.BASE_URL = server.base_url
+    yield server
+    http_client.BASE_URL = original_base
+    server.stop()
+
+
+def test_throttle_settles_under_an_upstream_rate_ceiling(upstream):
+    upstream.max_rate = 20
+    throttle = AdaptiveThrottle(
+        TokenBucket(rate=60, jitter=0), min_rate=2, max_rate=60, rate_step=1,
+        concurrency=4, max_concurrency=4, cooldown=0.3
+    )
+
+    def fetch(code):
+        try:
+            download_page(code, throttle=throttle, block_backoff=0.3)
+            return True
+        except UpstreamError as e:
+            assert e.outcome == THROTTLED
+            return False
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(4) as pool:
+        ok = list(pool.map(fetch, [f"{i:010d}" for i in range(60)]))
+
+    assert upstream.statuses[429] > 0 and throttle.backoffs >= 1
+    assert throttle.rate < 60
+    # After backing off nearly everything gets through at about the ceiling
+    assert sum(ok) >= 57
+    assert 60 / (time.monotonic() - start) < 30
+
+
+def test_blocked_answers_are_errors_not_empty_results(upstream, monkeypatch):
+    monkeypatch.setattr(crawler, "UPSTREAM_BLOCK_BACKOFF", 0.01)
+    cache = ResultCache(path=":memory:")
+    limiter = TokenBucket(rate=0)
+
+    upstream.mode = "captcha"
+    info = fetch_tax_info("0318735609", rate_limiter=limiter, cache=cache)
+    assert "captcha" in info["Error"]
+    assert upstream.requests == 3           # retried twice
+    assert cache.get("0318735609") is None  # a block is not remembered
+
+    upstream.mode = "empty"
+    info = fetch_tax_info("0200837003", rate_limiter=limiter, cache=cache)
+    assert info == {"MST": "0200837003", "Error": "No company data on the page"}
+    assert cache.get("0200837003") == info
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
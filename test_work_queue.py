@@ -0,0 +1,224 @@
+"""
+Tests for the shared work queue and the crawl workers
+"""
+import io
+import threading
+import time
+
+import pytest
+
+import jobs
+import work_queue
+from benchmarks.bench_workers import make_codes, run_workers
+from job_store import SQLiteJobStore
+from work_queue import RedisWorkQueue, SQLiteWorkQueue, iter_queued
+from worker import Worker
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def make_queue(request, tmp_path):
+    """Factory returning queues that share one backend, like workers on separate hosts"""
+    if request.param == "sqlite":
+        path = str(tmp_path / "queue.sqlite3")
+        return lambda: SQLiteWorkQueue(path=path)
+
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    return lambda: RedisWorkQueue(fakeredis.FakeRedis(server=server))
+
+
+def test_leases_are_exclusive_heartbeated_and_reclaimed(make_queue):
+    runner, worker_a, worker_b = make_queue(), make_queue(), make_queue()
+    assert runner.enqueue("job", ["0100000001", "0100000002", "0100000003"]) == 3
+    # A code the job already has queued is not queued twice
+    assert runner.enqueue("job", ["0100000001"], force_refresh=True) == 0
+    assert runner.stats() == {"pending": 3, "leased": 0}
+
+    a = worker_a.lease("worker-a", 2, lease_seconds=0.3)
+    b = worker_b.lease("worker-b", 5, lease_seconds=60)
+    assert [t.tax_code for t in a] == ["0100000001", "0100000002"]
+    assert [t.tax_code for t in b] == ["0100000003"] and not b[0].force_refresh
+    assert worker_b.lease("worker-b", 5) == []
+    assert runner.stats() == {"pending": 0, "leased": 3}
+
+    worker_b.complete("worker-b", b[0], {"MST": "0100000003", "Tên": "CÔNG TY C"})
+    assert runner.take_results("job") == [("0100000003", {"MST": "0100000003", "Tên": "CÔNG TY C"})]
+    assert runner.take_results("job") == []
+
+    # Heartbeats keep worker A's leases alive past their original expiry
+    for _ in range(3):
+        time.sleep(0.15)
+        assert worker_a.heartbeat("worker-a", [t.id for t in a], lease_seconds=0.3) == 2
+    assert worker_b.lease("worker-b", 5, lease_seconds=0.3) == []
+
+    # Worker A dies: once its leases expire, worker B gets the codes
+    time.sleep(0.5)
+    reclaimed = worker_b.lease("worker-b", 5, lease_seconds=0.3)
+    assert sorted(t.tax_code for t in reclaimed) == ["0100000001", "0100000002"]
+    assert worker_a.heartbeat("worker-a", [t.id for t in a]) == 0
+
+    for task in reclaimed:
+        worker_b.complete("worker-b", task, {"MST": task.tax_code, "by": "b"})
+    # A late result from the dead worker does not replace the first one
+    worker_a.complete("worker-a", a[0], {"MST": a[0].tax_code, "by": "a"})
+    assert sorted(runner.take_results("job")) == [
+        ("0100000001", {"MST": "0100000001", "by": "b"}), ("0100000002", {"MST": "0100000002", "by": "b"})
+    ]
+    assert runner.stats() == {"pending": 0, "leased": 0}
+
+
+def test_concurrent_enqueues_queue_each_code_once(make_queue):
+    queues = [make_queue() for _ in range(4)]
+    codes = make_codes(200)
+    added = []
+    threads = [threading.Thread(target=lambda q=q: added.append(q.enqueue("job", codes + codes[:10])))
+               for q in queues]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert sum(added) == len(codes)
+    assert queues[0].stats() == {"pending": len(codes), "leased": 0}
+
+
+def test_job_runs_through_the_queue(tmp_path, monkeypatch):
+    queue = SQLiteWorkQueue(path=str(tmp_path / "queue.sqlite3"))
+    store = SQLiteJobStore(path=str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(work_queue, "_queue", queue)
+    monkeypatch.setattr(jobs, "USE_WORK_QUEUE", True)
+    monkeypatch.setattr(jobs, "JOB_UPLOAD_DIR", str(tmp_path / "uploads"))
+
+    codes = make_codes(12)
+    rows = codes + [codes[0], "123"]
+    path = jobs.save_upload(io.BytesIO(("dinh_danh_doanh_nghiep\n" + "\n".join(rows) + "\n").encode()),
+                            "job", "codes.csv")
+    jobs.create_job("job", path, "codes.csv", batch_size=2, store=store)
+
+    # A worker that leased two codes and died before finishing them
+    queue.enqueue("job", codes[:2])
+    assert len(queue.lease("dead-worker", 2, lease_seconds=0.2)) == 2
+
+    fetched = []
+
+    def fetch(task):
+        fetched.append(task.tax_code)
+        return {"MST": task.tax_code, "Tên": f"CÔNG TY {task.tax_code}"}
+
+    workers = [Worker(queue=queue, worker_id=f"worker-{i}", concurrency=2, lease_seconds=0.2,
+                      poll_interval=0.01, fetch=fetch) for i in range(2)]
+    threads = [threading.Thread(target=worker.run) for worker in workers]
+    for thread in threads:
+        thread.start()
+    try:
+        stats = jobs.run_job("job", store=store)
+    finally:
+        for worker in workers:
+            worker.stop()
+        for thread in threads:
+            thread.join(timeout=10)
+
+    assert sorted(fetched) == sorted(codes)
+    assert stats.unique == 12 and stats.duplicates == 1 and stats.invalid == 1
+    results = store.get_results("job")
+    assert [r["MST"] for r in results[:13]] == rows[:13] and "Error" in results[13]
+    assert store.get_progress("job")["status"] == "completed"
+    assert sum(worker.completed for worker in workers) == 12
+    assert queue.stats() == {"pending": 0, "leased": 0}
+
+
+def test_iter_queued_keeps_the_queue_bounded(tmp_path):
+    queue = SQLiteWorkQueue(path=str(tmp_path / "queue.sqlite3"))
+    codes = make_codes(7)
+    seen = []
+
+    def fetch_all():
+        while len(seen) < len(codes):
+            tasks = queue.lease("worker", 10)
+            assert len(tasks) <= 3
+            seen.extend(task.tax_code for task in tasks)
+            for task in tasks:
+                queue.complete("worker", task, {"MST": task.tax_code})
+            time.sleep(0.01)
+
+    thread = threading.Thread(target=fetch_all)
+    thread.start()
+    results = dict(iter_queued("job", codes, queue=queue, poll_interval=0.01, max_outstanding=3))
+    thread.join(timeout=10)
+    assert results == {i: {"MST": code} for i, code in enumerate(codes)}
+    assert seen == codes
+
+
+def test_abandoned_job_is_purged_from_the_queue(make_queue):
+    runner, worker = make_queue(), make_queue()
+    codes = make_codes(5)
+    results = iter_queued("job", codes, queue=runner, poll_interval=0.01)
+
+    def fetch_one():
+        for _ in range(500):
+            tasks = worker.lease("worker", 1)
+            if tasks:
+                return worker.complete("worker", tasks[0], {"MST": tasks[0].tax_code})
+            time.sleep(0.01)
+
+    thread = threading.Thread(target=fetch_one)
+    thread.start()
+    assert next(results) == (0, {"MST": codes[0]})
+    thread.join(timeout=10)
+    results.close()
+
+    # The codes nobody waits for any more are not handed out
+    assert worker.lease("worker", 10) == []
+    assert runner.stats() == {"pending": 0, "leased": 0}
+    assert runner.take_results("job") == []
+
+
+def test_runner_requeues_codes_purged_under_it(make_queue):
+    runner, other, worker = make_queue(), make_queue(), make_queue()
+    codes = make_codes(3)
+    results = iter_queued("job", codes, queue=runner, poll_interval=0.01)
+    seen = []
+
+    def purge_then_fetch():
+        # A runner that lost the job drops its tasks while this one waits
+        time.sleep(0.2)
+        other.purge("job")
+        assert worker.lease("worker", 10) == []
+        while len(seen) < len(codes):
+            for task in worker.lease("worker", 10):
+                seen.append(task.tax_code)
+                worker.complete("worker", task, {"MST": task.tax_code})
+            time.sleep(0.01)
+
+    thread = threading.Thread(target=purge_then_fetch)
+    thread.start()
+    assert dict(results) == {i: {"MST": code} for i, code in enumerate(codes)}
+    thread.join(timeout=10)
+    assert sorted(seen) == sorted(codes)
+
+
+def test_sqlite_tasks_expire(tmp_path):
+    stale = SQLiteWorkQueue(path=str(tmp_path / "queue.sqlite3"), ttl=0)
+    stale.enqueue("abandoned", ["0100000002", "0100000003"])
+    (task,) = stale.lease("worker", 1)
+    stale.complete("worker", task, {"MST": task.tax_code})
+    queue = SQLiteWorkQueue(path=str(tmp_path / "queue.sqlite3"), ttl=60)
+    queue.enqueue("live", ["0100000001"])
+
+    assert queue.cleanup_expired() == 2
+    assert [t.job_id for t in queue.lease("worker", 10)] == ["live"]
+
+
+def test_throughput_grows_with_worker_processes():
+    """Each worker has its own rate budget, so four workers fetch about four times as fast as one"""
+    codes = make_codes(40)
+    one = run_workers(1, codes, rate=20)
+    four = run_workers(4, codes, rate=20)
+
+    assert one["requests"] == four["requests"] == len(codes)
+    assert one["seconds"] > 1.5
+    assert four["codes_per_second"] >= 2.5 * one["codes_per_second"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,379 @@
+"""
+Adaptive throttling driven by what the upstream actually returns
+
+Every response from masothue.com is classified (ok, throttled, blocked,
+captcha, empty, error) and fed to the host's AdaptiveThrottle, an AIMD
+controller over two knobs: the rate of the host's shared token bucket and
+the number of requests allowed in flight at once.
+
+- Healthy responses (ok, latency near its baseline) raise both knobs
+  additively, one step per window of successes, up to their maximums
+- 429, 403, captcha pages, 5xx/network errors, a run of empty pages or a
+  rising latency cut them multiplicatively, at most once per cooldown so one
+  burst of failures counts as one congestion event
+
+Blocked outcomes are raised as UpstreamError instead of being parsed into an
+empty result, so callers can tell "no such company" from "we were blocked".
+"""
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+from rate_limiter import DEFAULT_RATE, TokenBucket, get_rate_limiter, set_rate_limit
+from tax_parser import has_company_data
+
+
+ADAPTIVE_THROTTLE = os.environ.get("ADAPTIVE_THROTTLE", "true").lower() not in ("0", "false", "no")
+ADAPTIVE_MIN_RATE = float(os.environ.get("ADAPTIVE_MIN_RATE", "0.2"))
+ADAPTIVE_MAX_RATE = float(os.environ.get("ADAPTIVE_MAX_RATE", str(DEFAULT_RATE * 2)))
+ADAPTIVE_RATE_STEP = float(os.environ.get("ADAPTIVE_RATE_STEP", "0.1"))
+ADAPTIVE_CONCURRENCY = int(os.environ.get("ADAPTIVE_CONCURRENCY", "2"))
+ADAPTIVE_MAX_CONCURRENCY = int(os.environ.get("ADAPTIVE_MAX_CONCURRENCY", "8"))
+ADAPTIVE_COOLDOWN = float(os.environ.get("ADAPTIVE_COOLDOWN", "5"))
+
+# Outcomes of one upstream request
+OK = "ok"
+THROTTLED = "throttled"    # HTTP 429
+BLOCKED = "blocked"        # HTTP 403
+CAPTCHA = "captcha"        # challenge page instead of results
+EMPTY = "empty"            # answered, but no company table
+ERROR = "error"            # 5xx or network failure
+
+# Outcomes that mean "slow down"; EMPTY only counts after a run of them
+BACKOFF_OUTCOMES = {THROTTLED, BLOCKED, CAPTCHA, ERROR}
+# Outcomes worth retrying after backing off
+RETRYABLE_OUTCOMES = {THROTTLED, BLOCKED, CAPTCHA}
+
+_CAPTCHA_RE = re.compile(rb"captcha|cf-challenge|challenge-platform|just a moment\.\.\.", re.IGNORECASE)
+
+_MESSAGES = {
+    THROTTLED: "Upstream rate limit hit",
+    BLOCKED: "Upstream refused the request",
+    CAPTCHA: "Upstream answered with a captcha page",
+    EMPTY: "No company data on the page",
+    ERROR: "Upstream error",
+}
+
+
+class UpstreamError(Exception):
+    """A request was answered with something other than a result page"""
+
+    def __init__(self, outcome: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        self.outcome = outcome
+        self.status = status
+        self.retry_after = retry_after
+        message = _MESSAGES.get(outcome, outcome)
+        super().__init__(f"{message} (HTTP {status})" if status and outcome != EMPTY else message)
+
+    @property
+    def retryable(self) -> bool:
+        return self.outcome in RETRYABLE_OUTCOMES
+
+
+def classify_response(status: int, body: bytes) -> str:
+    """
+    Classify one upstream response
+
+    Args:
+        status: HTTP status code
+        body: Response body
+
+    Returns:
+        One of OK, THROTTLED, BLOCKED, CAPTCHA, EMPTY, ERROR (304 Not Modified is OK)
+    """
+    if status == 429:
+        return THROTTLED
+    if status == 403:
+        return BLOCKED
+    if status >= 500:
+        return ERROR
+    if status == 200 and has_company_data(body):
+        return OK
+    if status == 304:
+        # Answer to a conditional revalidation: the page we hold is current
+        return OK
+    # Only pages without company data are checked for a challenge, since a
+    # real result page may embed a captcha widget elsewhere
+    if _CAPTCHA_RE.search(body):
+        return CAPTCHA
+    return EMPTY
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header given in seconds (HTTP dates are ignored)"""
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+class AdaptiveThrottle:
+    """
+    AIMD controller for one upstream host
+
+    Thread-safe. Callers wrap each request in acquire()/release(outcome,
+    latency); acquire() blocks while the in-flight limit is reached, and the
+    rate is applied to the wrapped token bucket. Interactive callers (a
+    lookup someone is waiting on) get the next free slot before any bulk
+    caller waiting for one.
+    """
+
+    def __init__(
+        self,
+        bucket: TokenBucket,
+        min_rate: float = ADAPTIVE_MIN_RATE,
+        max_rate: float = ADAPTIVE_MAX_RATE,
+        rate_step: float = ADAPTIVE_RATE_STEP,
+        concurrency: int = ADAPTIVE_CONCURRENCY,
+        max_concurrency: int = ADAPTIVE_MAX_CONCURRENCY,
+        cooldown: float = ADAPTIVE_COOLDOWN,
+        backoff_factor: float = 0.5,
+        latency_factor: float = 2.0,
+        empty_streak: int = 3
+    ):
+        """
+        Args:
+            bucket: Token bucket whose rate is adjusted (a rate of 0 leaves it unlimited)
+            min_rate: Lowest rate backoff goes to (requests/second)
+            max_rate: Highest rate increases go to
+            rate_step: Rate added per healthy window
+            concurrency: Initial in-flight limit
+            max_concurrency: Highest in-flight limit
+            cooldown: Seconds after a backoff during which further failures don't cut again
+            backoff_factor: Multiplier applied on a block signal
+            latency_factor: Latency above baseline x factor counts as congestion
+            empty_streak: Consecutive empty pages that count as a block signal
+        """
+        self.bucket = bucket
+        self.adapt_rate = bucket.rate > 0
+        self.min_rate = min(min_rate, bucket.rate) if self.adapt_rate else min_rate
+        self.max_rate = max(max_rate, bucket.rate)
+        self.rate_step = rate_step
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(min(max(1, concurrency), self.max_concurrency))
+        self.cooldown = cooldown
+        self.backoff_factor = backoff_factor
+        self.latency_factor = latency_factor
+        self.empty_streak = empty_streak
+
+        self._cond = threading.Condition()
+        # (event loop, future) of each acquire_async() waiting for a slot
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._in_flight = 0
+        self._interactive_waiting = 0
+        self._healthy = 0
+        self._empties = 0
+        self._latency: Optional[float] = None
+        self._baseline: Optional[float] = None
+        self._samples = 0
+        self._last_backoff = float("-inf")
+        self.outcomes: Counter = Counter()
+        self.backoffs = 0
+
+    @property
+    def rate(self) -> float:
+        return self.bucket.rate
+
+    def _may_enter(self, interactive: bool) -> bool:
+        """A slot is free for this caller (bulk callers also give way to waiting interactive ones)"""
+        return self._in_flight < int(self.limit) and (interactive or not self._interactive_waiting)
+
+    def _stop_waiting(self):
+        """An interactive caller stopped waiting: bulk callers may be able to go (called with the lock held)"""
+        self._interactive_waiting -= 1
+        self._cond.notify_all()
+        self._wake_async_waiters()
+
+    def acquire(self, interactive: bool = False):
+        """
+        Block until another request may be in flight
+
+        Args:
+            interactive: Take the next free slot ahead of waiting bulk callers
+        """
+        with self._cond:
+            if self._may_enter(interactive):
+                self._in_flight += 1
+                return
+            if interactive:
+                self._interactive_waiting += 1
+            try:
+                while not self._may_enter(interactive):
+                    self._cond.wait()
+                self._in_flight += 1
+            finally:
+                if interactive:
+                    self._stop_waiting()
+
+    async def acquire_async(self, interactive: bool = False):
+        """acquire() for async code: waits for a release without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        waiting = False
+        try:
+            while True:
+                with self._cond:
+                    if self._may_enter(interactive):
+                        self._in_flight += 1
+                        return
+                    if interactive and not waiting:
+                        self._interactive_waiting += 1
+                        waiting = True
+                    waiter = loop.create_future()
+                    self._async_waiters.append((loop, waiter))
+                try:
+                    await waiter
+                finally:
+                    with self._cond:
+                        if (loop, waiter) in self._async_waiters:
+                            self._async_waiters.remove((loop, waiter))
+        finally:
+            if waiting:
+                with self._cond:
+                    self._stop_waiting()
+
+    def _wake_async_waiters(self):
+        """Wake every acquire_async() waiting on a slot (called with the lock held)"""
+        for loop, waiter in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, waiter)
+            except RuntimeError:
+                pass  # the waiter's loop is closed
+        self._async_waiters.clear()
+
+    def release(self, outcome: str, latency: float):
+        """
+        Report a finished request and adapt
+
+        Args:
+            outcome: classify_response() result (ERROR for network failures)
+            latency: Seconds the request took
+        """
+        with self._cond:
+            self._in_flight -= 1
+            self.outcomes[outcome] += 1
+            congested = self._observe_latency(latency) if outcome == OK else False
+
+            if outcome in BACKOFF_OUTCOMES or congested:
+                self._backoff(self.backoff_factor if not congested else (1 + self.backoff_factor) / 2)
+            elif outcome == EMPTY:
+                self._empties += 1
+                if self._empties >= self.empty_streak:
+                    self._empties = 0
+                    self._backoff(self.backoff_factor)
+            else:
+                self._empties = 0
+                self._healthy += 1
+                if self._healthy >= max(1, int(self.limit)):
+                    self._healthy = 0
+                    self.limit = min(self.max_concurrency, self.limit + 1)
+                    if self.adapt_rate:
+                        self.bucket.set_rate(min(self.max_rate, self.bucket.rate + self.rate_step))
+            self._cond.notify_all()
+            self._wake_async_waiters()
+
+    def _observe_latency(self, latency: float) -> bool:
+        """Track an EWMA of latency; True when it has risen well above its baseline"""
+        self._samples += 1
+        self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+        if self._baseline is None or self._latency < self._baseline:
+            self._baseline = self._latency
+        else:
+            # Let the baseline follow a lasting shift slowly
+            self._baseline += (self._latency - self._baseline) * 0.01
+        return self._samples >= 5 and self._latency > self._baseline * self.latency_factor
+
+    def _backoff(self, factor: float):
+        now = time.monotonic()
+        self._healthy = 0
+        if now - self._last_backoff < self.cooldown:
+            return
+        self._last_backoff = now
+        self.backoffs += 1
+        self.limit = max(1.0, self.limit * factor)
+        if self.adapt_rate:
+            self.bucket.set_rate(max(self.min_rate, self.bucket.rate * factor))
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "rate": round(self.bucket.rate, 3),
+                "concurrency": int(self.limit),
+                "in_flight": self._in_flight,
+                "latency_ms": round(self._latency * 1000, 1) if self._latency is not None else None,
+                "baseline_ms": round(self._baseline * 1000, 1) if self._baseline is not None else None,
+                "backoffs": self.backoffs,
+                "outcomes": dict(self.outcomes),
+            }
+
+
+def _resolve(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+_throttles: Dict[str, AdaptiveThrottle] = {}
+_throttles_lock = threading.Lock()
+
+
+def get_throttle(host: str) -> AdaptiveThrottle:
+    """
+    Get the shared throttle for a host, wrapping the host's shared token bucket
+
+    Rebuilt if the bucket was replaced (rate_limiter.set_rate_limit).
+    """
+    bucket = get_rate_limiter(host)
+    with _throttles_lock:
+        throttle = _throttles.get(host)
+        if throttle is None or throttle.bucket is not bucket:
+            throttle = _throttles[host] = AdaptiveThrottle(bucket)
+        return throttle
+
+
+def set_throttle_limits(host: str, max_rate: float, max_concurrency: int) -> AdaptiveThrottle:
+    """
+    Replace a host's token bucket and throttle with fixed ceilings
+
+    The throttle starts at `max_rate` and never goes above it or above
+    `max_concurrency` requests in flight; it still backs off below them
+    when the upstream pushes back.
+
+    Args:
+        host: Host name (netloc) the requests go to
+        max_rate: Highest requests per second (0 disables rate limiting)
+        max_concurrency: Highest number of requests in flight
+
+    Returns:
+        The new AdaptiveThrottle
+    """
+    bucket = set_rate_limit(host, max_rate)
+    with _throttles_lock:
+        throttle = _throttles[host] = AdaptiveThrottle(
+            bucket,
+            max_rate=max_rate,
+            concurrency=min(ADAPTIVE_CONCURRENCY, max_concurrency),
+            max_concurrency=max_concurrency
+        )
+        return throttle
+
+
+def _throttle_metrics():
+    """State of each host's adaptive throttle (scrape-time collector)"""
+    with _throttles_lock:
+        throttles = list(_throttles.items())
+    stats = [({"host": host}, throttle.stats()) for host, throttle in throttles]
+    yield ("crawler_throttle_rate", "gauge", "Current request rate allowed by the adaptive throttle (requests/second)",
+           [(labels, s["rate"]) for labels, s in stats])
+    yield ("crawler_throttle_concurrency", "gauge", "Current in-flight limit of the adaptive throttle",
+           [(labels, s["concurrency"]) for labels, s in stats])
+    yield ("crawler_throttle_in_flight", "gauge", "Requests holding an adaptive throttle slot",
+           [(labels, s["in_flight"]) for labels, s in stats])
+    yield ("crawler_throttle_backoffs_total", "counter", "Times the adaptive throttle backed off",
+           [(labels, s["backoffs"]) for labels, s in stats])
+
+
+metrics.REGISTRY.register_collector(_throttle_metrics)
@@ -0,0 +1,468 @@
+"""
+Shared work queue for distributed crawl workers
+
+With USE_WORK_QUEUE the job runner stops fetching codes itself: it puts the
+unique codes of a job in this queue and collects the results, while any
+number of ``worker.py`` processes, on any host that reaches the queue, lease
+codes, fetch them and write the results back. Two backends share one
+interface:
+
+- SQLiteWorkQueue: workers on one host (or sharing a volume). A lease is a
+  single ``UPDATE ... RETURNING`` over the oldest free tasks; SQLite lets one
+  writer in at a time, so two workers never get the same task (on Postgres
+  the same claim would be ``SELECT ... FOR UPDATE SKIP LOCKED``).
+- RedisWorkQueue: anything speaking the Redis protocol (``USE_REDIS=true``),
+  one stream read by a consumer group; a lease is a pending entry.
+
+A lease lasts WORK_QUEUE_LEASE_SECONDS unless its worker heartbeats it. A
+task whose worker died is handed to the next worker asking for work once
+its lease has expired, so every task is fetched at least once.
+
+A job runner that stops (done, failed or abandoned) purges the job's tasks
+and results; what a crashed runner leaves behind expires JOB_TTL seconds
+after its last update.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import metrics
+from job_store import JOB_TTL, REDIS_HOST, REDIS_PORT, USE_REDIS
+
+
+WORK_QUEUE_PATH = os.environ.get("WORK_QUEUE_PATH", "data/work_queue.sqlite3")
+# Seconds a leased task stays with its worker without a heartbeat
+WORK_QUEUE_LEASE_SECONDS = float(os.environ.get("WORK_QUEUE_LEASE_SECONDS", "30"))
+# Seconds between polls for new work (workers) or new results (job runners)
+WORK_QUEUE_POLL_INTERVAL = float(os.environ.get("WORK_QUEUE_POLL_INTERVAL", "0.05"))
+# Codes a job runner keeps in the queue at once (the input is read as they complete)
+WORK_QUEUE_MAX_OUTSTANDING = int(os.environ.get("WORK_QUEUE_MAX_OUTSTANDING", "1000"))
+
+
+class Task(NamedTuple):
+    """One tax code of a job, leased to a worker"""
+    id: str
+    job_id: str
+    tax_code: str
+    force_refresh: bool
+
+
+class WorkQueue:
+    """Interface shared by the work queue backends"""
+
+    def enqueue(self, job_id: str, tax_codes: Iterable[str], force_refresh: bool = False) -> int:
+        """
+        Add a job's codes; a code the job already has in the queue is not added again
+
+        Returns:
+            Number of codes added
+        """
+        raise NotImplementedError
+
+    def lease(self, worker_id: str, limit: int, lease_seconds: float = WORK_QUEUE_LEASE_SECONDS) -> List[Task]:
+        """
+        Take up to `limit` tasks for `worker_id`: free ones first in queue
+        order, then ones whose lease has expired
+        """
+        raise NotImplementedError
+
+    def heartbeat(self, worker_id: str, task_ids: Iterable[str], lease_seconds: float = WORK_QUEUE_LEASE_SECONDS) -> int:
+        """
+        Extend `worker_id`'s leases on these tasks
+
+        Returns:
+            Number of leases still held (a lost lease was reclaimed by another worker)
+        """
+        raise NotImplementedError
+
+    def complete(self, worker_id: str, task: Task, result: Dict):
+        """Write a task's result back (the first result of a task wins)"""
+        raise NotImplementedError
+
+    def take_results(self, job_id: str, limit: int = 500) -> List[Tuple[str, Dict]]:
+        """Remove and return finished tasks of a job as (tax code, result)"""
+        raise NotImplementedError
+
+    def purge(self, job_id: str):
+        """Drop a job's tasks and results; its tasks still queued are never handed out"""
+        raise NotImplementedError
+
+    def cleanup_expired(self) -> int:
+        """Remove tasks of jobs not updated for JOB_TTL seconds; returns how many were removed"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        """Tasks waiting for a worker ("pending") and being fetched ("leased")"""
+        raise NotImplementedError
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """Work queue backed by a SQLite file shared by the worker processes of a host"""
+
+    def __init__(self, path: str = WORK_QUEUE_PATH, ttl: int = JOB_TTL):
+        """
+        Args:
+            path: SQLite database file
+            ttl: Seconds a task is kept after it was queued or finished
+        """
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        # lease_expires is 0 for a free task; result is set once it is done
+        db.executescript(
+            "CREATE TABLE IF NOT EXISTS work_tasks ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " job_id TEXT NOT NULL,"
+            " tax_code TEXT NOT NULL,"
+            " force_refresh INTEGER NOT NULL,"
+            " owner TEXT,"
+            " lease_expires REAL NOT NULL DEFAULT 0,"
+            " result TEXT,"
+            " expires_at REAL NOT NULL DEFAULT 0,"
+            " UNIQUE (job_id, tax_code));"
+            "CREATE INDEX IF NOT EXISTS work_tasks_free ON work_tasks (lease_expires, id) WHERE result IS NULL;"
+            "CREATE INDEX IF NOT EXISTS work_tasks_done ON work_tasks (job_id, id) WHERE result IS NOT NULL;"
+        )
+        # Queue files created before tasks expired
+        if "expires_at" not in [row[1] for row in db.execute("PRAGMA table_info(work_tasks)")]:
+            db.execute("ALTER TABLE work_tasks ADD COLUMN expires_at REAL NOT NULL DEFAULT 0")
+
+    def _db(self) -> sqlite3.Connection:
+        """One connection per thread (sqlite3 connections are not thread-safe)"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA busy_timeout=30000")
+            self._local.db = db
+        return db
+
+    def enqueue(self, job_id: str, tax_codes: Iterable[str], force_refresh: bool = False) -> int:
+        db = self._db()
+        before = db.total_changes
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                "INSERT OR IGNORE INTO work_tasks (job_id, tax_code, force_refresh, expires_at) VALUES (?, ?, ?, ?)",
+                ((job_id, code, int(force_refresh), time.time() + self.ttl) for code in tax_codes)
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return db.total_changes - before
+
+    def lease(self, worker_id: str, limit: int, lease_seconds: float = WORK_QUEUE_LEASE_SECONDS) -> List[Task]:
+        now = time.time()
+        # One statement: the subquery and the update run under the same write lock
+        rows = self._db().execute(
+            "UPDATE work_tasks SET owner = ?, lease_expires = ?"
+            " WHERE id IN (SELECT id FROM work_tasks WHERE result IS NULL AND lease_expires < ?"
+            " ORDER BY lease_expires, id LIMIT ?)"
+            " RETURNING id, job_id, tax_code, force_refresh",
+            (worker_id, now + lease_seconds, now, limit)
+        ).fetchall()
+        rows.sort()
+        return [Task(str(id_), job_id, code, bool(force)) for id_, job_id, code, force in rows]
+
+    def heartbeat(self, worker_id: str, task_ids: Iterable[str], lease_seconds: float = WORK_QUEUE_LEASE_SECONDS) -> int:
+        ids = [int(task_id) for task_id in task_ids]
+        if not ids:
+            return 0
+        cursor = self._db().execute(
+            f"UPDATE work_tasks SET lease_expires = ? WHERE owner = ? AND result IS NULL"
+            f" AND id IN ({','.join('?' * len(ids))})",
+            (time.time() + lease_seconds, worker_id, *ids)
+        )
+        return cursor.rowcount
+
+    def complete(self, worker_id: str, task: Task, result: Dict):
+        self._db().execute(
+            "UPDATE work_tasks SET result = ?, owner = ?, expires_at = ? WHERE id = ? AND result IS NULL",
+            (json.dumps(result, ensure_ascii=False), worker_id, time.time() + self.ttl, int(task.id))
+        )
+
+    def take_results(self, job_id: str, limit: int = 500) -> List[Tuple[str, Dict]]:
+        rows = self._db().execute(
+            "DELETE FROM work_tasks WHERE id IN (SELECT id FROM work_tasks"
+            " WHERE job_id = ? AND result IS NOT NULL ORDER BY id LIMIT ?)"
+            " RETURNING tax_code, result",
+            (job_id, limit)
+        ).fetchall()
+        return [(code, json.loads(data)) for code, data in rows]
+
+    def purge(self, job_id: str):
+        self._db().execute("DELETE FROM work_tasks WHERE job_id = ?", (job_id,))
+
+    def cleanup_expired(self) -> int:
+        return self._db().execute("DELETE FROM work_tasks WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def stats(self) -> Dict[str, int]:
+        pending, leased = self._db().execute(
+            "SELECT COALESCE(SUM(lease_expires < ?), 0), COALESCE(SUM(lease_expires >= ?), 0)"
+            " FROM work_tasks WHERE result IS NULL",
+            (time.time(), time.time())
+        ).fetchone()
+        return {"pending": pending, "leased": leased}
+
+
+class RedisWorkQueue(WorkQueue):
+    """
+    Work queue backed by a Redis-protocol server
+
+    Keys: ``{prefix}tasks`` is a stream read by the ``workers`` consumer
+    group; a leased task is an entry pending for its worker. A lease has
+    expired once the entry has been idle for longer than the lease length
+    of the worker asking for work (XCLAIM on a heartbeat resets the idle
+    time, XAUTOCLAIM hands expired entries over), so every worker should
+    use the same lease length. ``{prefix}job:{id}:codes`` is the set of a job's queued codes,
+    ``{prefix}job:{id}:results`` a hash of code -> result JSON and
+    ``{prefix}job:{id}:done`` the finished codes in completion order; the
+    per-job keys carry the job TTL. A code is added to the set and the
+    stream in one transaction, and an entry whose code is no longer in the
+    set (the job was purged or expired) is dropped when a worker leases it.
+    """
+
+    GROUP = "workers"
+
+    def __init__(self, client, prefix: str = "workq:"):
+        """
+        Args:
+            client: redis.Redis (or compatible) client
+            prefix: Key prefix for queue records
+        """
+        self.client = client
+        self.prefix = prefix
+        self.stream = f"{prefix}tasks"
+        try:
+            client.xgroup_create(self.stream, self.GROUP, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def _key(self, job_id: str, suffix: str) -> str:
+        return f"{self.prefix}job:{job_id}:{suffix}"
+
+    @staticmethod
+    def _text(value) -> str:
+        return value.decode() if isinstance(value, bytes) else value
+
+    def _task(self, entry_id, fields) -> Task:
+        fields = {self._text(k): self._text(v) for k, v in fields.items()}
+        return Task(self._text(entry_id), fields["job_id"], fields["tax_code"], fields["force_refresh"] == "1")
+
+    def enqueue(self, job_id: str, tax_codes: Iterable[str], force_refresh: bool = False) -> int:
+        codes = list(dict.fromkeys(tax_codes))
+        if not codes:
+            return 0
+        key = self._key(job_id, "codes")
+
+        def add(pipe) -> List[str]:
+            # WATCHed: the set is read, then changed with the stream in one MULTI/EXEC
+            added = [code for code, queued in zip(codes, pipe.smismember(key, codes)) if not queued]
+            pipe.multi()
+            for code in added:
+                pipe.sadd(key, code)
+                pipe.xadd(self.stream, {"job_id": job_id, "tax_code": code, "force_refresh": int(force_refresh)})
+            pipe.expire(key, JOB_TTL)
+            return added
+
+        return len(self.client.transaction(add, key, value_from_callable=True))
+
+    def lease(self, worker_id: str, limit: int, lease_seconds: float = WORK_QUEUE_LEASE_SECONDS) -> List[Task]:
+        tasks = []
+        # Expired leases first: their codes have waited longest
+        reclaimed = self.client.xautoclaim(
+            self.stream, self.GROUP, worker_id, min_idle_time=int(lease_seconds * 1000),
+            start_id="0-0", count=limit
+        )
+        for entry_id, fields in reclaimed[1]:
+            if fields:  # entries deleted while pending come back empty
+                tasks.append(self._task(entry_id, fields))
+        if len(tasks) < limit:
+            for _, entries in self.client.xreadgroup(
+                self.GROUP, worker_id, {self.stream: ">"}, count=limit - len(tasks)
+            ) or []:
+                tasks.extend(self._task(entry_id, fields) for entry_id, fields in entries)
+        return self._drop_purged(tasks)
+
+    def _drop_purged(self, tasks: List[Task]) -> List[Task]:
+        """Acknowledge and delete tasks whose job no longer queues their code"""
+        if not tasks:
+            return tasks
+        pipe = self.client.pipeline()
+        for task in tasks:
+            pipe.sismember(self._key(task.job_id, "codes"), task.tax_code)
+        live = pipe.execute()
+        stale = [task.id for task, queued in zip(tasks, live) if not queued]
+        if stale:
+            pipe = self.client.pipeline()
+            pipe.xack(self.stream, self.GROUP, *stale)
+            pipe.xdel(self.stream, *stale)
+            pipe.execute()
+        return [task for task, queued in zip(tasks, live) if queued]
+
+    def heartbeat(self, worker_id: str, task_ids: Iterable[str], lease_seconds: float = WORK_QUEUE_LEASE_SECONDS) -> int:
+        ids = set(task_ids)
+        if not ids:
+            return 0
+        # Only touch entries still pending for this worker, or XCLAIM would take back reclaimed ones
+        owned = [
+            self._text(entry["message_id"]) for entry in self.client.xpending_range(
+                self.stream, self.GROUP, min="-", max="+", count=max(len(ids), 100), consumername=worker_id
+            )
+        ]
+        held = [entry_id for entry_id in owned if entry_id in ids]
+        if held:
+            self.client.xclaim(self.stream, self.GROUP, worker_id, 0, held, justid=True)
+        return len(held)
+
+    def complete(self, worker_id: str, task: Task, result: Dict):
+        if not self._drop_purged([task]):
+            return
+        results = self._key(task.job_id, "results")
+        if not self.client.hsetnx(results, task.tax_code, json.dumps(result, ensure_ascii=False)):
+            return
+        pipe = self.client.pipeline()
+        pipe.rpush(self._key(task.job_id, "done"), task.tax_code)
+        for suffix in ("codes", "results", "done"):
+            pipe.expire(self._key(task.job_id, suffix), JOB_TTL)
+        pipe.xack(self.stream, self.GROUP, task.id)
+        pipe.xdel(self.stream, task.id)
+        pipe.execute()
+
+    def take_results(self, job_id: str, limit: int = 500) -> List[Tuple[str, Dict]]:
+        done = self._key(job_id, "done")
+        pipe = self.client.pipeline()
+        pipe.lrange(done, 0, limit - 1)
+        pipe.ltrim(done, limit, -1)
+        codes = [self._text(code) for code in pipe.execute()[0]]
+        if not codes:
+            return []
+        results = self._key(job_id, "results")
+        data = self.client.hmget(results, codes)
+        pipe = self.client.pipeline()
+        pipe.hdel(results, *codes)
+        pipe.srem(self._key(job_id, "codes"), *codes)
+        pipe.execute()
+        return [(code, json.loads(value)) for code, value in zip(codes, data) if value is not None]
+
+    def purge(self, job_id: str):
+        # Stream entries of the job are dropped as workers lease them
+        self.client.delete(*(self._key(job_id, suffix) for suffix in ("codes", "results", "done")))
+
+    def cleanup_expired(self) -> int:
+        # The per-job keys carry the job TTL
+        return 0
+
+    def stats(self) -> Dict[str, int]:
+        leased = self.client.xpending(self.stream, self.GROUP)["pending"]
+        return {"pending": max(0, self.client.xlen(self.stream) - leased), "leased": leased}
+
+
+def iter_queued(
+    job_id: str,
+    tax_codes: Iterable[str],
+    progress_callback = None,
+    force_refresh: bool = False,
+    queue: Optional[WorkQueue] = None,
+    poll_interval: float = WORK_QUEUE_POLL_INTERVAL,
+    max_outstanding: int = WORK_QUEUE_MAX_OUTSTANDING
+) -> Iterator[Tuple[int, Dict]]:
+    """
+    Crawl codes through the work queue, yielding (index, result) as workers finish them
+
+    Codes are read lazily and kept at most `max_outstanding` in the queue.
+    While no result arrives the callback still gets a "Waiting for workers"
+    update about once a second, and the codes still outstanding are queued
+    again in case the job was purged meanwhile (by a runner that lost the job
+    to this one). However the iteration ends, the job is purged from the
+    queue, so codes nobody waits for any more are not fetched.
+
+    Args:
+        job_id: Job the codes belong to (a job's code is queued once)
+        tax_codes: Unique tax codes
+        progress_callback: Callback function(current, total, code, status)
+        force_refresh: Workers skip the result cache
+        queue: Work queue (defaults to the shared one)
+    """
+    queue = queue or get_work_queue()
+    codes = iter(tax_codes)
+    positions: Dict[str, int] = {}  # queued code -> index
+    queued = completed = 0
+    exhausted = False
+    waiting_since = time.monotonic()
+
+    try:
+        while not exhausted or positions:
+            if not exhausted and len(positions) < max_outstanding:
+                batch = list(islice(codes, min(500, max_outstanding - len(positions))))
+                if not batch:
+                    exhausted = True
+                for code in batch:
+                    positions[code] = queued
+                    queued += 1
+                queue.enqueue(job_id, batch, force_refresh)
+
+            done = queue.take_results(job_id)
+            for code, info in done:
+                idx = positions.pop(code, None)
+                if idx is None:
+                    continue  # fetched twice after a lost lease
+                completed += 1
+                if progress_callback:
+                    progress_callback(completed, queued, code, f"Completed {completed}/{queued}")
+                yield idx, info
+
+            if done:
+                waiting_since = time.monotonic()
+            elif positions:
+                if time.monotonic() - waiting_since >= 1.0:
+                    if progress_callback:
+                        progress_callback(completed, queued, '', f"Waiting for workers ({len(positions)} queued)")
+                    queue.enqueue(job_id, list(positions), force_refresh)
+                    waiting_since = time.monotonic()
+                time.sleep(poll_interval)
+    finally:
+        queue.purge(job_id)
+
+
+_queue: Optional[WorkQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_work_queue() -> WorkQueue:
+    """
+    Get the process-wide work queue (Redis when USE_REDIS is set, else SQLite)
+
+    Returns:
+        Shared WorkQueue
+    """
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                if USE_REDIS:
+                    import redis
+                    _queue = RedisWorkQueue(redis.Redis(host=REDIS_HOST, port=REDIS_PORT))
+                else:
+                    _queue = SQLiteWorkQueue()
+    return _queue
+
+
+def _work_queue_metrics():
+    """Tasks in the shared queue, if this process uses it (scrape-time collector)"""
+    if _queue is not None:
+        stats = _queue.stats()
+        yield ("crawler_work_queue_tasks", "gauge", "Tasks in the shared work queue by state",
+               [({"state": state}, count) for state, count in stats.items()])
+
+
+metrics.REGISTRY.register_collector(_work_queue_metrics)
@@ -0,0 +1,185 @@
+"""
+Crawl worker: fetches tax codes from the shared work queue
+
+    python worker.py --concurrency 4 --rate 1
+
+Run any number of these, on one host or many (with USE_REDIS=true they all
+use the same Redis). Each worker leases codes from the queue (work_queue.py)
+as it has free fetch slots, runs fetch_tax_info on them (result cache,
+single-flight, adaptive throttle), heartbeats its leases while the fetches
+run and writes every result back to the queue, where the job's runner picks
+it up. Codes a worker leased but never finished (it crashed or was killed)
+go to another worker once the lease expires.
+
+Every worker has its own rate budget: --rate requests per second and at most
+--concurrency requests in flight, so N workers against one upstream send up
+to N times --rate.
+
+SIGINT/SIGTERM stop leasing new codes; the codes in flight are finished and
+written back before the worker exits.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional
+
+from crawler import fetch_tax_info
+from http_client import upstream_host
+from logs import configure_logging
+from rate_limiter import DEFAULT_RATE
+from throttle import set_throttle_limits
+from work_queue import WORK_QUEUE_LEASE_SECONDS, WORK_QUEUE_POLL_INTERVAL, SQLiteWorkQueue, Task, WorkQueue, get_work_queue
+
+
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", "4"))
+
+logger = logging.getLogger(__name__)
+
+
+def _fetch(task: Task) -> Dict:
+    try:
+        return fetch_tax_info(task.tax_code, force_refresh=task.force_refresh)
+    except Exception as e:
+        return {"MST": task.tax_code, "Error": str(e)}
+
+
+class Worker:
+    """Leases tasks from a work queue and fetches them on a thread pool"""
+
+    def __init__(
+        self,
+        queue: Optional[WorkQueue] = None,
+        worker_id: Optional[str] = None,
+        concurrency: int = WORKER_CONCURRENCY,
+        lease_seconds: float = WORK_QUEUE_LEASE_SECONDS,
+        poll_interval: float = WORK_QUEUE_POLL_INTERVAL,
+        fetch: Callable[[Task], Dict] = _fetch
+    ):
+        """
+        Args:
+            queue: Work queue (defaults to the shared one)
+            worker_id: Lease owner name (defaults to host:pid:random)
+            concurrency: Tasks fetched at once
+            lease_seconds: Lease length; leases are renewed every third of it
+            poll_interval: Seconds to wait before asking an empty queue again
+            fetch: Function(task) -> result
+        """
+        self.queue = queue or get_work_queue()
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.fetch = fetch
+        self.completed = 0
+        self._stopping = threading.Event()
+        self._in_flight: Dict[Future, Task] = {}
+        self._lock = threading.Lock()
+
+    def stop(self):
+        """Stop leasing; run() returns once the tasks in flight are written back"""
+        self._stopping.set()
+
+    def _heartbeat(self, done: threading.Event):
+        while not done.wait(self.lease_seconds / 3):
+            with self._lock:
+                ids = [task.id for task in self._in_flight.values()]
+            if ids:
+                try:
+                    held = self.queue.heartbeat(self.worker_id, ids, self.lease_seconds)
+                except Exception:
+                    logger.exception("worker_heartbeat_failed", extra={"worker_id": self.worker_id})
+                    continue
+                if held < len(ids):
+                    logger.warning("worker_leases_lost", extra={"worker_id": self.worker_id,
+                                                                "lost": len(ids) - held})
+
+    def run(self, max_idle: Optional[float] = None) -> int:
+        """
+        Work until stop() is called (or the queue has been empty for `max_idle` seconds)
+
+        Returns:
+            Number of tasks completed
+        """
+        logger.info("worker_started", extra={"worker_id": self.worker_id, "concurrency": self.concurrency})
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(done,), name="worker-heartbeat", daemon=True)
+        heartbeat.start()
+        idle_since = time.monotonic()
+        try:
+            with ThreadPoolExecutor(self.concurrency, thread_name_prefix="worker-fetch") as pool:
+                while True:
+                    free = self.concurrency - len(self._in_flight)
+                    if free > 0 and not self._stopping.is_set():
+                        for task in self.queue.lease(self.worker_id, free, self.lease_seconds):
+                            with self._lock:
+                                self._in_flight[pool.submit(self.fetch, task)] = task
+
+                    if self._in_flight:
+                        finished, _ = wait(list(self._in_flight), timeout=self.poll_interval,
+                                           return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            with self._lock:
+                                task = self._in_flight.pop(future)
+                            self.queue.complete(self.worker_id, task, future.result())
+                            self.completed += 1
+                        idle_since = time.monotonic()
+                    elif self._stopping.is_set():
+                        break
+                    elif max_idle is not None and time.monotonic() - idle_since >= max_idle:
+                        break
+                    else:
+                        self._stopping.wait(self.poll_interval)
+        finally:
+            done.set()
+        logger.info("worker_stopped", extra={"worker_id": self.worker_id, "completed": self.completed})
+        return self.completed
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="tax-crawler-worker", description="Fetch tax codes from the shared work queue")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY,
+                        help="Fetches in flight at once (default: WORKER_CONCURRENCY)")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                        help="This worker's requests per second to the upstream (0: unlimited; "
+                             "default: RATE_LIMIT_PER_SECOND)")
+    parser.add_argument("--lease-seconds", type=float, default=WORK_QUEUE_LEASE_SECONDS,
+                        help="Lease length (default: WORK_QUEUE_LEASE_SECONDS)")
+    parser.add_argument("--queue", help="SQLite work queue file (default: WORK_QUEUE_PATH, or Redis with USE_REDIS)")
+    parser.add_argument("--max-idle", type=float, default=None,
+                        help="Exit after the queue has been empty for this many seconds")
+    parser.add_argument("--log-level", default="INFO", help="Log level (logs go to stderr)")
+    return parser
+
+
+def main(argv: Optional[list] = None) -> int:
+    """Entry point of the worker"""
+    args = build_parser().parse_args(argv)
+    configure_logging(level=args.log_level)
+    if args.concurrency < 1:
+        sys.stderr.write("error: --concurrency must be at least 1\n")
+        return 2
+
+    set_throttle_limits(upstream_host(), args.rate, args.concurrency)
+    worker = Worker(
+        queue=SQLiteWorkQueue(path=args.queue) if args.queue else None,
+        concurrency=args.concurrency,
+        lease_seconds=args.lease_seconds
+    )
+    removed = worker.queue.cleanup_expired()
+    if removed:
+        logger.info("work_tasks_expired", extra={"removed": removed})
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: worker.stop())
+    worker.run(max_idle=args.max_idle)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())